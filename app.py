@@ -1,12 +1,39 @@
 # =============================================================================
 #  RM Suite — Ferramentas integradas TOTVS RM
-#  Versão  : 2.1.0
+#  Versão  : 2.2.0
 #  Autor   : Claudio Ximenes  <csenemix@gmail.com>
 #  LinkedIn: https://www.linkedin.com/in/claudio-ximenes-pereira-bb090036/
 #
 # -----------------------------------------------------------------------------
 #  CHANGELOG
 # -----------------------------------------------------------------------------
+#  v2.2.0  - Desempenho: metadados do SQL Maker em cache Parquet (sem
+#             reler os XLSX a cada processo) e indexados em memória.
+#             JOINs por menor caminho no grafo de relacionamentos, com
+#             tabelas intermediárias automáticas. Imports pesados (zeep,
+#             pygwalker, plotly) carregados sob demanda; benchmark_startup.py.
+#             Pool de clientes SOAP com cache de WSDL e keep-alive HTTP.
+#             Parse do XML de retorno em blocos, direto para colunas tipadas.
+#             Cache compartilhado de resultados (TTL + LRU, spill Parquet).
+#             Busca incremental mês a mês com cache de meses fechados.
+#             DataFrame da ficha com tipos compactos (category, int8/int16).
+#             Consulta em segundo plano com progresso (MB, registros,
+#             competências) e cancelamento; a tela segue utilizável.
+#             Cubo de agregação único por filtro, compartilhado pelos gráficos.
+#             Filtros com máscaras por valor memoizadas e cache por assinatura.
+#             Comprometimento calculado uma vez por dimensão; tabela paginada.
+#             Pareto com buckets, cores e hover vetorizados.
+#             Gráficos limitados por orçamento de pontos/KB (LTTB e top-N +
+#             "Outros", mesma seleção para traces do mesmo eixo).
+#             Formatação de moeda e percentual por valor distinto.
+#             Envelopes de pagamento por índice (Nome, Mês, Período) e ZIP
+#             com todos os envelopes gerado sob demanda.
+#             Exportação de Dados Detalhados em blocos, em disco, sob demanda.
+#             PyGWalker montado só quando aberto, por filtro (DuckDB/amostra).
+#             SQL Maker: busca de campos sem acentos em CAMPOS, compilador
+#             de sentenças puro e em cache com otimização de JOINs e filtros,
+#             geração em lote sem Streamlit (sqlmaker_lote.py) e analisador
+#             T-SQL (tokenizador/parser) para as colunas e tabelas editadas.
 #  v2.1.0  - Pareto de Concentracao da Folha com buckets adaptativos,
 #             tabela de alerta com exportacao CSV e slider de faixas.
 #  v2.0.1  - Correcoes de compatibilidade Plotly (titlefont -> title=dict).
@@ -16,7 +43,7 @@
 # -----------------------------------------------------------------------------
 #
 #  DEPENDENCIAS (pip install):
-#    streamlit pygwalker pandas plotly zeep requests openpyxl
+#    streamlit pygwalker pandas plotly zeep requests openpyxl pyarrow
 # =============================================================================
 
 import streamlit as st
@@ -24,13 +51,12 @@ import pandas as pd
 from datetime import datetime
 import os
 import random
-import re
-import requests
-import xml.etree.ElementTree as ET
-import plotly.graph_objects as go
-from pygwalker.api.streamlit import StreamlitRenderer
-from zeep import Client
-from zeep.transports import Transport
+
+# plotly, zeep/requests e pygwalker são importados sob demanda dentro do
+# módulo Ficha Financeira: Home e SQL Maker não pagam esse custo de import.
+from sqlmaker_analise import AnalisadorSQL
+from sqlmaker_compilador import FUNCOES_AGREGACAO, Agregacao, CompiladorSQL, ConsultaSQL, salvar_sentenca
+from sqlmaker_metadados import IndiceMetadados, carregar_metadados
 
 # ============================================================
 # CONFIGURAÇÃO DA PÁGINA
@@ -143,14 +169,12 @@ div[data-testid="metric-container"] {
 WSDL_SUFIXO = "/wsConsultaSQL/MEX?wsdl"
 SISTEMA_WS  = "P"
 SENTENCA    = "FICHA_FINANCEIRA"
+SENTENCA_MENSAL = "FICHA_FINANCEIRA_MES"   # mesma consulta, com parâmetro MES adicional
 LINKEDIN_URL = "https://www.linkedin.com/in/claudio-ximenes-pereira-bb090036/"
 
 MESES = {1:"Jan", 2:"Fev", 3:"Mar", 4:"Abr", 5:"Mai", 6:"Jun",
          7:"Jul", 8:"Ago", 9:"Set", 10:"Out", 11:"Nov", 12:"Dez"}
 
-def fmt(valor: float) -> str:
-    return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-
 # ============================================================
 # SESSION STATE DEFAULTS
 # ============================================================
@@ -160,12 +184,17 @@ _defaults = {
     "df": pd.DataFrame(),
     "param_coligada": "1",
     "param_ano": 2024,
+    "param_mensal": False,
+    "dados_coligada": "1",
+    "dados_ano": 2024,
     "executar_consulta": False,
     "consultou": False,
     "conexao_ok": False,
     "pag_Nome": 0,
     "pag_Seção": 0,
     "pag_Função": 0,
+    "max_payload_kb": 1024,
+    "max_pontos_serie": 2000,
     "servidor_base": "http://localhost:8051",
     "rm_usuario": "mestre",
     "rm_senha": "",
@@ -290,61 +319,103 @@ if st.session_state["modulo_ativo"] == "home":
 # ██  MÓDULO: DASHBOARD FICHA FINANCEIRA
 # ============================================================
 elif st.session_state["modulo_ativo"] == "dashboard":
+    import numpy as np
+    import plotly.graph_objects as go
+    from ficha_analise import (CuboFicha, FiltroFicha, faixas_pareto, fmt, fmt_pct, fmt_serie,
+                               reduzir_figura)
+    from ficha_envelope import EnvelopesFicha
 
     # ---------- Funções do dashboard ----------
-    def buscar_dados(coligada: int, ano: int) -> pd.DataFrame:
+    def iniciar_busca(coligada: int, ano: int, mensal: bool = False) -> None:
+        """Dispara a carga em segundo plano; uma carga anterior com outros parâmetros é cancelada."""
+        from ficha_dados import iniciar_consulta
+
         wsdl_url   = st.session_state.get("wsdl_url")
         rm_usuario = st.session_state.get("rm_usuario")
         rm_senha   = st.session_state.get("rm_senha")
+        tarefa = st.session_state.get("tarefa_consulta")
+        if tarefa is not None and not tarefa.concluida:
+            if tarefa.chave == (wsdl_url, rm_usuario, coligada, ano, mensal):
+                return
+            tarefa.cancelar()
+        # Cliente SOAP, conexões HTTP e caches vêm do processo (ficha_dados)
+        st.session_state["tarefa_consulta"] = iniciar_consulta(
+            wsdl_url, rm_usuario, rm_senha, coligada, ano,
+            SENTENCA_MENSAL if mensal else SENTENCA, SISTEMA_WS, mensal)
+
+    def concluir_busca(tarefa) -> None:
+        """Copia o resultado de uma carga terminada para a sessão."""
+        from ficha_dados import ConsultaCancelada
+
+        st.session_state.pop("tarefa_consulta", None)
         try:
-            session = requests.Session()
-            session.auth = (rm_usuario, rm_senha)
-            transport = Transport(session=session)
-            client = Client(wsdl_url, transport=transport)
-            service = client.bind("wsConsultaSQL", "RM_IwsConsultaSQL")
-            parameters = f"CODCOLIGADA={coligada};ANO={ano}"
-            resultado = service.RealizarConsultaSQL(
-                codSentenca=SENTENCA, codColigada=0,
-                codSistema=SISTEMA_WS, parameters=parameters
-            )
-            root = ET.fromstring(resultado)
-            registros = []
-            for item in root.findall("Resultado"):
-                registros.append({
-                    "Coligada":    item.findtext("CODCOLIGADA"),
-                    "Empresa":     item.findtext("NOMEFANTASIA"),
-                    "Nome":        item.findtext("NOME"),
-                    "Função":      item.findtext("FUNCAO"),
-                    "Seção":       item.findtext("SECAO"),
-                    "Tipo Evento": item.findtext("TIPO_EVENTO"),
-                    "Evento":      item.findtext("EVENTO"),
-                    "Período":     item.findtext("NROPERIODO"),
-                    "Mês":         int(item.findtext("MESCOMP") or 0),
-                    "Ano":         int(item.findtext("ANOCOMP") or 0),
-                    "Valor":       float(item.findtext("VALOR") or 0),
-                    "Liquido":     float(item.findtext("VLR_PROV_DESC") or 0)
-                })
-            return pd.DataFrame(registros)
+            df, estatisticas = tarefa.resultado()
+        except ConsultaCancelada:
+            st.toast("Consulta cancelada.")
+            return
         except Exception as e:
             st.error(f"Erro ao buscar dados: {e}")
-            return pd.DataFrame()
+            df, estatisticas = pd.DataFrame(), None
+        _, _, coligada, ano, _ = tarefa.chave
+        st.session_state["df"] = df
+        # Versão dos dados da sessão: chave dos caches que dependem do df carregado
+        st.session_state["versao_dados"] = st.session_state.get("versao_dados", 0) + 1
+        st.session_state["estatisticas_parse"] = estatisticas
+        st.session_state["dados_coligada"] = coligada
+        st.session_state["dados_ano"] = ano
+        st.session_state["consultou"] = True
 
-    def grafico_proventos_descontos_saldo(df: pd.DataFrame):
-        grp = df.groupby(["Ano", "Mês", "Tipo Evento"])["Valor"].sum().reset_index()
-        grp["Período"] = grp["Mês"].astype(str).str.zfill(2) + "/" + grp["Ano"].astype(str)
-        pivot = grp.pivot_table(index="Período", columns="Tipo Evento", values="Valor", aggfunc="sum").fillna(0).reset_index()
+    @st.fragment(run_every=0.5)
+    def acompanhar_busca():
+        """Progresso da carga em andamento; reexecuta só este trecho até ela terminar."""
+        tarefa = st.session_state.get("tarefa_consulta")
+        if tarefa is None:
+            return
+        if tarefa.concluida:
+            st.rerun()
+        p = tarefa.progresso
+        _, _, coligada, ano, _ = tarefa.chave
+        col_info, col_cancelar = st.columns([5, 1])
+        with col_info:
+            texto = (f"⏳ Coligada {coligada} / {ano} — {p.fase}: {p.bytes/1e6:,.1f} MB recebidos, "
+                     f"{p.linhas:,} registros lidos ({tarefa.segundos:.0f}s)")
+            if p.particoes_total:
+                st.progress(p.particoes / p.particoes_total,
+                            text=f"{texto} · {p.particoes}/{p.particoes_total} competências")
+            else:
+                st.info(texto)
+        with col_cancelar:
+            if st.button("✖ Cancelar", key="cancelar_consulta", use_container_width=True):
+                tarefa.cancelar()
+
+    def preparar_grafico(fig: go.Figure) -> tuple[go.Figure, int, int]:
+        """reduzir_figura com o orçamento da sessão (max_payload_kb, max_pontos_serie)."""
+        return reduzir_figura(fig, int(st.session_state["max_payload_kb"]) * 1024,
+                              int(st.session_state["max_pontos_serie"]))
+
+    def exibir_grafico(fig: go.Figure) -> None:
+        """st.plotly_chart com redução de pontos e relatório dos bytes economizados."""
+        fig, antes, depois = preparar_grafico(fig)
+        st.plotly_chart(fig, use_container_width=True)
+        if depois < antes:
+            st.caption(f"📉 Gráfico reduzido para caber no orçamento: ~{antes/1024:,.0f} KB → "
+                       f"~{depois/1024:,.0f} KB ({(antes - depois)/1024:,.0f} KB economizados).")
+
+    def grafico_proventos_descontos_saldo(cubo: CuboFicha):
+        pivot = cubo.saldo_periodo().copy()
+        pivot["Período"] = pivot["Mês"].astype(str).str.zfill(2) + "/" + pivot["Ano"].astype(str)
         pivot = pivot.sort_values("Período")
-        provento = pivot.get("Provento", pd.Series([0]*len(pivot)))
-        desconto = pivot.get("Desconto", pd.Series([0]*len(pivot)))
-        saldo    = provento - desconto
+        provento = pivot["Provento"]
+        desconto = pivot["Desconto"]
+        saldo    = pivot["Saldo"]
         fig = go.Figure()
         fig.add_trace(go.Bar(x=pivot["Período"], y=provento, name="Proventos", marker_color="#2ecc71",
-            text=provento.apply(fmt), textposition="inside"))
+            text=fmt_serie(provento), textposition="inside"))
         fig.add_trace(go.Bar(x=pivot["Período"], y=desconto, name="Descontos", marker_color="#e74c3c",
-            text=desconto.apply(fmt), textposition="inside"))
+            text=fmt_serie(desconto), textposition="inside"))
         fig.add_trace(go.Scatter(x=pivot["Período"], y=saldo, name="Saldo Líquido",
             mode="lines+markers+text", line=dict(color="#f39c12", width=3), marker=dict(size=8),
-            text=saldo.apply(fmt), textposition="top center", textfont=dict(color="#f39c12", size=11)))
+            text=fmt_serie(saldo), textposition="top center", textfont=dict(color="#f39c12", size=11)))
         fig.update_layout(barmode="stack", title="📊 Proventos x Descontos por Período + Saldo Líquido",
             xaxis_title="Período", yaxis_title="Valor (R$)", height=450,
             legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
@@ -352,24 +423,21 @@ elif st.session_state["modulo_ativo"] == "dashboard":
             xaxis=dict(gridcolor="rgba(255,255,255,0.1)"), yaxis=dict(gridcolor="rgba(255,255,255,0.1)"))
         return fig
 
-    def grafico_ranking_eventos(df: pd.DataFrame):
-        grp = df.groupby(["Evento", "Tipo Evento"])["Valor"].sum().reset_index()
+    def grafico_ranking_eventos(cubo: CuboFicha):
+        grp = cubo.somar(["Evento", "Tipo Evento"]).reset_index()
         grp = grp.sort_values("Valor", ascending=True).tail(10)
-        colors = grp["Tipo Evento"].map({"Provento": "#2ecc71", "Desconto": "#e74c3c"}).fillna("#95a5a6")
+        colors = grp["Tipo Evento"].astype(str).map({"Provento": "#2ecc71", "Desconto": "#e74c3c"}).fillna("#95a5a6")
         fig = go.Figure(go.Bar(x=grp["Valor"], y=grp["Evento"], orientation="h",
-            marker_color=colors, text=grp["Valor"].apply(fmt), textposition="outside"))
+            marker_color=colors, text=fmt_serie(grp["Valor"]), textposition="outside"))
         fig.update_layout(title="🏆 Top 10 Eventos por Valor Total", xaxis_title="Valor Total (R$)",
             yaxis_title="", height=400, plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)",
             font=dict(color="white"), xaxis=dict(gridcolor="rgba(255,255,255,0.1)"),
             yaxis=dict(gridcolor="rgba(255,255,255,0.1)"))
         return fig
 
-    def grafico_evolucao_saldo(df: pd.DataFrame):
-        grp = df.groupby(["Ano", "Mês", "Tipo Evento"])["Valor"].sum().reset_index()
-        pivot = grp.pivot_table(index=["Ano", "Mês"], columns="Tipo Evento", values="Valor", aggfunc="sum").fillna(0).reset_index()
+    def grafico_evolucao_saldo(cubo: CuboFicha):
+        pivot = cubo.saldo_periodo().copy()
         pivot["Período"] = pivot["Mês"].astype(str).str.zfill(2) + "/" + pivot["Ano"].astype(str)
-        pivot = pivot.sort_values(["Ano", "Mês"])
-        pivot["Saldo"] = pivot.get("Provento", 0) - pivot.get("Desconto", 0)
         fig = go.Figure()
         fig.add_trace(go.Scatter(x=pivot["Período"], y=pivot["Saldo"], mode="lines+markers",
             fill="tozeroy", line=dict(color="#f39c12", width=2), marker=dict(size=6),
@@ -380,31 +448,31 @@ elif st.session_state["modulo_ativo"] == "dashboard":
             xaxis=dict(gridcolor="rgba(255,255,255,0.1)"), yaxis=dict(gridcolor="rgba(255,255,255,0.1)"))
         return fig
 
-    def grafico_gastos_funcao(df: pd.DataFrame, coluna: str = "Valor"):
-        grp = df.groupby("Função")[coluna].sum().reset_index()
+    def grafico_gastos_funcao(cubo: CuboFicha, coluna: str = "Valor"):
+        grp = cubo.somar("Função", coluna).reset_index()
         grp = grp.sort_values(coluna, ascending=True).tail(10)
         label = "Valor Líquido (R$)" if coluna == "Liquido" else "Valor Total (R$)"
         fig = go.Figure(go.Bar(x=grp[coluna], y=grp["Função"], orientation="h",
-            marker_color="#3498db", text=grp[coluna].apply(fmt), textposition="outside"))
+            marker_color="#3498db", text=fmt_serie(grp[coluna]), textposition="outside"))
         fig.update_layout(title="👔 Gastos por Função (Top 10)", xaxis_title=label,
             yaxis_title="", height=400, plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)",
             font=dict(color="white"), xaxis=dict(gridcolor="rgba(255,255,255,0.1)"),
             yaxis=dict(gridcolor="rgba(255,255,255,0.1)"))
         return fig
 
-    def grafico_gastos_secao(df: pd.DataFrame, coluna: str = "Valor"):
-        grp = df.groupby("Seção")[coluna].sum().reset_index()
+    def grafico_gastos_secao(cubo: CuboFicha, coluna: str = "Valor"):
+        grp = cubo.somar("Seção", coluna).reset_index()
         grp = grp.sort_values(coluna, ascending=True).tail(10)
         label = "Valor Líquido (R$)" if coluna == "Liquido" else "Valor Total (R$)"
         fig = go.Figure(go.Bar(x=grp[coluna], y=grp["Seção"], orientation="h",
-            marker_color="#9b59b6", text=grp[coluna].apply(fmt), textposition="outside"))
+            marker_color="#9b59b6", text=fmt_serie(grp[coluna]), textposition="outside"))
         fig.update_layout(title="🏢 Gastos por Seção (Top 10)", xaxis_title=label,
             yaxis_title="", height=400, plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)",
             font=dict(color="white"), xaxis=dict(gridcolor="rgba(255,255,255,0.1)"),
             yaxis=dict(gridcolor="rgba(255,255,255,0.1)"))
         return fig
 
-    def grafico_pareto_folha(df: pd.DataFrame, limiar_pareto: float = 80.0, n_buckets: int = 20,
+    def grafico_pareto_folha(cubo: CuboFicha, limiar_pareto: float = 80.0, n_buckets: int = 20,
                              tipo_valor: str = "Provento", agrupamento: str = "Funcionário"):
         """Pareto de concentração da folha com agrupamento em buckets para grandes quadros."""
 
@@ -412,85 +480,53 @@ elif st.session_state["modulo_ativo"] == "dashboard":
         col_grupo = {"Funcionário": "Nome", "Seção": "Seção", "Função": "Função"}[agrupamento]
         label_valor = {"Provento": "Proventos", "Desconto": "Descontos", "Base (Líquido)": "Base Líquida"}[tipo_valor]
 
-        if tipo_valor == "Base (Líquido)":
-            prov = df[df["Tipo Evento"] == "Provento"].groupby(col_grupo)["Valor"].sum()
-            desc = df[df["Tipo Evento"] == "Desconto"].groupby(col_grupo)["Valor"].sum()
-            grp_val = (prov.subtract(desc, fill_value=0)).reset_index()
-            grp_val.columns = [col_grupo, "Valor"]
-        else:
-            grp_val = df[df["Tipo Evento"] == tipo_valor].groupby(col_grupo)["Valor"].sum().reset_index()
-
-        grp = grp_val[grp_val["Valor"] > 0].sort_values("Valor", ascending=False).reset_index(drop=True)
+        # Ranking memoizado no cubo: mover os sliders de limiar/faixas não reordena os grupos
+        grp = cubo.pareto(col_grupo, None if tipo_valor == "Base (Líquido)" else tipo_valor)
 
         if grp.empty:
             return go.Figure().update_layout(
                 title="📊 Sem dados para exibir",
                 paper_bgcolor="rgba(0,0,0,0)", font=dict(color="white")), 0, 0, 0, pd.DataFrame()
 
-        total      = grp["Valor"].sum()
-        n_total    = len(grp)
-        grp["% Acumulado"] = (grp["Valor"].cumsum() / total * 100).round(2)
-        grp["Rank"] = range(1, n_total + 1)
+        n_total = len(grp)
+        pct_acum = grp["% Acumulado"].to_numpy()
 
-        # Corte no limiar
-        idx_corte     = grp[grp["% Acumulado"] >= limiar_pareto].index[0]
+        # Corte no limiar: primeira posição cujo % acumulado atinge o limiar
+        idx_corte     = min(int(np.searchsorted(pct_acum, limiar_pareto)), n_total - 1)
         n_func_limiar = idx_corte + 1
         pct_func      = round(n_func_limiar / n_total * 100, 1)
 
         # Tabela de alerta
         df_alerta = grp.iloc[:n_func_limiar][["Rank", col_grupo, "Valor", "% Acumulado"]].copy()
-        df_alerta["Valor"] = df_alerta["Valor"].apply(fmt)
-        df_alerta["% Acumulado"] = df_alerta["% Acumulado"].apply(lambda v: f"{v:.1f}%")
+        df_alerta["Valor"] = fmt_serie(df_alerta["Valor"])
+        df_alerta["% Acumulado"] = fmt_pct(df_alerta["% Acumulado"])
         df_alerta = df_alerta.rename(columns={"Rank": "#", col_grupo: agrupamento, "Valor": label_valor, "% Acumulado": "% Acum."})
 
         # ── Agrupamento em buckets ──────────────────────────────────────────
         usar_buckets = n_total > 40
         if usar_buckets:
-            tamanho_bucket = max(1, n_total // n_buckets)
-            buckets = []
-            for i in range(0, n_total, tamanho_bucket):
-                fatia = grp.iloc[i:i+tamanho_bucket]
-                rank_ini = fatia["Rank"].iloc[0]
-                rank_fim = fatia["Rank"].iloc[-1]
-                label    = f"{rank_ini}–{rank_fim}"
-                valor_bk = fatia["Valor"].sum()
-                pct_bk   = fatia["% Acumulado"].iloc[-1]
-                n_bk     = len(fatia)
-                no_alerta = fatia["Rank"].iloc[-1] <= n_func_limiar
-                parcial   = fatia["Rank"].iloc[0] <= n_func_limiar < fatia["Rank"].iloc[-1]
-                buckets.append({
-                    "label": label, "Valor": valor_bk,
-                    "% Acumulado": pct_bk, "n": n_bk,
-                    "alerta": no_alerta, "parcial": parcial,
-                    "rank_ini": rank_ini, "rank_fim": rank_fim
-                })
-            df_plot = pd.DataFrame(buckets)
+            df_plot = faixas_pareto(grp, n_buckets, n_func_limiar)
             x_vals  = df_plot["label"]
             y_vals  = df_plot["Valor"]
             y2_vals = df_plot["% Acumulado"]
-            cores   = ["#f39c12" if r["alerta"] else ("#f39c12" if r["parcial"] else "#2d2d44")
-                       for _, r in df_plot.iterrows()]
-            hover   = [
-                f"<b>Grupo {r['label']}</b><br>"
-                f"{agrupamento}s: {r['n']}<br>"
-                f"Total {label_valor}: {fmt(r['Valor'])}<br>"
-                f"% Acumulado: {r['% Acumulado']:.1f}%<extra></extra>"
-                for _, r in df_plot.iterrows()
-            ]
-            bucket_corte = df_plot[df_plot["% Acumulado"] >= limiar_pareto].index[0]
-            x_vline = df_plot.loc[bucket_corte, "label"]
+            cores   = np.where(df_plot["alerta"] | df_plot["parcial"], "#f39c12", "#2d2d44")
+            hover   = ("<b>Grupo " + df_plot["label"] + "</b><br>"
+                       + f"{agrupamento}s: " + df_plot["n"].astype(str) + "<br>"
+                       + f"Total {label_valor}: " + fmt_serie(df_plot["Valor"]) + "<br>"
+                       + "% Acumulado: " + fmt_pct(df_plot["% Acumulado"])
+                       + "<extra></extra>").to_numpy()
+            bucket_corte = min(int(np.searchsorted(y2_vals.to_numpy(), limiar_pareto)), len(df_plot) - 1)
         else:
             df_plot = grp
             x_vals  = grp["Rank"]
             y_vals  = grp["Valor"]
             y2_vals = grp["% Acumulado"]
-            cores   = ["#f39c12" if i <= idx_corte else "#2d2d44" for i in grp.index]
-            hover   = [
-                f"<b>{r[col_grupo]}</b><br>Rank: {r['Rank']}º<br>"
-                f"{label_valor}: {fmt(r['Valor'])}<br>"
-                f"% Acumulado: {r['% Acumulado']:.1f}%<extra></extra>"
-                for _, r in grp.iterrows()
-            ]
+            cores   = np.where(np.arange(n_total) <= idx_corte, "#f39c12", "#2d2d44")
+            hover   = ("<b>" + grp[col_grupo].astype(str) + "</b><br>Rank: "
+                       + grp["Rank"].astype(str) + "º<br>"
+                       + f"{label_valor}: " + fmt_serie(grp["Valor"]) + "<br>"
+                       + "% Acumulado: " + fmt_pct(grp["% Acumulado"])
+                       + "<extra></extra>").to_numpy()
             x_vline = n_func_limiar
 
         # ── Figura ──────────────────────────────────────────────────────────
@@ -505,12 +541,10 @@ elif st.session_state["modulo_ativo"] == "dashboard":
             showlegend=True
         ))
 
-        _n   = len(list(y2_vals))
+        _n   = len(y2_vals)
         _passo = max(1, _n // 8)
-        _textos = [
-            f"{v:.0f}%" if (i % _passo == 0 or i == _n - 1) else ""
-            for i, v in enumerate(y2_vals)
-        ]
+        _pos   = np.arange(_n)
+        _textos = np.where((_pos % _passo == 0) | (_pos == _n - 1), fmt_pct(y2_vals, 0), "")
 
         fig.add_trace(go.Scatter(
             x=x_vals, y=y2_vals,
@@ -578,18 +612,10 @@ elif st.session_state["modulo_ativo"] == "dashboard":
         )
         return fig, n_func_limiar, pct_func, n_total, df_alerta
 
-    def grafico_comprometimento(df: pd.DataFrame, limiar: float, agrupamento: str):
+    def grafico_comprometimento(grp: pd.DataFrame, limiar: float, agrupamento: str):
+        """Barras de uma fatia de CuboFicha.comprometimento (já ordenada)."""
         col = agrupamento
-        prov = df[df["Tipo Evento"] == "Provento"].groupby(col)["Valor"].sum().rename("Proventos")
-        desc = df[df["Tipo Evento"] == "Desconto"].groupby(col)["Valor"].sum().rename("Descontos")
-        grp  = pd.concat([prov, desc], axis=1).fillna(0).reset_index()
-        grp  = grp[grp["Proventos"] > 0].copy()
-        grp["Índice (%)"] = (grp["Descontos"] / grp["Proventos"] * 100).round(1)
-        grp = grp.sort_values("Índice (%)", ascending=False)
         if col == "Nome":
-            info = df[["Nome", "Seção", "Função"]].drop_duplicates("Nome").set_index("Nome")
-            grp["Seção"]  = grp["Nome"].map(info["Seção"]).fillna("-")
-            grp["Função"] = grp["Nome"].map(info["Função"]).fillna("-")
             customdata = grp[["Proventos", "Descontos", "Seção", "Função"]].values
             hovertemplate = (
                 "<b>%{y}</b><br>Seção: %{customdata[2]}<br>Função: %{customdata[3]}<br>"
@@ -604,7 +630,7 @@ elif st.session_state["modulo_ativo"] == "dashboard":
                 "Descontos: R$ %{customdata[1]:,.2f}<extra></extra>"
             )
         colors = ["#e74c3c" if v >= limiar else "#2ecc71" for v in grp["Índice (%)"]]
-        texto  = grp["Índice (%)"].apply(lambda v: f"{v:.1f}%")
+        texto  = fmt_pct(grp["Índice (%)"])
         fig = go.Figure(go.Bar(
             x=grp["Índice (%)"], y=grp[col], orientation="h",
             marker_color=colors, text=texto, textposition="outside",
@@ -620,7 +646,101 @@ elif st.session_state["modulo_ativo"] == "dashboard":
             paper_bgcolor="rgba(0,0,0,0)", font=dict(color="white"),
             xaxis=dict(gridcolor="rgba(255,255,255,0.1)", ticksuffix="%"),
             yaxis=dict(gridcolor="rgba(255,255,255,0.1)", autorange="reversed"))
-        return fig, alertas, grp
+        return fig
+
+    def renderizador_pygwalker(df_ordenado: pd.DataFrame, chave_filtro: tuple, modo: str, limite: int):
+        """StreamlitRenderer da sessão, recriado só quando o filtro, o modo ou o limite mudam."""
+        chave = (chave_filtro, modo, limite if modo == "Amostra" else None)
+        atual = st.session_state.get("pyg_renderer")
+        if atual is not None and st.session_state.get("pyg_chave") == chave:
+            return atual
+        from pygwalker.api.streamlit import StreamlitRenderer
+
+        dados = df_ordenado
+        if modo == "Amostra" and len(dados) > limite:
+            dados = dados.sample(n=limite, random_state=0).sort_index()
+        if modo == "Servidor (DuckDB)":
+            try:
+                renderer = StreamlitRenderer(dados, kernel_computation=True)
+            except TypeError:   # pygwalker < 0.4.7
+                renderer = StreamlitRenderer(dados, use_kernel_calc=True)
+        else:
+            renderer = StreamlitRenderer(dados)
+        st.session_state["pyg_renderer"] = renderer
+        st.session_state["pyg_chave"] = chave
+        return renderer
+
+    def oferecer_arquivo(caminho: str, rotulo: str, nome_arquivo: str, mime: str):
+        """Botão de download de um arquivo recém-gerado, que é apagado em seguida.
+
+        Limite: o download_button lê o arquivo inteiro para a memória do
+        servidor ao ser montado, e o Streamlit o entrega a partir dessa cópia,
+        não do disco. A geração em blocos só evita montar o arquivo em memória
+        durante a escrita. Por isso o botão só aparece na execução do clique em
+        gerar (não a cada rerun), e o temporário sai do disco logo depois.
+        """
+        try:
+            with open(caminho, "rb") as arquivo:
+                st.download_button(rotulo, data=arquivo, file_name=nome_arquivo, mime=mime)
+        finally:
+            os.remove(caminho)
+        st.caption("O botão vale até a próxima interação; para baixar de novo, gere o arquivo outra vez.")
+
+    @st.fragment
+    def painel_comprometimento(cubo: CuboFicha, limiar_pct: float):
+        """Aba e página selecionadas; trocar de aba ou de página reexecuta só este trecho."""
+        POR_PAGINA = 20
+        abas = {"👤 Por Funcionário": "Nome", "🏢 Por Seção": "Seção", "👔 Por Função": "Função"}
+        aba = st.radio("Agrupamento", options=list(abas), horizontal=True,
+                       key="aba_comprometimento", label_visibility="collapsed")
+        agrup = abas[aba]
+
+        # Tabela do agrupamento calculada uma vez por estado de filtro (memoizada no cubo)
+        df_comp = cubo.comprometimento(agrup)
+        qtd_alertas = int((df_comp["Índice (%)"] >= limiar_pct).sum())
+        if qtd_alertas > 0:
+            st.warning(f"⚠️ **{qtd_alertas}** {agrup.lower()}(s) com índice acima de **{limiar_pct}%**")
+        else:
+            st.success(f"✅ Nenhum(a) {agrup.lower()} acima do limiar de **{limiar_pct}%**")
+
+        total     = len(df_comp)
+        total_pag = max(1, -(-total // POR_PAGINA))
+        pag_key   = f"pag_{agrup}"
+        pag_atual = min(st.session_state.get(pag_key, 0), total_pag - 1)
+        inicio = pag_atual * POR_PAGINA
+        fim    = inicio + POR_PAGINA
+        df_pag = df_comp.iloc[inicio:fim]
+
+        fig_pag = grafico_comprometimento(df_pag, limiar_pct, agrup)
+        fig_pag.update_layout(title=f"🚨 Comprometimento por {agrup} — Pág. {pag_atual+1}/{total_pag} ({total} registros)")
+        exibir_grafico(fig_pag)
+
+        col_prev, *cols_num, col_next = st.columns([1] + [1]*min(total_pag, 10) + [1])
+        with col_prev:
+            if st.button("◀", key=f"prev_{agrup}", disabled=pag_atual == 0):
+                st.session_state[pag_key] = pag_atual - 1
+                st.rerun(scope="fragment")
+        for i, col in enumerate(cols_num):
+            pag_i = i if total_pag <= 10 else round(i * (total_pag - 1) / max(len(cols_num)-1, 1))
+            label = f"**{pag_i+1}**" if pag_i == pag_atual else str(pag_i+1)
+            with col:
+                if st.button(label, key=f"pag_{agrup}_{i}"):
+                    st.session_state[pag_key] = pag_i
+                    st.rerun(scope="fragment")
+        with col_next:
+            if st.button("▶", key=f"next_{agrup}", disabled=pag_atual >= total_pag - 1):
+                st.session_state[pag_key] = pag_atual + 1
+                st.rerun(scope="fragment")
+        st.caption(f"Exibindo {inicio+1}–{min(fim, total)} de **{total}** registros")
+
+        df_alerta = df_comp[df_comp["Índice (%)"] >= limiar_pct]
+        if not df_alerta.empty:
+            with st.expander(f"📋 Ver detalhes dos {agrup.lower()}(s) em alerta"):
+                df_alerta_fmt = df_alerta[[agrup, "Proventos", "Descontos", "Índice (%)"]].copy()
+                df_alerta_fmt["Proventos"]  = fmt_serie(df_alerta_fmt["Proventos"])
+                df_alerta_fmt["Descontos"]  = fmt_serie(df_alerta_fmt["Descontos"])
+                df_alerta_fmt["Índice (%)"] = fmt_pct(df_alerta_fmt["Índice (%)"])
+                st.dataframe(df_alerta_fmt.reset_index(drop=True), use_container_width=True)
 
     # ---------- Layout do Dashboard ----------
     st.title("📊 Ficha Financeira — RM TOTVS")
@@ -669,7 +789,7 @@ elif st.session_state["modulo_ativo"] == "dashboard":
 
     st.subheader("🔍 Parâmetros da Consulta")
     with st.form("form_consulta_dash"):
-        col1, col2, col3 = st.columns([1, 1, 2])
+        col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
         with col1:
             coligada_input = st.text_input("Coligada", value="1")
         with col2:
@@ -677,23 +797,49 @@ elif st.session_state["modulo_ativo"] == "dashboard":
         with col3:
             st.markdown("<br>", unsafe_allow_html=True)
             consultar = st.form_submit_button("🔎 Consultar", use_container_width=True)
-
-    if consultar:
+        with col4:
+            st.markdown("<br>", unsafe_allow_html=True)
+            invalidar = st.form_submit_button("♻️ Invalidar cache", use_container_width=True,
+                help="Descarta o resultado em cache desta Coligada/Ano (inclusive os meses "
+                     "fechados) e consulta o RM novamente")
+        mensal_input = st.checkbox("📆 Busca incremental mês a mês",
+            value=st.session_state.get("param_mensal", False),
+            help=f"Consulta cada competência separadamente pela sentença {SENTENCA_MENSAL} "
+                 "(parâmetros CODCOLIGADA, ANO e MES). Meses fechados ficam em cache; "
+                 "só o mês corrente é consultado novamente.")
+
+    if consultar or invalidar:
         if not coligada_input.strip().isdigit():
             st.error("Coligada deve ser um número válido.")
             st.stop()
+        if invalidar:
+            wsdl_url = st.session_state.get("wsdl_url")
+            if not wsdl_url:
+                st.error("⚠️ Configure a conexão antes de invalidar o cache.")
+                st.stop()
+            from ficha_dados import cache_particoes, cache_resultados
+            cache_resultados.invalidar(wsdl_url, int(coligada_input), int(ano_input))
+            cache_particoes.invalidar(wsdl_url, int(coligada_input), int(ano_input))
+            tarefa = st.session_state.pop("tarefa_consulta", None)
+            if tarefa is not None:
+                tarefa.cancelar()
         st.session_state["param_coligada"] = coligada_input
         st.session_state["param_ano"] = ano_input
+        st.session_state["param_mensal"] = mensal_input
         st.session_state["executar_consulta"] = True
 
     if st.session_state.get("executar_consulta"):
         st.session_state["executar_consulta"] = False
-        with st.spinner(f"Buscando dados..."):
-            st.session_state["df"] = buscar_dados(
-                int(st.session_state["param_coligada"]),
-                int(st.session_state["param_ano"])
-            )
-        st.session_state["consultou"] = True
+        iniciar_busca(int(st.session_state["param_coligada"]),
+                      int(st.session_state["param_ano"]),
+                      st.session_state.get("param_mensal", False))
+
+    # A carga roda em segundo plano: enquanto isso, os dados anteriores seguem navegáveis
+    _tarefa = st.session_state.get("tarefa_consulta")
+    if _tarefa is not None and _tarefa.concluida:
+        concluir_busca(_tarefa)
+    elif _tarefa is not None:
+        acompanhar_busca()
 
     df: pd.DataFrame = st.session_state.get("df", pd.DataFrame())
 
@@ -702,7 +848,7 @@ elif st.session_state["modulo_ativo"] == "dashboard":
         st.stop()
 
     if df.empty or "Ano" not in df.columns:
-        st.warning(f"⚠️ Dados não encontrados para Coligada **{st.session_state['param_coligada']}** / Ano **{st.session_state['param_ano']}**.")
+        st.warning(f"⚠️ Dados não encontrados para Coligada **{st.session_state['dados_coligada']}** / Ano **{st.session_state['dados_ano']}**.")
         st.stop()
 
     colunas_esperadas = ["Ano", "Mês", "Nome", "Tipo Evento", "Evento", "Valor", "Empresa"]
@@ -711,47 +857,68 @@ elif st.session_state["modulo_ativo"] == "dashboard":
         st.error(f"Colunas não encontradas: {colunas_faltando}")
         st.stop()
 
-    st.success(f"✅ Coligada **{st.session_state['param_coligada']}** | Ano **{st.session_state['param_ano']}** | **{len(df):,}** registros carregados.")
+    st.success(f"✅ Coligada **{st.session_state['dados_coligada']}** | Ano **{st.session_state['dados_ano']}** | **{len(df):,}** registros carregados.")
+    _est = st.session_state.get("estatisticas_parse")
+    if _est and "particoes" in _est:
+        st.caption(f"📆 {_est['particoes']} competência(s) carregadas, "
+                   f"{_est['particoes_rm']} consultada(s) no RM e as demais do cache de meses fechados.")
+    elif _est and _est.get("cache"):
+        st.caption("⚡ Dados servidos do cache compartilhado (use **Invalidar cache** para buscar novamente no RM).")
+    elif _est:
+        st.caption(f"⏱️ XML de {_est['bytes']/1e6:.1f} MB processado em {_est['segundos']:.2f}s "
+                   f"({_est['linhas_s']:,.0f} linhas/s)")
     st.markdown("---")
 
     # Filtros
+    # Motor de filtros do DataFrame carregado: índices por valor e resultados em cache
+    filtro = st.session_state.get("filtro_ficha")
+    if filtro is None or filtro.df is not df:
+        filtro = FiltroFicha(df)
+        st.session_state["filtro_ficha"] = filtro
+
     st.subheader("🔎 Filtros")
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        anos = st.multiselect("Ano", sorted(df["Ano"].unique()), default=sorted(df["Ano"].unique()))
+        anos_disponiveis = filtro.valores("Ano")
+        anos = st.multiselect("Ano", anos_disponiveis, default=anos_disponiveis)
     with col2:
-        tipos = st.multiselect("Tipo de Evento", df["Tipo Evento"].unique(), default=df["Tipo Evento"].unique())
+        tipos_disponiveis = filtro.valores("Tipo Evento", ordenar=False)
+        tipos = st.multiselect("Tipo de Evento", tipos_disponiveis, default=tipos_disponiveis)
     with col3:
-        periodos_disponiveis = sorted(df["Período"].dropna().unique().tolist())
+        periodos_disponiveis = filtro.valores("Período")
         periodos_sel = st.multiselect("Período", periodos_disponiveis, default=periodos_disponiveis)
     with col4:
-        lista_funcionarios = ["Todos"] + sorted(df["Nome"].unique().tolist())
+        lista_funcionarios = ["Todos"] + filtro.valores("Nome")
         funcionario_sel = st.selectbox("👤 Funcionário", lista_funcionarios)
 
-    mes_min = int(df["Mês"].min())
-    mes_max = int(df["Mês"].max())
+    meses_disponiveis = filtro.valores("Mês")
+    mes_min = int(meses_disponiveis[0])
+    mes_max = int(meses_disponiveis[-1])
     mes_inicio, mes_fim = st.slider("📅 Intervalo de Mês", min_value=mes_min, max_value=mes_max,
         value=(mes_min, mes_max), format="%d")
     st.caption(f"Filtrando de **{MESES[mes_inicio]}** até **{MESES[mes_fim]}**")
 
-    nomes_filtro = df["Nome"].unique() if funcionario_sel == "Todos" else [funcionario_sel]
-    df_filtrado = df[
-        df["Ano"].isin(anos) &
-        df["Tipo Evento"].isin(tipos) &
-        df["Período"].isin(periodos_sel) &
-        df["Nome"].isin(nomes_filtro) &
-        df["Mês"].between(mes_inicio, mes_fim)
-    ]
+    filtros = {
+        "Ano": anos,
+        "Tipo Evento": tipos,
+        "Período": periodos_sel,
+        "Mês": [m for m in meses_disponiveis if mes_inicio <= m <= mes_fim],
+    }
+    if funcionario_sel != "Todos":
+        filtros["Nome"] = [funcionario_sel]
+    # Mesma assinatura de filtro = mesmo df_filtrado e mesmo cubo (um groupby por estado)
+    df_filtrado, assinatura_filtro = filtro.filtrar(filtros)
+    cubo = filtro.cubo(assinatura_filtro)
 
     st.markdown("---")
 
     # Métricas
     st.subheader("📈 Resumo")
     col1, col2, col3, col4 = st.columns(4)
-    total_proventos = df_filtrado[df_filtrado["Tipo Evento"] == "Provento"]["Valor"].sum()
-    total_descontos = df_filtrado[df_filtrado["Tipo Evento"] == "Desconto"]["Valor"].sum()
+    total_proventos = cubo.total(tipo="Provento")
+    total_descontos = cubo.total(tipo="Desconto")
     saldo           = total_proventos - total_descontos
-    col1.metric("Total de Registros", len(df_filtrado))
+    col1.metric("Total de Registros", cubo.registros)
     col2.metric("Total Proventos",    fmt(total_proventos))
     col3.metric("Total Descontos",    fmt(total_descontos))
     col4.metric("Saldo Líquido",      fmt(saldo))
@@ -759,12 +926,21 @@ elif st.session_state["modulo_ativo"] == "dashboard":
     st.markdown("---")
 
     # Gráficos
-    st.plotly_chart(grafico_proventos_descontos_saldo(df_filtrado), use_container_width=True)
+    with st.expander("⚙️ Desempenho dos gráficos"):
+        col_kb, col_pts = st.columns(2)
+        col_kb.number_input("Tamanho máximo por gráfico (KB)", min_value=64, max_value=16384,
+            step=64, key="max_payload_kb",
+            help="Gráficos maiores que isso têm as séries reduzidas antes de ir ao navegador.")
+        col_pts.number_input("Máximo de pontos por série", min_value=50, max_value=50000,
+            step=50, key="max_pontos_serie",
+            help="Linhas são reduzidas por LTTB; barras mantêm as maiores e somam o resto em \"Outros\".")
+
+    exibir_grafico(grafico_proventos_descontos_saldo(cubo))
     col1, col2 = st.columns(2)
     with col1:
-        st.plotly_chart(grafico_evolucao_saldo(df_filtrado), use_container_width=True)
+        exibir_grafico(grafico_evolucao_saldo(cubo))
     with col2:
-        st.plotly_chart(grafico_ranking_eventos(df_filtrado), use_container_width=True)
+        exibir_grafico(grafico_ranking_eventos(cubo))
 
     tipo_valor = st.radio("💰 Tipo de Valor — Gastos por Função e Seção",
         options=["Valor Bruto", "Valor Líquido"], horizontal=True)
@@ -772,9 +948,9 @@ elif st.session_state["modulo_ativo"] == "dashboard":
 
     col1, col2 = st.columns(2)
     with col1:
-        st.plotly_chart(grafico_gastos_funcao(df_filtrado, coluna_valor), use_container_width=True)
+        exibir_grafico(grafico_gastos_funcao(cubo, coluna_valor))
     with col2:
-        st.plotly_chart(grafico_gastos_secao(df_filtrado, coluna_valor), use_container_width=True)
+        exibir_grafico(grafico_gastos_secao(cubo, coluna_valor))
 
     st.markdown("---")
 
@@ -800,7 +976,7 @@ elif st.session_state["modulo_ativo"] == "dashboard":
             options=["Funcionário", "Seção", "Função"],
             help="Define a dimensão de análise do Pareto")
 
-    resultado_pareto = grafico_pareto_folha(df_filtrado, float(limiar_pareto), n_buckets,
+    resultado_pareto = grafico_pareto_folha(cubo, float(limiar_pareto), n_buckets,
                                             tipo_valor_pareto, agrupamento_pareto)
 
     if isinstance(resultado_pareto, tuple):
@@ -811,7 +987,7 @@ elif st.session_state["modulo_ativo"] == "dashboard":
         col_p2.metric(f"🎯 {agrupamento_pareto}s que concentram {limiar_pareto}%", n_func)
         col_p3.metric("📌 Representam", f"{pct_func}% do total")
 
-        st.plotly_chart(fig_pareto, use_container_width=True)
+        exibir_grafico(fig_pareto)
 
         if not df_alerta.empty:
             with st.expander(f"📋 Ver os {n_func} {agrupamento_pareto.lower()}(s) que concentram {limiar_pareto}% do custo", expanded=False):
@@ -825,7 +1001,7 @@ elif st.session_state["modulo_ativo"] == "dashboard":
                     mime="text/csv"
                 )
     else:
-        st.plotly_chart(resultado_pareto, use_container_width=True)
+        exibir_grafico(resultado_pareto)
 
     st.markdown("---")
 
@@ -836,57 +1012,8 @@ elif st.session_state["modulo_ativo"] == "dashboard":
     with col_limiar:
         limiar_pct = st.slider("⚠️ Limiar de alerta (%)", min_value=10, max_value=80, value=30, step=5)
 
-    POR_PAGINA = 20
-    tabs_comp = st.tabs(["👤 Por Funcionário", "🏢 Por Seção", "👔 Por Função"])
-    agrupamentos = ["Nome", "Seção", "Função"]
-
-    for tab, agrup in zip(tabs_comp, agrupamentos):
-        with tab:
-            _, qtd_alertas, df_comp = grafico_comprometimento(df_filtrado, limiar_pct, agrup)
-            if qtd_alertas > 0:
-                st.warning(f"⚠️ **{qtd_alertas}** {agrup.lower()}(s) com índice acima de **{limiar_pct}%**")
-            else:
-                st.success(f"✅ Nenhum(a) {agrup.lower()} acima do limiar de **{limiar_pct}%**")
-
-            total     = len(df_comp)
-            total_pag = max(1, -(-total // POR_PAGINA))
-            pag_key   = f"pag_{agrup}"
-            pag_atual = min(st.session_state.get(pag_key, 0), total_pag - 1)
-            inicio = pag_atual * POR_PAGINA
-            fim    = inicio + POR_PAGINA
-            df_pag = df_comp.iloc[inicio:fim]
-
-            fig_pag, _, _ = grafico_comprometimento(
-                df_filtrado[df_filtrado[agrup].isin(df_pag[agrup])], limiar_pct, agrup)
-            fig_pag.update_layout(title=f"🚨 Comprometimento por {agrup} — Pág. {pag_atual+1}/{total_pag} ({total} registros)")
-            st.plotly_chart(fig_pag, use_container_width=True)
-
-            col_prev, *cols_num, col_next = st.columns([1] + [1]*min(total_pag, 10) + [1])
-            with col_prev:
-                if st.button("◀", key=f"prev_{agrup}", disabled=pag_atual == 0):
-                    st.session_state[pag_key] = pag_atual - 1
-                    st.rerun()
-            for i, col in enumerate(cols_num):
-                pag_i = i if total_pag <= 10 else round(i * (total_pag - 1) / max(len(cols_num)-1, 1))
-                label = f"**{pag_i+1}**" if pag_i == pag_atual else str(pag_i+1)
-                with col:
-                    if st.button(label, key=f"pag_{agrup}_{i}"):
-                        st.session_state[pag_key] = pag_i
-                        st.rerun()
-            with col_next:
-                if st.button("▶", key=f"next_{agrup}", disabled=pag_atual >= total_pag - 1):
-                    st.session_state[pag_key] = pag_atual + 1
-                    st.rerun()
-            st.caption(f"Exibindo {inicio+1}–{min(fim, total)} de **{total}** registros")
-
-            df_alerta = df_comp[df_comp["Índice (%)"] >= limiar_pct].sort_values("Índice (%)", ascending=False)
-            if not df_alerta.empty:
-                with st.expander(f"📋 Ver detalhes dos {agrup.lower()}(s) em alerta"):
-                    df_alerta_fmt = df_alerta[[agrup, "Proventos", "Descontos", "Índice (%)"]].copy()
-                    df_alerta_fmt["Proventos"]  = df_alerta_fmt["Proventos"].apply(fmt)
-                    df_alerta_fmt["Descontos"]  = df_alerta_fmt["Descontos"].apply(fmt)
-                    df_alerta_fmt["Índice (%)"] = df_alerta_fmt["Índice (%)"].apply(lambda v: f"{v:.1f}%")
-                    st.dataframe(df_alerta_fmt.reset_index(drop=True), use_container_width=True)
+    # Só o agrupamento visível é calculado; as páginas são fatias da tabela em cache
+    painel_comprometimento(cubo, limiar_pct)
 
     st.markdown("---")
 
@@ -894,17 +1021,21 @@ elif st.session_state["modulo_ativo"] == "dashboard":
     st.subheader("🧾 Envelope de Pagamento")
     st.caption("Selecione um funcionário e o período para visualizar o envelope detalhado.")
 
+    # Motor de envelopes do DataFrame carregado: posições por (Nome, Mês, Período)
+    envelopes = st.session_state.get("envelopes_ficha")
+    if envelopes is None or envelopes.df is not df:
+        envelopes = EnvelopesFicha(df, MESES)
+        st.session_state["envelopes_ficha"] = envelopes
+
     col_env1, col_env2, col_env3, col_env4 = st.columns([2, 1, 1, 1])
     with col_env1:
-        func_env = st.selectbox("👤 Funcionário", sorted(df["Nome"].unique().tolist()), key="env_func")
+        func_env = st.selectbox("👤 Funcionário", envelopes.nomes(), key="env_func")
     with col_env2:
-        meses_env_disp = sorted(df["Mês"].dropna().unique().tolist())
+        meses_env_disp = envelopes.meses()
         mes_env = st.selectbox("🗓️ Mês", meses_env_disp,
             index=len(meses_env_disp)-1, format_func=lambda m: MESES.get(int(m), str(m)), key="env_mes")
     with col_env3:
-        periodos_env_disp = sorted(df[(df["Nome"]==func_env)&(df["Mês"]==mes_env)]["Período"].dropna().unique().tolist())
-        if not periodos_env_disp:
-            periodos_env_disp = sorted(df[df["Mês"]==mes_env]["Período"].dropna().unique().tolist())
+        periodos_env_disp = envelopes.periodos(mes_env, func_env)
         periodo_env = st.selectbox("📋 Período", periodos_env_disp,
             index=len(periodos_env_disp)-1, key="env_periodo")
     with col_env4:
@@ -921,73 +1052,101 @@ elif st.session_state["modulo_ativo"] == "dashboard":
         _func   = st.session_state["envelope_func"]
         _mes    = st.session_state["envelope_mes"]
         _period = st.session_state["envelope_period"]
-        df_env  = df[(df["Nome"]==_func)&(df["Mês"]==_mes)&(df["Período"]==_period)].copy()
+        envelope = envelopes.envelope(_func, _mes, _period)
 
-        if not df_env.empty:
-            _ano_env = int(df_env["Ano"].iloc[0])
-            _period_label = f"{MESES.get(_mes, str(_mes))}/{_ano_env} — Período {_period}"
+        if envelope is None:
+            st.warning(f"Nenhum dado encontrado para **{_func}** no período "
+                       f"**{MESES.get(_mes, str(_mes))} — Período {_period}**.")
         else:
-            _period_label = f"{MESES.get(_mes, str(_mes))} — Período {_period}"
-
-        if df_env.empty:
-            st.warning(f"Nenhum dado encontrado para **{_func}** no período **{_period_label}**.")
-        else:
-            empresa = df_env["Empresa"].iloc[0] if "Empresa" in df_env.columns else ""
-            proventos_df = df_env[df_env["Tipo Evento"]=="Provento"][["Evento","Período","Valor"]].copy()
-            descontos_df = df_env[df_env["Tipo Evento"]=="Desconto"][["Evento","Período","Valor"]].copy()
-            total_prov = proventos_df["Valor"].sum()
-            total_desc = descontos_df["Valor"].sum()
-            liquido    = total_prov - total_desc
-            linhas = []
-            for _, row in proventos_df.iterrows():
-                ev = str(int(float(row["Evento"]))) if str(row["Evento"]).replace(".","").isdigit() else row["Evento"]
-                linhas.append({"Evento": ev, "Proventos": fmt(row["Valor"]), "Descontos": ""})
-            for _, row in descontos_df.iterrows():
-                ev = str(int(float(row["Evento"]))) if str(row["Evento"]).replace(".","").isdigit() else row["Evento"]
-                linhas.append({"Evento": ev, "Proventos": "", "Descontos": fmt(row["Valor"])})
-            df_envelope = pd.DataFrame(linhas)
-            rows_html = ""
-            for _, r in df_envelope.iterrows():
-                rows_html += f"<tr><td style='text-align:center'>{r['Evento']}</td><td style='text-align:right'>{r['Proventos']}</td><td style='text-align:right'>{r['Descontos']}</td></tr>"
-
-            envelope_html = f"""
-            <style>
-            .envelope-wrap {{ font-family: Arial, sans-serif; font-size: 13px; color: #e0e0e0; }}
-            .envelope-wrap table {{ width: 100%; border-collapse: collapse; background: #1e1e2e; border-radius: 8px; overflow: hidden; }}
-            .envelope-wrap .title-row td {{ background: #2d2d44; text-align: center; font-weight: bold; font-size: 15px; padding: 10px; letter-spacing: 1px; color: #ffffff; border-bottom: 2px solid #444; }}
-            .envelope-wrap .func-row td {{ background: #252535; padding: 6px 10px; font-weight: bold; color: #ccc; border-bottom: 1px solid #444; text-align: center; }}
-            .envelope-wrap .header-row td {{ background: #2d2d44; padding: 7px 10px; color: #aaa; font-size: 12px; border-bottom: 2px solid #555; font-weight: bold; text-transform: uppercase; }}
-            .envelope-wrap tbody tr:nth-child(even) {{ background: #1a1a2e; }}
-            .envelope-wrap tbody tr:nth-child(odd)  {{ background: #1e1e2e; }}
-            .envelope-wrap tbody td {{ padding: 6px 10px; border-bottom: 1px solid #2a2a3e; text-align: center; }}
-            .envelope-wrap .totals-row td {{ background: #252535; padding: 7px 10px; font-weight: bold; text-align: right; border-top: 2px solid #555; color: #ccc; }}
-            .envelope-wrap .liquido-row td {{ background: #1c3a2a; padding: 8px 10px; font-weight: bold; text-align: right; color: #2ecc71; font-size: 14px; border-top: 2px solid #2ecc71; }}
-            </style>
-            <div class="envelope-wrap"><table><tbody>
-                <tr class="title-row"><td colspan="3">ENVELOPE DE PAGAMENTO</td></tr>
-                <tr class="func-row"><td colspan="3">FUNCIONÁRIO: {_func} &nbsp;|&nbsp; EMPRESA: {empresa} &nbsp;|&nbsp; PERÍODO: {_period_label}</td></tr>
-                <tr class="header-row"><td style="text-align:center;width:60%">DESCRIÇÃO</td><td style="text-align:right;width:20%">PROVENTOS</td><td style="text-align:right;width:20%">DESCONTOS</td></tr>
-                {rows_html}
-            </tbody>
-                <tr class="totals-row"><td style="text-align:right;color:#aaa">Totais</td><td>{fmt(total_prov)}</td><td>{fmt(total_desc)}</td></tr>
-                <tr class="liquido-row"><td style="text-align:left">💰 LÍQUIDO</td><td></td><td>{fmt(liquido)}</td></tr>
-            </table></div>"""
-            st.html(envelope_html)
-            csv_env = df_envelope.to_csv(index=False, sep=";", decimal=",").encode("utf-8")
-            st.download_button("⬇️ Baixar Envelope CSV", data=csv_env,
+            st.html(envelope.html())
+            st.download_button("⬇️ Baixar Envelope CSV", data=envelope.csv(),
                 file_name=f"envelope_{_func.replace(' ','_')}.csv", mime="text/csv")
 
+    # Exportação em massa: todos os funcionários do Mês/Período selecionado
+    with st.expander(f"📦 Exportar todos os envelopes de {MESES.get(int(mes_env), str(mes_env))} — Período {periodo_env}"):
+        col_fmt, col_unico, col_exp = st.columns([1, 1, 1])
+        with col_fmt:
+            formato_lote = st.radio("Formato", ["HTML", "CSV"], horizontal=True, key="lote_formato")
+        with col_unico:
+            combinado_lote = st.checkbox("Arquivo único", key="lote_combinado",
+                help="Um só arquivo com todos os funcionários, em vez de um arquivo por funcionário.")
+        with col_exp:
+            exportar_lote = st.button("📦 Gerar ZIP", use_container_width=True)
+
+        if exportar_lote:
+            import tempfile
+            from ficha_envelope import exportar_periodo
+
+            barra = st.progress(0.0, text="Gerando envelopes…")
+            with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as destino:
+                try:
+                    estat = exportar_periodo(envelopes, mes_env, periodo_env, destino,
+                        formato_lote.lower(), combinado_lote,
+                        progresso=lambda feitos, total: barra.progress(
+                            feitos / max(total, 1), text=f"Gerando envelopes… {feitos:,}/{total:,}"))
+                except BaseException:
+                    destino.close()
+                    os.remove(destino.name)
+                    raise
+            barra.empty()
+            st.caption(f"⚡ {estat['envelopes']:,} envelopes ({estat['bytes']/1e6:,.1f} MB) em "
+                       f"{estat['segundos']:.1f}s — {estat['envelopes_s']:,.0f} envelopes/s, "
+                       f"{estat['processos']} processo(s).")
+            # O ZIP foi gravado em blocos, mas o botão o carrega inteiro em memória (ver oferecer_arquivo)
+            oferecer_arquivo(destino.name, "⬇️ Baixar ZIP",
+                f"envelopes_{int(mes_env):02d}_{periodo_env}_{formato_lote.lower()}.zip", "application/zip")
+
     st.markdown("---")
     st.subheader("📋 Dados Detalhados")
-    tab1, tab2 = st.tabs(["📊 Análise Dinâmica (PyGWalker)", "📋 Tabela"])
-    with tab1:
+    # Só a visão selecionada é montada; as duas usam a mesma ordenação em cache por filtro
+    aba_dados = st.radio("Visão", ["📊 Análise Dinâmica (PyGWalker)", "📋 Tabela"], index=1,
+                         horizontal=True, key="aba_dados", label_visibility="collapsed")
+    df_ordenado = filtro.ordenado(assinatura_filtro)
+    if aba_dados.startswith("📊"):
         st.caption("Arraste os campos para criar seus próprios agrupamentos e gráficos!")
-        renderer = StreamlitRenderer(df_filtrado.sort_values(["Ano","Mês","Nome"]).reset_index(drop=True))
+        col_modo, col_limite = st.columns([2, 1])
+        with col_modo:
+            modo_pyg = st.radio("Processamento",
+                ["Servidor (DuckDB)", "Amostra", "Completo no navegador"], horizontal=True, key="pyg_modo",
+                help="Servidor: os agrupamentos rodam no DuckDB do servidor e só o resultado vai ao navegador. "
+                     "Amostra: envia no máximo o limite de linhas. Completo: envia todas as linhas.")
+        with col_limite:
+            limite_pyg = st.number_input("Limite da amostra (linhas)", min_value=1_000, max_value=1_000_000,
+                value=50_000, step=5_000, key="pyg_limite", disabled=modo_pyg != "Amostra")
+        renderer = renderizador_pygwalker(
+            df_ordenado, (st.session_state.get("versao_dados", 0), assinatura_filtro), modo_pyg, int(limite_pyg))
+        if modo_pyg == "Amostra" and len(df_ordenado) > limite_pyg:
+            st.caption(f"🎲 Amostra de {int(limite_pyg):,} de {len(df_ordenado):,} linhas.")
         renderer.explorer()
-    with tab2:
-        st.dataframe(df_filtrado.sort_values(["Ano","Mês","Nome"]).reset_index(drop=True), use_container_width=True)
-        csv = df_filtrado.to_csv(index=False, sep=";", decimal=",").encode("utf-8")
-        st.download_button("⬇️ Baixar CSV", data=csv, file_name="ficha_financeira.csv", mime="text/csv")
+    else:
+        st.dataframe(df_ordenado, use_container_width=True)
+        # Arquivo gravado em blocos só no clique; o download o carrega em memória uma vez e ele é apagado
+        formatos_export = {"CSV": "csv", "CSV compactado (gzip)": "csv.gz", "Parquet": "parquet"}
+        col_fmt_exp, col_btn_exp = st.columns([2, 1])
+        with col_fmt_exp:
+            formato_exp = formatos_export[st.radio("Formato do arquivo", list(formatos_export),
+                horizontal=True, key="export_formato")]
+        with col_btn_exp:
+            st.markdown("<br>", unsafe_allow_html=True)
+            gerar_exp = st.button("🗂️ Gerar arquivo", use_container_width=True)
+        if gerar_exp:
+            import tempfile
+            from ficha_dados import FORMATOS_EXPORTACAO, exportar_dados
+
+            with tempfile.NamedTemporaryFile(suffix=FORMATOS_EXPORTACAO[formato_exp], delete=False) as tmp:
+                caminho_exp = tmp.name
+            try:
+                with st.spinner("Gravando arquivo…"):
+                    estat_exp = exportar_dados(df_filtrado, caminho_exp, formato_exp)
+            except BaseException:
+                os.remove(caminho_exp)
+                raise
+            st.caption(f"📁 {estat_exp['linhas']:,} linhas, {estat_exp['bytes']/1e6:,.1f} MB "
+                       f"gravados em {estat_exp['segundos']:.1f}s.")
+            mime_exp = {"csv": "text/csv", "csv.gz": "application/gzip",
+                        "parquet": "application/vnd.apache.parquet"}[formato_exp]
+            oferecer_arquivo(caminho_exp, "⬇️ Baixar arquivo",
+                f"ficha_financeira{FORMATOS_EXPORTACAO[formato_exp]}", mime_exp)
 
 # ============================================================
 # ██  MÓDULO: SQL MAKER
@@ -1036,15 +1195,7 @@ elif st.session_state["modulo_ativo"] == "sqlmaker":
 
     def salvar_query_em_arquivo(sql, tabela_principal):
         try:
-            if not os.path.exists("historico_queries"):
-                os.makedirs("historico_queries")
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"historico_queries/query_{tabela_principal}_{timestamp}.sql"
-            with open(filename, "w", encoding="utf-8") as f:
-                f.write(f"-- Query gerada em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
-                f.write(f"-- Tabela principal: {tabela_principal}\n-- Gerado por: RM Suite\n\n")
-                f.write(sql)
-            return filename
+            return salvar_sentenca(sql, tabela_principal)
         except Exception as e:
             st.warning(f"Não foi possível salvar automaticamente: {e}")
             return None
@@ -1062,35 +1213,61 @@ elif st.session_state["modulo_ativo"] == "sqlmaker":
                 return salvar_query_em_arquivo(sql_editada, st.session_state.tabela_atual)
         return None
 
+    def analisar_sql_editada(sql):
+        # Um analisador por sessão: reaproveita os tokens da versão anterior do editor
+        if "analisador_sql" not in st.session_state:
+            st.session_state.analisador_sql = AnalisadorSQL()
+        return st.session_state.analisador_sql.analisar(sql)
+
     def extrair_colunas_select(sql):
-        sql = re.sub(r"--.*","",sql)
-        match = re.search(r"SELECT(.*?)FROM", sql, re.IGNORECASE|re.DOTALL)
-        if not match: return []
-        bloco_select = match.group(1)
-        colunas_raw  = [c.strip() for c in bloco_select.split(",") if c.strip()]
-        colunas_final = []
-        for col in colunas_raw:
-            alias_match = re.search(r"\s+AS\s+(.+)$", col, re.IGNORECASE)
-            if alias_match:
-                colunas_final.append(alias_match.group(1).strip()); continue
-            func_match = re.search(r"(\w+)\((.*?)\)", col)
-            if func_match:
-                func  = func_match.group(1).upper()
-                campo = func_match.group(2).split(".")[-1]
-                colunas_final.append(f"{func}_{campo}"); continue
-            colunas_final.append(col)
-        return colunas_final
-
-    @st.cache_data
+        colunas = [c for c in analisar_sql_editada(sql).colunas if c.campo != "*"]
+        rotulos = [c.rotulo for c in colunas]
+        # Nomes repetidos (ex.: PFUNC.NOME e PFUNCAO.NOME) são distinguidos pela expressão
+        return [c.expressao if rotulos.count(r) > 1 else r for c, r in zip(colunas, rotulos)]
+
+    @st.cache_resource
     def load_data():
+        # Lê o cache Parquet compilado (sqlmaker_metadados) e monta o índice uma
+        # vez por processo; o XLSX só é reinterpretado quando alguma planilha muda.
         try:
-            df_campos   = pd.read_excel("CAMPOS.xlsx")
-            df_sistemas = pd.read_excel("SISTEMAS.xlsx")
-            df_relacoes = pd.read_excel("RELACIONAMENTOS.xlsx")
-            return df_campos, df_sistemas, df_relacoes
+            return IndiceMetadados(*carregar_metadados())
         except Exception as e:
             st.error(f"Erro ao carregar planilhas: {e}")
-            return None, None, None
+            return None
+
+    @st.cache_resource
+    def load_compilador():
+        # Um compilador (e seu cache de sentenças) por índice carregado
+        return CompiladorSQL(load_data())
+
+    PROFUNDIDADE_MAXIMA = 6
+
+    def adicionar_campos_busca(seed, tabela_pai):
+        # on_click: roda antes do rerun, então pode alterar o estado dos widgets
+        estado = st.session_state
+        sem_caminho = []
+        for chave in estado.get(f"busca_sel_{seed}", []):
+            tabela, campo = chave.split(".", 1)
+            if tabela == tabela_pai:
+                destino = f"cols_pai_{seed}"
+            else:
+                caminho = indice.grafo.caminho(tabela_pai, tabela, PROFUNDIDADE_MAXIMA)
+                # Só entra se estiver entre as opções oferecidas (caminho pelas arestas fortes)
+                if caminho is None or tabela not in indice.grafo.alcancaveis(tabela_pai, PROFUNDIDADE_MAXIMA):
+                    sem_caminho.append(tabela)
+                    continue
+                estado[f"prof_{seed}"] = max(estado.get(f"prof_{seed}", 2), len(caminho) - 1)
+                filhas = estado.setdefault(f"fil_{seed}", [])
+                if tabela not in filhas:
+                    estado[f"fil_{seed}"] = filhas + [tabela]
+                destino = f"cols_{tabela}_{seed}"
+            colunas = estado.get(destino, [])
+            if campo not in colunas:
+                estado[destino] = colunas + [campo]
+        estado[f"busca_sel_{seed}"] = []
+        if sem_caminho:
+            estado[f"busca_aviso_{seed}"] = (f"Sem caminho de JOIN até {tabela_pai} em {PROFUNDIDADE_MAXIMA} saltos: "
+                                             + ", ".join(sorted(set(sem_caminho))))
 
     # ---------- Layout ----------
     st.title("🚀 SQL Maker — Assistente de Relatórios RM")
@@ -1098,7 +1275,7 @@ elif st.session_state["modulo_ativo"] == "sqlmaker":
 
     tab_tutorial, tab_gerador, tab_historico = st.tabs(["📖 Como Usar", "🛠️ Criar minha Sentença", "🕐 Histórico"])
 
-    df_campos, df_sistemas, df_relacoes = load_data()
+    indice = load_data()
 
     # ABA 1: TUTORIAL
     with tab_tutorial:
@@ -1183,36 +1360,58 @@ elif st.session_state["modulo_ativo"] == "sqlmaker":
 
     # ABA 2: GERADOR
     with tab_gerador:
-        if df_campos is not None:
+        if indice is not None:
             seed = st.session_state.get("reset_counter", 0)
 
-            df_sistemas.columns = df_sistemas.columns.str.strip().str.upper()
-            df_campos.columns   = df_campos.columns.str.strip().str.upper()
-            df_relacoes.columns = df_relacoes.columns.str.strip().str.upper()
-
-            df_sistemas["LABEL"] = df_sistemas["CODSISTEMA"].astype(str) + " - " + df_sistemas["DESCRICAO"]
-            sistema_sel = st.selectbox("1. Qual o Módulo do RM?", df_sistemas["LABEL"], key=f"sis_{seed}")
-            cod_sistema = str(df_sistemas[df_sistemas["LABEL"]==sistema_sel]["CODSISTEMA"].values[0])
-
-            tab_disponiveis = df_campos[df_campos["TABELA"].fillna("").str.startswith(cod_sistema)]["TABELA"].unique()
-            tabela_pai = st.selectbox("2. Escolha a Tabela Principal", sorted(tab_disponiveis), key=f"pai_{seed}")
-
-            col_nome_campo = df_campos.columns[1]
-            todos_campos_pai = df_campos[df_campos["TABELA"]==tabela_pai][col_nome_campo].dropna().tolist()
+            sistema_sel = st.selectbox("1. Qual o Módulo do RM?", list(indice.sistemas), key=f"sis_{seed}")
+            cod_sistema = indice.sistemas[sistema_sel]
+
+            tab_disponiveis = indice.tabelas_do_sistema(cod_sistema)
+            tabela_pai = st.selectbox("2. Escolha a Tabela Principal", tab_disponiveis, key=f"pai_{seed}")
+
+            # Busca por nome ou descrição: os campos escolhidos entram nas colunas
+            # da principal ou nas tabelas relacionadas (com a profundidade do caminho).
+            with st.expander("🔎 Buscar campo por nome ou descrição"):
+                termo_busca = st.text_input("Buscar campo", key=f"busca_{seed}",
+                    placeholder="ex.: salário base, data admissão, chapa")
+                so_alcancaveis = st.checkbox(f"Só tabelas ligadas a {tabela_pai}", value=True, key=f"busca_alc_{seed}")
+                if termo_busca.strip():
+                    restricao = None
+                    if so_alcancaveis:
+                        restricao = set(indice.grafo.alcancaveis(tabela_pai, PROFUNDIDADE_MAXIMA)) | {tabela_pai}
+                    achados = indice.busca.buscar(termo_busca, limite=30, tabelas=restricao)
+                    if achados.empty:
+                        st.info("Nenhum campo encontrado.")
+                    else:
+                        descricoes = {f"{t}.{c}": d for t, c, d in
+                                      zip(achados["TABELA"], achados["CAMPO"], achados["DESCRIÇÃO"])}
+                        st.multiselect("Campos encontrados", list(descricoes), key=f"busca_sel_{seed}",
+                            format_func=lambda k: f"{k} — {descricoes[k]}" if isinstance(descricoes[k], str) else k)
+                        st.button("➕ Adicionar à consulta", key=f"busca_add_{seed}",
+                            on_click=adicionar_campos_busca, args=(seed, tabela_pai))
+                aviso = st.session_state.pop(f"busca_aviso_{seed}", None)
+                if aviso:
+                    st.warning(aviso)
+
+            todos_campos_pai = indice.campos(tabela_pai)
             campos_pai_sel   = st.multiselect(f"Quais informações de {tabela_pai} você quer?",
                 options=todos_campos_pai, key=f"cols_pai_{seed}")
 
-            # Pai → Filha (direto)
-            filhas_do_pai = df_relacoes[df_relacoes["MASTERTABLE"]==tabela_pai]["CHILDTABLE"].unique().tolist()
-
-            # Filha → Filha: tabelas que se relacionam com qualquer filha do pai
-            # mas que NÃO têm vínculo direto com a tabela pai
-            filhas_das_filhas = df_relacoes[df_relacoes["MASTERTABLE"].isin(filhas_do_pai)]["CHILDTABLE"].unique().tolist()
-            todas_filhas_possiveis = list(set(filhas_do_pai + filhas_das_filhas))
-
-            filhas_finais = sorted([t for t in todas_filhas_possiveis if t != tabela_pai])
-
-            tabelas_filhas = st.multiselect("Deseja buscar dados em tabelas relacionadas? (Joins)", filhas_finais, key=f"fil_{seed}")
+            # Tabelas alcançáveis a partir da principal pelo grafo de RELACIONAMENTOS;
+            # o caminho de JOIN (com tabelas intermediárias) é montado na geração.
+            profundidade_join = st.slider("Profundidade máxima dos JOINs", min_value=1, max_value=PROFUNDIDADE_MAXIMA, value=2,
+                key=f"prof_{seed}",
+                help="Quantos saltos de relacionamento podem separar a tabela principal das relacionadas. "
+                     "Tabelas intermediárias necessárias são incluídas automaticamente.")
+            filhas_finais = indice.grafo.alcancaveis(tabela_pai, profundidade_join)
+            # Sem relação forte, a principal só se liga pelas chaves de CODCOLIGADA
+            filhas_fracas = indice.grafo.ligacoes_fracas(tabela_pai, profundidade_join)
+            if filhas_fracas:
+                st.caption(f"⚠️ {tabela_pai} não tem relacionamento além de CODCOLIGADA: "
+                           "as tabelas marcadas se ligam só pela coligada.")
+
+            tabelas_filhas = st.multiselect("Deseja buscar dados em tabelas relacionadas? (Joins)", filhas_finais,
+                key=f"fil_{seed}", format_func=lambda t: f"{t} ⚠️ só CODCOLIGADA" if t in filhas_fracas else t)
 
             tipos_join      = {}
             campos_por_filha = {}
@@ -1226,9 +1425,8 @@ elif st.session_state["modulo_ativo"] == "sqlmaker":
                     tipos_join[filha] = tipo_join
                 with col_campos:
                     st.markdown("**Colunas:**")
-                    campos_da_filha = df_campos[df_campos["TABELA"]==filha][col_nome_campo].dropna().tolist()
                     campos_por_filha[filha] = st.multiselect(f"Colunas de: {filha}",
-                        options=campos_da_filha, key=f"cols_{filha}_{seed}", label_visibility="collapsed")
+                        options=indice.campos(filha), key=f"cols_{filha}_{seed}", label_visibility="collapsed")
 
             st.markdown("### 📊 Adicionar Cálculos (Opcional)")
             col1, col2 = st.columns(2)
@@ -1252,8 +1450,7 @@ elif st.session_state["modulo_ativo"] == "sqlmaker":
             for campo in todos_campos_pai:
                 campos_disponiveis_filtro[f"{tabela_pai}.{campo}"] = tabela_pai
             for filha in tabelas_filhas:
-                campos_da_filha = df_campos[df_campos["TABELA"]==filha][col_nome_campo].dropna().tolist()
-                for campo in campos_da_filha:
+                for campo in indice.campos(filha):
                     campos_disponiveis_filtro[f"{filha}.{campo}"] = filha
             lista_campos_filtro = sorted(list(campos_disponiveis_filtro.keys()))
 
@@ -1399,97 +1596,30 @@ elif st.session_state["modulo_ativo"] == "sqlmaker":
             st.markdown("---")
 
             # GERAÇÃO DA SQL
+            otimizar_sql = st.checkbox("⚡ Otimizar a sentença", value=True, key=f"otimizar_{seed}",
+                help="Mais seletivos primeiro nos JOINs, LEFT JOIN vira INNER quando o filtro exige a linha, "
+                     "filtros descem para tabelas derivadas e CODCOLIGADA abre cada ON/WHERE.")
             if st.button("✨ GERAR MINHA SENTENÇA SQL", use_container_width=True):
                 if not campos_pai_sel and not any(campos_por_filha.values()):
                     st.warning("Selecione ao menos uma coluna!")
                 else:
-                    colunas_select = [f"{tabela_pai}.{c}" for c in campos_pai_sel]
-                    for filha, cols in campos_por_filha.items():
-                        for c in cols:
-                            colunas_select.append(f"{filha}.{c}")
-
-                    if op_agregacao != "NENHUM" and 'campo_metrica' in locals() and campo_metrica:
-                        map_op = {"SOMA (SUM)":"SUM","CONTAGEM (COUNT)":"COUNT","MÉDIA (AVG)":"AVG","MÁXIMO (MAX)":"MAX","MÍNIMO (MIN)":"MIN"}
-                        func = map_op[op_agregacao]
-                        prefixo_met = tabela_pai if campo_metrica in campos_pai_sel else ""
-                        if not prefixo_met:
-                            for f_filha, cs in campos_por_filha.items():
-                                if campo_metrica in cs:
-                                    prefixo_met = f_filha; break
-                        campo_final_met = f"{func}({prefixo_met}.{campo_metrica}) AS {func}_{campo_metrica}"
-                        campos_gb   = [c for c in colunas_select if not c.endswith(f".{campo_metrica}")]
-                        select_final = ",\n  ".join(campos_gb + [campo_final_met])
-                        group_by_sql = f"\nGROUP BY\n  " + ",\n  ".join(campos_gb)
-                    else:
-                        select_final = ",\n  ".join(colunas_select)
-                        group_by_sql = ""
-
-                    script = f"SELECT\n  {select_final}\nFROM {tabela_pai} (NOLOCK)"
-                    for filha in tabelas_filhas:
-                        # Tenta relação direta Pai → Filha
-                        rel = df_relacoes[(df_relacoes["MASTERTABLE"]==tabela_pai)&(df_relacoes["CHILDTABLE"]==filha)]
-                        master_usado = tabela_pai
-
-                        # Se não encontrou, procura relação Filha → Filha
-                        # (alguma tabela já adicionada que é master desta filha)
-                        if rel.empty:
-                            for outra_filha in tabelas_filhas:
-                                if outra_filha == filha:
-                                    continue
-                                rel_ff = df_relacoes[(df_relacoes["MASTERTABLE"]==outra_filha)&(df_relacoes["CHILDTABLE"]==filha)]
-                                if not rel_ff.empty:
-                                    rel = rel_ff
-                                    master_usado = outra_filha
-                                    break
-
-                        tipo = tipos_join.get(filha,"INNER")
-                        if not rel.empty:
-                            conds = []
-                            for _, r in rel.iterrows():
-                                cp_l = str(r["MASTERFIELD"]).split(",")
-                                cf_l = str(r["CHILDFIELD"]).split(",")
-                                for cp, cf in zip(cp_l, cf_l):
-                                    conds.append(f"{master_usado}.{cp.strip()} = {filha}.{cf.strip()}")
-                            script += f"\n{tipo} JOIN {filha} (NOLOCK) ON\n  " + " AND\n  ".join(conds)
-                        else:
-                            script += f"\n{tipo} JOIN {filha} (NOLOCK) ON\n  -- AJUSTE O JOIN: {tabela_pai}.ID = {filha}.ID"
-
-                    if st.session_state[f"filtros_{seed}"]:
-                        condicoes_where = []
-                        for idx, filtro in enumerate(st.session_state[f"filtros_{seed}"]):
-                            campo = filtro["campo"]; operador = filtro["operador"]; valor = filtro["valor"]
-                            if operador in ["IS NULL","IS NOT NULL"]:
-                                condicao = f"{campo} {operador}"
-                            elif operador == "BETWEEN":
-                                valores = valor.split("|")
-                                if len(valores)==2:
-                                    val1,val2=valores[0].strip(),valores[1].strip()
-                                    if not val1.replace('.','').replace('-','').isdigit() and not val1.startswith("'"): val1=f"'{val1}'"
-                                    if not val2.replace('.','').replace('-','').isdigit() and not val2.startswith("'"): val2=f"'{val2}'"
-                                    condicao = f"{campo} BETWEEN {val1} AND {val2}"
-                                else:
-                                    condicao = f"{campo} BETWEEN {valor}"
-                            elif operador in ["IN","NOT IN"]:
-                                condicao = f"{campo} {operador} ({valor})"
-                            elif operador in ["LIKE","NOT LIKE"]:
-                                if not valor.startswith("'"): valor=f"'{valor}'"
-                                condicao = f"{campo} {operador} {valor}"
-                            else:
-                                if valor.replace('.','').replace('-','').replace(',','').isdigit():
-                                    condicao = f"{campo} {operador} {valor}"
-                                else:
-                                    if not valor.startswith("'"): valor=f"'{valor}'"
-                                    condicao = f"{campo} {operador} {valor}"
-                            if idx==0: condicoes_where.append(condicao)
-                            else:      condicoes_where.append(f"{filtro['conector']} {condicao}")
-                        if condicoes_where:
-                            script += f"\nWHERE\n  " + "\n  ".join(condicoes_where)
-
-                    script += group_by_sql
-
-                    if st.session_state[f"ordenacoes_{seed}"]:
-                        order_fields = [f"{o['campo']} {o['direcao']}" for o in st.session_state[f"ordenacoes_{seed}"]]
-                        script += "\nORDER BY\n  " + ",\n  ".join(order_fields)
+                    agregacao = None
+                    if op_agregacao != "NENHUM" and campo_metrica:
+                        tabela_met = tabela_pai if campo_metrica in campos_pai_sel else next(
+                            (f for f, cs in campos_por_filha.items() if campo_metrica in cs), "")
+                        agregacao = Agregacao(FUNCOES_AGREGACAO[op_agregacao], tabela_met, campo_metrica)
+                    consulta = ConsultaSQL.criar(
+                        tabela_pai,
+                        [(tabela_pai, c) for c in campos_pai_sel]
+                        + [(filha, c) for filha, cols in campos_por_filha.items() for c in cols],
+                        juncoes=[(filha, tipos_join.get(filha, "INNER")) for filha in tabelas_filhas],
+                        profundidade=profundidade_join,
+                        agregacao=agregacao,
+                        filtros=st.session_state[f"filtros_{seed}"],
+                        ordenacao=st.session_state[f"ordenacoes_{seed}"],
+                        otimizar=otimizar_sql,
+                    )
+                    script = load_compilador().compilar(consulta)
 
                     st.session_state.sql_gerada  = script
                     st.session_state.sql_editada = script
@@ -1519,6 +1649,15 @@ elif st.session_state["modulo_ativo"] == "sqlmaker":
                 with tab_edit:
                     sql_editada = st.text_area("Editor SQL:", value=st.session_state.sql_editada,
                         height=300, key=f"editor_sql_{seed}", label_visibility="collapsed")
+                    analise = analisar_sql_editada(sql_editada)
+                    for erro in analise.erros:
+                        st.warning(erro, icon="⚠️")
+                    st.caption(f"🧩 {len(analise.colunas)} coluna(s) · {len(analise.tabelas)} tabela(s) no FROM "
+                               f"({len(analise.juncoes)} JOIN) · citadas: {', '.join(analise.referenciadas) or '—'}")
+                    if analise.juncoes:
+                        with st.expander("🔗 JOINs da sentença"):
+                            st.dataframe(pd.DataFrame(analise.juncoes, columns=["Tabela","Apelido","JOIN","Condição"]),
+                                         use_container_width=True, hide_index=True)
                     if sql_editada != st.session_state.sql_editada:
                         st.session_state.sql_editada = sql_editada
                         arquivo_salvo = atualizar_query_editada(sql_editada)
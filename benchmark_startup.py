@@ -0,0 +1,94 @@
+# =============================================================================
+#  RM Suite — Benchmark de inicialização
+#
+#  Mede, cada um em um interpretador novo (cold start):
+#    1. o custo de import de cada dependência (python -X importtime);
+#    2. o tempo do primeiro render de cada módulo do app (Home, SQL Maker e
+#       Ficha Financeira), via streamlit.testing.
+#
+#  Uso:  python benchmark_startup.py [--repeticoes N]
+# =============================================================================
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+
+DEPENDENCIAS = [
+    "streamlit",
+    "pandas",
+    "plotly.graph_objects",
+    "requests",
+    "zeep",
+    "pygwalker.api.streamlit",
+]
+MODULOS_APP = ["home", "sqlmaker", "dashboard"]
+
+_SCRIPT_RENDER = """
+import sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=300)
+at.session_state["modulo_ativo"] = {modulo!r}
+at.run()
+carregados = [m for m in ("zeep", "pygwalker") if m in sys.modules]
+print(f"{{time.perf_counter() - t0:.4f}};{{','.join(carregados)}}")
+"""
+
+
+def custo_import(modulo: str) -> float:
+    """Tempo cumulativo (s) de `import modulo` em um interpretador novo."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                          capture_output=True, text=True, cwd=PASTA_APP)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    for linha in reversed(proc.stderr.splitlines()):
+        partes = [p.strip() for p in linha.split("|")]
+        if len(partes) == 3 and partes[2] == modulo:
+            return int(partes[1]) / 1e6
+    return 0.0
+
+
+def tempo_render(modulo: str) -> tuple[float, str]:
+    """Tempo (s) do primeiro render de um módulo do app e dependências pesadas carregadas."""
+    script = _SCRIPT_RENDER.format(app=os.path.join(PASTA_APP, "app.py"), modulo=modulo)
+    env = {**os.environ, "PYTHONPATH": PASTA_APP}
+    proc = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                          cwd=PASTA_APP, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    tempo, carregados = proc.stdout.strip().splitlines()[-1].split(";")
+    return float(tempo), carregados or "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de cold start do RM Suite")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    print("Custo de import por dependência (mediana, cold start)")
+    print(f"{'Módulo':<28}{'Tempo (ms)':>12}")
+    for modulo in DEPENDENCIAS:
+        try:
+            tempos = [custo_import(modulo) for _ in range(args.repeticoes)]
+            print(f"{modulo:<28}{statistics.median(tempos) * 1000:>12.1f}")
+        except RuntimeError as e:
+            print(f"{modulo:<28}{'erro':>12}  {e}")
+
+    print()
+    print("Primeiro render por módulo do app (mediana, cold start)")
+    print(f"{'Módulo':<28}{'Tempo (ms)':>12}  Dependências pesadas carregadas")
+    for modulo in MODULOS_APP:
+        try:
+            medicoes = [tempo_render(modulo) for _ in range(args.repeticoes)]
+            tempo = statistics.median(t for t, _ in medicoes)
+            print(f"{modulo:<28}{tempo * 1000:>12.1f}  {medicoes[-1][1]}")
+        except RuntimeError as e:
+            print(f"{modulo:<28}{'erro':>12}  {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+# =============================================================================
+#  RM Suite — Camada de análise da Ficha Financeira
+#
+#  Agregações do dashboard sem dependência do Streamlit nem do Plotly. O
+#  DataFrame filtrado é reduzido uma única vez a um cubo de somas por
+#  (Ano, Mês, Tipo Evento, Nome, Seção, Função, Evento); cada gráfico e
+#  métrica é derivado desse cubo, que é bem menor que os lançamentos.
+#  FiltroFicha aplica os filtros do dashboard com máscaras memoizadas e guarda
+#  o resultado (e o cubo) por assinatura de filtro; as tabelas derivadas do
+#  cubo (ex.: comprometimento) valem, portanto, por estado de filtro.
+#  lttb/indices_maiores reduzem séries longas e reduzir_figura aplica-as aos
+#  traces de uma figura Plotly já montada (sem importar o Plotly);
+#  fmt/fmt_serie/fmt_pct formatam valores para exibição (pt-BR).
+# =============================================================================
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+DIMENSOES_CUBO = ["Ano", "Mês", "Tipo Evento", "Nome", "Seção", "Função", "Evento"]
+
+_PONTUACAO_BR = str.maketrans(",.", ".,")
+
+
+@lru_cache(maxsize=8192)
+def fmt(valor: float) -> str:
+    """Moeda pt-BR: 1234.5 -> "R$ 1.234,50"."""
+    return f"R$ {valor:,.2f}".translate(_PONTUACAO_BR)
+
+
+def _formatar_distintos(valores, formatar) -> pd.Series:
+    """Aplica `formatar` uma vez por valor distinto e espalha o texto pelas posições."""
+    serie = valores if isinstance(valores, pd.Series) else pd.Series(valores)
+    codigos, distintos = pd.factorize(serie, use_na_sentinel=False)
+    textos = pd.Index([formatar(v) for v in distintos], dtype=object).take(codigos)
+    return pd.Series(textos, index=serie.index, dtype=object)
+
+
+def fmt_serie(valores) -> pd.Series:
+    """fmt() sobre uma coluna inteira (Series/array), formatando cada valor distinto uma vez."""
+    return _formatar_distintos(valores, lambda v: fmt(float(v)))
+
+
+def fmt_pct(valores, casas: int = 1) -> pd.Series:
+    """Percentuais como f"{v:.1f}%" (com `casas` decimais), formatando cada valor distinto uma vez."""
+    return _formatar_distintos(valores, lambda v: f"{v:.{casas}f}%")
+
+
+class CuboFicha:
+    """Somas de Valor/Liquido e contagem de registros por DIMENSOES_CUBO.
+
+    As visões derivadas são memoizadas por argumentos e compartilhadas entre
+    os gráficos: quem as recebe não deve alterá-las no lugar.
+    """
+
+    def __init__(self, df: pd.DataFrame | None = None):
+        self._memo: dict[tuple, object] = {}
+        if df is None:
+            return
+        # sort=False preserva a ordem de primeira ocorrência (usada em atributos_nome);
+        # dropna=False mantém nos totais os lançamentos com dimensão nula
+        if df.empty:
+            self.cubo = pd.DataFrame(columns=DIMENSOES_CUBO + ["Valor", "Liquido", "Registros"])
+        else:
+            self.cubo = (df.groupby(DIMENSOES_CUBO, observed=True, sort=False, dropna=False)
+                           .agg(Valor=("Valor", "sum"), Liquido=("Liquido", "sum"),
+                                Registros=("Valor", "size"))
+                           .reset_index())
+
+    def _memoizar(self, chave: tuple, calcular):
+        if chave not in self._memo:
+            self._memo[chave] = calcular()
+        return self._memo[chave]
+
+    def _do_tipo(self, tipo: str | None) -> pd.DataFrame:
+        if tipo is None:
+            return self.cubo
+        return self._memoizar(("tipo", tipo), lambda: self.cubo[self.cubo["Tipo Evento"] == tipo])
+
+    @property
+    def registros(self) -> int:
+        return int(self.cubo["Registros"].sum())
+
+    def total(self, coluna: str = "Valor", tipo: str | None = None) -> float:
+        return self._memoizar(("total", coluna, tipo), lambda: float(self._do_tipo(tipo)[coluna].sum()))
+
+    def somar(self, por: str | list[str], coluna: str = "Valor", tipo: str | None = None) -> pd.Series:
+        """Soma de `coluna` agrupada por `por`, opcionalmente só de um Tipo Evento."""
+        chave = ("somar", tuple(por) if isinstance(por, list) else por, coluna, tipo)
+        return self._memoizar(chave, lambda: self._do_tipo(tipo).groupby(por, observed=True)[coluna].sum())
+
+    def proventos_descontos(self, por: str) -> pd.DataFrame:
+        """Colunas [por, Proventos, Descontos] com zero onde só um dos tipos ocorre."""
+        def calcular():
+            prov = self.somar(por, tipo="Provento").rename("Proventos")
+            desc = self.somar(por, tipo="Desconto").rename("Descontos")
+            return pd.concat([prov, desc], axis=1).fillna(0).rename_axis(por).reset_index()
+        return self._memoizar(("prov_desc", por), calcular)
+
+    def saldo_periodo(self) -> pd.DataFrame:
+        """Proventos, Descontos e Saldo por (Ano, Mês), em ordem cronológica."""
+        def calcular():
+            pivot = (self.somar(["Ano", "Mês", "Tipo Evento"]).unstack("Tipo Evento", fill_value=0)
+                     .reindex(columns=["Provento", "Desconto"], fill_value=0)
+                     .sort_index().reset_index())
+            pivot.columns.name = None
+            pivot["Saldo"] = pivot["Provento"] - pivot["Desconto"]
+            return pivot
+        return self._memoizar(("saldo_periodo",), calcular)
+
+    def atributos_nome(self) -> pd.DataFrame:
+        """Seção e Função da primeira ocorrência de cada Nome (índice: Nome)."""
+        return self._memoizar(("atributos_nome",), lambda: (
+            self.cubo[["Nome", "Seção", "Função"]].drop_duplicates("Nome").set_index("Nome")))
+
+    def comprometimento(self, por: str) -> pd.DataFrame:
+        """Índice Descontos/Proventos (%) por `por`, do maior para o menor.
+
+        Só entram os grupos com Proventos > 0; por Nome, inclui a Seção e a
+        Função de atributos_nome. Não depende do limiar: as páginas e os
+        alertas são recortes desta tabela.
+        """
+        def calcular():
+            grp = self.proventos_descontos(por)
+            grp = grp[grp["Proventos"] > 0].copy()
+            grp["Índice (%)"] = (grp["Descontos"] / grp["Proventos"] * 100).round(1)
+            grp = grp.sort_values("Índice (%)", ascending=False, kind="stable").reset_index(drop=True)
+            if por == "Nome":
+                info = self.atributos_nome()
+                grp["Seção"]  = grp["Nome"].map(info["Seção"].astype(str)).fillna("-")
+                grp["Função"] = grp["Nome"].map(info["Função"].astype(str)).fillna("-")
+            return grp
+        return self._memoizar(("comprometimento", por), calcular)
+
+    def pareto(self, por: str, tipo: str | None) -> pd.DataFrame:
+        """Colunas [por, Valor, % Acumulado, Rank] dos grupos com Valor > 0, do maior ao menor.
+
+        `tipo` é o Tipo Evento somado; None usa a base líquida (Proventos − Descontos).
+        """
+        def calcular():
+            if tipo is None:
+                prov_desc = self.proventos_descontos(por)
+                grp = pd.DataFrame({por: prov_desc[por],
+                                    "Valor": prov_desc["Proventos"] - prov_desc["Descontos"]})
+            else:
+                grp = self.somar(por, tipo=tipo).reset_index()
+            grp = grp[grp["Valor"] > 0].sort_values("Valor", ascending=False).reset_index(drop=True)
+            grp["% Acumulado"] = (grp["Valor"].cumsum() / grp["Valor"].sum() * 100).round(2)
+            grp["Rank"] = np.arange(1, len(grp) + 1)
+            return grp
+        return self._memoizar(("pareto", por, tipo), calcular)
+
+
+def faixas_pareto(pareto: pd.DataFrame, n_buckets: int, n_corte: int) -> pd.DataFrame:
+    """Agrupa um CuboFicha.pareto em faixas consecutivas de max(1, n // n_buckets) posições.
+
+    Cada faixa traz rank_ini/rank_fim, soma de Valor, % Acumulado do último
+    item, n e os marcadores alerta (faixa toda até o corte) e parcial (o
+    corte cai dentro dela). Sem laço por faixa: somas por np.add.reduceat.
+    """
+    n_total = len(pareto)
+    tamanho = max(1, n_total // n_buckets)
+    inicio  = np.arange(0, n_total, tamanho)
+    fim     = np.minimum(inicio + tamanho, n_total)
+    rank_ini = inicio + 1
+    rank_fim = fim
+    return pd.DataFrame({
+        "label": pd.Series(rank_ini).astype(str) + "–" + pd.Series(rank_fim).astype(str),
+        "Valor": np.add.reduceat(pareto["Valor"].to_numpy(dtype="float64"), inicio),
+        "% Acumulado": pareto["% Acumulado"].to_numpy()[fim - 1],
+        "n": fim - inicio,
+        "alerta": rank_fim <= n_corte,
+        "parcial": (rank_ini <= n_corte) & (n_corte < rank_fim),
+        "rank_ini": rank_ini,
+        "rank_fim": rank_fim,
+    })
+
+
+class FiltroFicha:
+    """Filtros do dashboard sobre um DataFrame fixo, com cache por assinatura.
+
+    As posições das linhas de cada valor são calculadas uma vez por coluna; a
+    máscara de uma seleção é a união dessas posições (memoizada) e a de um
+    filtro completo é a interseção das máscaras das colunas. Seleções que
+    cobrem todas as linhas ("tudo marcado") ficam fora da assinatura e não
+    geram máscara.
+    """
+
+    def __init__(self, df: pd.DataFrame, max_resultados: int = 8, max_mascaras: int = 64):
+        self.df = df
+        self.max_resultados = max_resultados
+        self.max_mascaras   = max_mascaras
+        self._indices: dict[str, dict] = {}
+        self._completa: dict[str, bool] = {}
+        self._mascaras: dict[tuple, np.ndarray] = {}
+        self._resultados: OrderedDict[tuple, dict] = OrderedDict()
+
+    def _indices_de(self, coluna: str) -> dict:
+        if coluna not in self._indices:
+            self._indices[coluna] = indices = self.df.groupby(coluna, observed=True, sort=False).indices
+            # Coluna com nulos: nem "todos os valores" cobre todas as linhas
+            self._completa[coluna] = sum(len(pos) for pos in indices.values()) == len(self.df)
+        return self._indices[coluna]
+
+    def valores(self, coluna: str, ordenar: bool = True) -> list:
+        """Valores distintos não nulos da coluna (ordenados ou por primeira ocorrência)."""
+        indices = self._indices_de(coluna)
+        if ordenar:
+            return sorted(indices)
+        return sorted(indices, key=lambda v: indices[v][0])
+
+    def _normalizar(self, coluna: str, selecionados) -> frozenset | None:
+        """Seleção efetiva da coluna, ou None quando ela não exclui nenhuma linha."""
+        indices = self._indices_de(coluna)
+        selecao = frozenset(v for v in selecionados if v in indices)
+        if self._completa[coluna] and len(selecao) == len(indices):
+            return None
+        return selecao
+
+    def _mascara(self, coluna: str, selecao: frozenset) -> np.ndarray:
+        chave = (coluna, selecao)
+        if chave not in self._mascaras:
+            indices = self._indices_de(coluna)
+            mascara = np.zeros(len(self.df), dtype=bool)
+            if selecao:
+                mascara[np.concatenate([indices[v] for v in selecao])] = True
+            if len(self._mascaras) >= self.max_mascaras:
+                self._mascaras.clear()
+            self._mascaras[chave] = mascara
+        return self._mascaras[chave]
+
+    def assinatura(self, filtros: dict[str, object]) -> tuple:
+        """Assinatura canônica de {coluna: valores selecionados}, sem os filtros identidade."""
+        partes = []
+        for coluna in sorted(filtros):
+            selecao = self._normalizar(coluna, filtros[coluna])
+            if selecao is not None:
+                partes.append((coluna, selecao))
+        return tuple(partes)
+
+    def _entrada(self, assinatura: tuple) -> dict:
+        entrada = self._resultados.get(assinatura)
+        if entrada is not None:
+            self._resultados.move_to_end(assinatura)
+            return entrada
+        if not assinatura:
+            df = self.df
+        else:
+            mascara = self._mascara(*assinatura[0])
+            for coluna, selecao in assinatura[1:]:
+                mascara = mascara & self._mascara(coluna, selecao)
+            df = self.df[mascara]
+        entrada = {"df": df}
+        self._resultados[assinatura] = entrada
+        while len(self._resultados) > self.max_resultados:
+            self._resultados.popitem(last=False)
+        return entrada
+
+    def filtrar(self, filtros: dict[str, object]) -> tuple[pd.DataFrame, tuple]:
+        """(DataFrame filtrado, assinatura); repetir a mesma seleção não toca nos dados."""
+        assinatura = self.assinatura(filtros)
+        return self._entrada(assinatura)["df"], assinatura
+
+    def ordenado(self, assinatura: tuple, por: tuple[str, ...] = ("Ano", "Mês", "Nome")) -> pd.DataFrame:
+        """Recorte da assinatura ordenado por `por` (índice 0..n-1), ordenado uma vez por filtro."""
+        entrada = self._entrada(assinatura)
+        chave = ("ordenado", por)
+        if chave not in entrada:
+            entrada[chave] = entrada["df"].sort_values(list(por)).reset_index(drop=True)
+        return entrada[chave]
+
+    def cubo(self, assinatura: tuple) -> CuboFicha:
+        """Cubo de agregação do recorte da assinatura, construído uma vez."""
+        entrada = self._entrada(assinatura)
+        if "cubo" not in entrada:
+            entrada["cubo"] = CuboFicha(entrada["df"])
+        return entrada["cubo"]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_pontos: int) -> np.ndarray:
+    """Posições escolhidas por Largest-Triangle-Three-Buckets (Steinarsson).
+
+    Mantém o primeiro e o último ponto e, em cada um dos n_pontos - 2 baldes
+    intermediários, o ponto que forma o maior triângulo com o escolhido no
+    balde anterior e a média do seguinte. Preserva picos e vales da série.
+    """
+    n = len(y)
+    if n_pontos >= n or n_pontos < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    limites = np.linspace(1, n - 1, n_pontos - 1).astype(int)
+    escolhidos = np.empty(n_pontos, dtype=int)
+    escolhidos[0], escolhidos[-1] = 0, n - 1
+    a = 0
+    for i in range(n_pontos - 2):
+        ini, fim = limites[i], max(limites[i + 1], limites[i] + 1)
+        prox_ini = fim
+        prox_fim = limites[i + 2] if i + 2 < len(limites) else n
+        if prox_ini >= prox_fim:
+            prox_ini, prox_fim = n - 1, n
+        mx, my = x[prox_ini:prox_fim].mean(), y[prox_ini:prox_fim].mean()
+        areas = np.abs((x[a] - mx) * (y[ini:fim] - y[a]) - (x[a] - x[ini:fim]) * (my - y[a]))
+        a = ini + int(areas.argmax())
+        escolhidos[i + 1] = a
+    return escolhidos
+
+
+def indices_maiores(valores: np.ndarray, n: int) -> np.ndarray:
+    """Posições (em ordem original) dos n maiores valores absolutos."""
+    valores = np.abs(np.asarray(valores, dtype="float64"))
+    if n >= len(valores):
+        return np.arange(len(valores))
+    return np.sort(np.argpartition(-valores, n)[:n])
+
+
+# ============================================================
+# REDUÇÃO DE FIGURAS
+# ============================================================
+_PROPS_POR_PONTO = ("x", "y", "text", "customdata", "hovertext", "hovertemplate", "ids")
+_BYTES_LAYOUT    = 4096   # layout, nomes e estilos dos traces: estimativa fixa
+
+
+def _eixo_valor(trace) -> str:
+    return "x" if trace.type == "bar" and trace.orientation == "h" else "y"
+
+
+def _pontos(trace) -> int:
+    valores = trace[_eixo_valor(trace)]
+    return 0 if valores is None else len(valores)
+
+
+def estimar_bytes_figura(fig) -> int:
+    """Tamanho aproximado do JSON da figura pela contagem de pontos, sem serializá-la."""
+    total = _BYTES_LAYOUT
+    for trace in fig.data:
+        cor = trace.marker.color if "marker" in trace and trace.marker is not None else None
+        arrays = [trace[p] for p in _PROPS_POR_PONTO if p in trace] + [cor]
+        for v in arrays:
+            if v is None or isinstance(v, str) or not len(v):
+                continue
+            amostra = v[:32]
+            total += int(len(v) * (sum(len(str(e)) for e in amostra) / len(amostra) + 3))
+    return total
+
+
+def _selecionar(grupo: list, n: int, max_pontos: int) -> tuple[np.ndarray, bool]:
+    """Posições mantidas para todos os traces de um mesmo eixo (e se há "Outros").
+
+    Com barras no grupo, ficam os max_pontos - 1 maiores (soma das barras) e o
+    resto vira "Outros"; só com linhas, o LTTB do primeiro trace.
+    """
+    barras = [t for t in grupo if t.type == "bar"]
+    if barras:
+        soma = sum(np.abs(np.asarray(t[_eixo_valor(t)], dtype="float64")) for t in barras)
+        return indices_maiores(soma, max_pontos - 1), True
+    ref = grupo[0]
+    try:
+        x_num = np.asarray(ref.x, dtype="float64") if ref.x is not None else np.arange(n, dtype="float64")
+    except (TypeError, ValueError):
+        x_num = np.arange(n, dtype="float64")
+    return lttb(x_num, np.asarray(ref.y, dtype="float64"), max_pontos), False
+
+
+def _aplicar_selecao(trace, idx: np.ndarray, n: int, com_outros: bool) -> None:
+    """Mantém só as posições idx do trace; com_outros acrescenta a categoria "Outros".
+
+    "Outros" recebe hovertext e hovertemplate próprios com a soma e a
+    quantidade de itens agrupados.
+    """
+    eixo_valor = _eixo_valor(trace)
+    eixo_categoria = "x" if eixo_valor == "y" else "y"
+    if com_outros:
+        valores = np.asarray(trace[eixo_valor], dtype="float64")
+        resto = np.ones(n, dtype=bool)
+        resto[idx] = False
+        # Barras somam o resto; linhas ficam sem ponto em "Outros"
+        rotulo = f"Outros ({int(resto.sum()):,} itens)"
+        outros = {eixo_valor: valores[resto].sum() if trace.type == "bar" else np.nan,
+                  eixo_categoria: "Outros", "hovertext": rotulo,
+                  # hover próprio: o template dos demais pode ler customdata, que "Outros" não tem
+                  "hovertemplate": f"<b>{rotulo}</b><br>%{{{eixo_valor}:,.2f}}<extra></extra>"}
+        if isinstance(trace.hovertemplate, str):
+            trace.hovertemplate = [trace.hovertemplate] * n
+    for prop in _PROPS_POR_PONTO:
+        v = trace[prop]
+        if v is None or isinstance(v, str) or len(v) != n:
+            continue
+        v = np.asarray(v, dtype=object if prop != eixo_valor else "float64")[idx]
+        if com_outros:
+            extra = outros.get(prop, [""] * v.shape[1] if v.ndim == 2 else "")
+            v = np.concatenate([v, np.asarray([extra], dtype=v.dtype)])
+        trace[prop] = v
+    cor = trace.marker.color if trace.marker is not None else None
+    if cor is not None and not isinstance(cor, str) and len(cor) == n:
+        cor = np.asarray(cor, dtype=object)[idx]
+        trace.marker.color = np.append(cor, "#95a5a6") if com_outros else cor
+
+
+def reduzir_traces(traces, max_pontos: int) -> bool:
+    """Limita os traces a max_pontos; os que dividem o eixo x e o tamanho usam a mesma seleção.
+
+    Assim barras e linhas do mesmo gráfico (ex.: Pareto) continuam com os
+    mesmos valores de x depois da redução.
+    """
+    grupos: dict[tuple, list] = {}
+    for t in traces:
+        # Agrupa pelo eixo das categorias/x: o Pareto põe a linha no y2, mas divide o x
+        eixo = (t.yaxis or "y") if _eixo_valor(t) == "x" else (t.xaxis or "x")
+        grupos.setdefault((eixo, _pontos(t)), []).append(t)
+    alterou = False
+    for (*_, n), grupo in grupos.items():
+        if n <= max_pontos:
+            continue
+        idx, com_outros = _selecionar(grupo, n, max_pontos)
+        for t in grupo:
+            _aplicar_selecao(t, idx, n, com_outros)
+        alterou = True
+    return alterou
+
+
+def reduzir_figura(fig, max_bytes: int, max_pontos: int) -> tuple[object, int, int]:
+    """(figura a enviar, bytes estimados da original, da enviada) dentro do orçamento.
+
+    Séries acima de max_pontos são reduzidas numa cópia da figura; se a
+    estimativa do JSON ainda passar de max_bytes, o orçamento de pontos cai
+    pela metade (até 50). A figura original não é alterada.
+    """
+    antes = estimar_bytes_figura(fig)
+    maior = max((_pontos(t) for t in fig.data), default=0)
+    if antes <= max_bytes and maior <= max_pontos:
+        return fig, antes, antes
+    while True:
+        reduzida = type(fig)(fig)
+        alterou = reduzir_traces(reduzida.data, max_pontos)
+        if alterou and reduzida.layout.height and any(
+                t.type == "bar" and t.orientation == "h" for t in reduzida.data):
+            # Altura proporcional às barras horizontais que sobraram
+            reduzida.layout.height = min(reduzida.layout.height, max(400, (max_pontos + 1) * 28))
+        depois = estimar_bytes_figura(reduzida)
+        if depois <= max_bytes or max_pontos <= 50:
+            return reduzida, antes, depois
+        max_pontos = max(50, max_pontos // 2)
@@ -0,0 +1,786 @@
+# =============================================================================
+#  RM Suite — Camada de dados da Ficha Financeira
+#
+#  Acesso ao Web Service wsConsultaSQL do RM. Os clientes SOAP ficam em um
+#  pool por processo, chaveado por (wsdl_url, usuário): o WSDL é interpretado
+#  uma vez (com cache SQLite compartilhado entre processos) e as conexões
+#  HTTP/TLS são reaproveitadas via keep-alive. Os resultados ficam em um
+#  cache LRU com TTL compartilhado entre as sessões do processo. A carga roda
+#  em segundo plano (carregar_ficha / iniciar_consulta), com progresso e
+#  cancelamento via Progresso.
+# =============================================================================
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Ajustáveis por variável de ambiente
+POOL_HTTP        = int(os.environ.get("RM_SUITE_POOL_HTTP", "10"))          # conexões por host
+CLIENTE_OCIOSO_S = int(os.environ.get("RM_SUITE_CLIENTE_OCIOSO_S", "900"))   # expira cliente sem uso
+CLIENTES_MAX     = int(os.environ.get("RM_SUITE_CLIENTES_MAX", "32"))
+WSDL_CACHE_S     = int(os.environ.get("RM_SUITE_WSDL_CACHE_S", "86400"))
+PASTA_CACHE      = os.environ.get("RM_SUITE_CACHE_DIR",
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_rmsuite"))
+WSDL_CACHE_PATH  = os.environ.get("RM_SUITE_WSDL_CACHE", os.path.join(PASTA_CACHE, "wsdl.sqlite"))
+RESULTADO_TTL_S  = int(os.environ.get("RM_SUITE_RESULTADO_TTL_S", "1800"))
+RESULTADO_MAX_MB = int(os.environ.get("RM_SUITE_RESULTADO_MAX_MB", "512"))
+# Pasta para despejo (spill) em Parquet das entradas que saem da memória; "" desliga
+RESULTADO_SPILL  = os.environ.get("RM_SUITE_RESULTADO_SPILL", os.path.join(PASTA_CACHE, "resultados"))
+PARTICOES_PARALELAS = int(os.environ.get("RM_SUITE_PARTICOES_PARALELAS", "4"))
+PASTA_PARTICOES  = os.path.join(PASTA_CACHE, "particoes")
+CONSULTAS_PARALELAS = int(os.environ.get("RM_SUITE_CONSULTAS_PARALELAS", "4"))   # cargas em segundo plano
+_BLOCO_HTTP = 64 << 10
+
+# Tag do XML de retorno → (coluna do DataFrame, tipo)
+COLUNAS_FICHA = {
+    "CODCOLIGADA":   ("Coligada",    str),
+    "NOMEFANTASIA":  ("Empresa",     str),
+    "NOME":          ("Nome",        str),
+    "FUNCAO":        ("Função",      str),
+    "SECAO":         ("Seção",       str),
+    "TIPO_EVENTO":   ("Tipo Evento", str),
+    "EVENTO":        ("Evento",      str),
+    "NROPERIODO":    ("Período",     str),
+    "MESCOMP":       ("Mês",         int),
+    "ANOCOMP":       ("Ano",         int),
+    "VALOR":         ("Valor",       float),
+    "VLR_PROV_DESC": ("Liquido",     float),
+}
+_BLOCO_PARSE = 1 << 20
+
+# Esquema compacto do DataFrame: textos repetidos por evento viram category,
+# inteiros pequenos encolhem. Valores monetários ficam em float64: float32 tem
+# ~7 dígitos significativos e perderia centavos nos totais da folha.
+SCHEMA_FICHA = {
+    "Coligada":    "int16",
+    "Empresa":     "category",
+    "Nome":        "category",
+    "Função":      "category",
+    "Seção":       "category",
+    "Tipo Evento": "category",
+    "Evento":      "category",
+    "Período":     "category",
+    "Mês":         "int8",
+    "Ano":         "int16",
+    "Valor":       "float64",
+    "Liquido":     "float64",
+}
+
+
+def _hash_senha(senha: str) -> str:
+    return hashlib.sha256(senha.encode("utf-8")).hexdigest()
+
+
+# ============================================================
+# PROGRESSO E CANCELAMENTO
+# ============================================================
+class ConsultaCancelada(Exception):
+    """A carga foi cancelada (ex.: substituída por outra com novos parâmetros)."""
+
+
+class Progresso:
+    """Contadores de uma carga (bytes recebidos, linhas lidas, partições prontas).
+
+    Atualizado pelas threads de trabalho e lido pela interface; `cancelar()`
+    faz a carga parar no próximo ponto de verificação (entre blocos HTTP,
+    blocos de parse ou partições).
+    """
+
+    def __init__(self):
+        self.bytes           = 0
+        self.linhas          = 0
+        self.particoes       = 0
+        self.particoes_total = 0
+        self.fase            = "Conectando ao RM"
+        self._lock      = threading.Lock()
+        self._cancelado = threading.Event()
+
+    def somar(self, bytes_: int = 0, linhas: int = 0, particoes: int = 0) -> None:
+        with self._lock:
+            self.bytes     += bytes_
+            self.linhas    += linhas
+            self.particoes += particoes
+
+    def cancelar(self) -> None:
+        self._cancelado.set()
+
+    @property
+    def cancelado(self) -> bool:
+        return self._cancelado.is_set()
+
+    def verificar(self) -> None:
+        if self._cancelado.is_set():
+            raise ConsultaCancelada()
+
+
+# Progresso da carga em andamento na thread atual (lido pelo transporte HTTP)
+_contexto = threading.local()
+
+
+def _progresso_atual() -> Progresso | None:
+    return getattr(_contexto, "progresso", None)
+
+
+@lru_cache(maxsize=1)
+def _classe_transporte():
+    from zeep.transports import Transport
+
+    class TransporteProgresso(Transport):
+        """Transport do zeep que lê a resposta em blocos, contando bytes e checando cancelamento."""
+
+        def post(self, address, message, headers):
+            progresso = _progresso_atual()
+            if progresso is None:
+                return super().post(address, message, headers)
+            progresso.verificar()
+            resposta = self.session.post(address, data=message, headers=headers,
+                                         timeout=self.operation_timeout, stream=True)
+            if not progresso.particoes_total:
+                progresso.fase = "Recebendo resposta do RM"
+            try:
+                partes = []
+                for parte in resposta.iter_content(_BLOCO_HTTP):
+                    progresso.verificar()
+                    partes.append(parte)
+                    progresso.somar(bytes_=len(parte))
+                resposta._content = b"".join(partes)
+            finally:
+                resposta.close()
+            return resposta
+
+    return TransporteProgresso
+
+
+# ============================================================
+# POOL DE CLIENTES SOAP
+# ============================================================
+class _ClienteRM:
+    __slots__ = ("servico", "sessao", "senha_hash", "ultimo_uso")
+
+    def __init__(self, servico, sessao, senha_hash: str):
+        self.servico    = servico
+        self.sessao     = sessao
+        self.senha_hash = senha_hash
+        self.ultimo_uso = time.monotonic()
+
+
+def _cache_wsdl():
+    from zeep.cache import InMemoryCache, SqliteCache
+    try:
+        os.makedirs(os.path.dirname(WSDL_CACHE_PATH), exist_ok=True)
+        return SqliteCache(path=WSDL_CACHE_PATH, timeout=WSDL_CACHE_S)
+    except Exception:
+        return InMemoryCache(timeout=WSDL_CACHE_S)
+
+
+class PoolClientesRM:
+    """Clientes zeep reutilizáveis por (wsdl_url, usuário), com expiração por ociosidade."""
+
+    def __init__(self, pool_http: int = POOL_HTTP, ocioso_s: int = CLIENTE_OCIOSO_S,
+                 maximo: int = CLIENTES_MAX):
+        self.pool_http = pool_http
+        self.ocioso_s  = ocioso_s
+        self.maximo    = maximo
+        self._clientes: dict[tuple[str, str], _ClienteRM] = {}
+        self._lock = threading.Lock()
+        self._cache = None
+
+    def _criar(self, wsdl_url: str, usuario: str, senha: str, senha_hash: str) -> _ClienteRM:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from zeep import Client, Settings
+
+        sessao = requests.Session()
+        sessao.auth = (usuario, senha)
+        adapter = HTTPAdapter(pool_connections=self.pool_http, pool_maxsize=self.pool_http)
+        sessao.mount("http://", adapter)
+        sessao.mount("https://", adapter)
+        if self._cache is None:
+            self._cache = _cache_wsdl()
+        # O XML do resultado vem como um único nó texto: folhas grandes passam do limite padrão do lxml
+        client = Client(wsdl_url, transport=_classe_transporte()(session=sessao, cache=self._cache),
+                        settings=Settings(xml_huge_tree=True))
+        servico = client.bind("wsConsultaSQL", "RM_IwsConsultaSQL")
+        return _ClienteRM(servico, sessao, senha_hash)
+
+    def _expirar(self, agora: float) -> None:
+        for chave, cli in list(self._clientes.items()):
+            if agora - cli.ultimo_uso > self.ocioso_s:
+                cli.sessao.close()
+                del self._clientes[chave]
+        while len(self._clientes) > self.maximo:
+            chave = min(self._clientes, key=lambda k: self._clientes[k].ultimo_uso)
+            self._clientes.pop(chave).sessao.close()
+
+    def servico(self, wsdl_url: str, usuario: str, senha: str):
+        """Retorna o proxy RM_IwsConsultaSQL, criando o cliente só se necessário."""
+        chave = (wsdl_url, usuario)
+        senha_hash = _hash_senha(senha)
+        with self._lock:
+            agora = time.monotonic()
+            self._expirar(agora)
+            cli = self._clientes.get(chave)
+            if cli is not None and cli.senha_hash == senha_hash:
+                cli.ultimo_uso = agora
+                return cli.servico
+        # Criação (download do WSDL) fora do lock para não bloquear outras sessões
+        novo = self._criar(wsdl_url, usuario, senha, senha_hash)
+        with self._lock:
+            antigo = self._clientes.get(chave)
+            if antigo is not None and antigo is not novo:
+                antigo.sessao.close()
+            self._clientes[chave] = novo
+            self._expirar(time.monotonic())
+        return novo.servico
+
+    def invalidar(self, wsdl_url: str, usuario: str) -> None:
+        with self._lock:
+            cli = self._clientes.pop((wsdl_url, usuario), None)
+        if cli is not None:
+            cli.sessao.close()
+
+
+pool_clientes = PoolClientesRM()
+
+
+def consultar_sentenca(wsdl_url: str, usuario: str, senha: str, cod_sentenca: str,
+                       cod_sistema: str, parameters: str) -> str:
+    """Executa RealizarConsultaSQL e retorna o XML de resultado."""
+    servico = pool_clientes.servico(wsdl_url, usuario, senha)
+    try:
+        return servico.RealizarConsultaSQL(codSentenca=cod_sentenca, codColigada=0,
+                                           codSistema=cod_sistema, parameters=parameters)
+    except ConsultaCancelada:
+        raise
+    except Exception:
+        # Cliente possivelmente inválido (credencial, WSDL alterado): recria na próxima
+        pool_clientes.invalidar(wsdl_url, usuario)
+        raise
+
+
+# ============================================================
+# PARSE EM STREAMING DO RESULTADO
+# ============================================================
+def aplicar_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte as colunas da ficha para os tipos compactos de SCHEMA_FICHA."""
+    if df.empty:
+        return df
+    tipos = {}
+    for coluna, tipo in SCHEMA_FICHA.items():
+        if coluna not in df.columns or str(df[coluna].dtype) == tipo:
+            continue
+        if coluna == "Coligada":
+            df[coluna] = pd.to_numeric(df[coluna], errors="coerce").fillna(0)
+        tipos[coluna] = tipo
+    return df.astype(tipos) if tipos else df
+
+
+def _blocos_resultado(resultado: str):
+    """Fatias de ~1 MB do XML contendo apenas elementos <Resultado> completos."""
+    fim = "</Resultado>"
+    pos = resultado.find("<Resultado")
+    if pos < 0:
+        return
+    while True:
+        limite = resultado.rfind(fim, pos, pos + _BLOCO_PARSE)
+        if limite < 0:
+            limite = resultado.find(fim, pos + _BLOCO_PARSE)   # registro maior que o bloco
+            if limite < 0:
+                return
+        limite += len(fim)
+        yield resultado[pos:limite]
+        pos = limite
+
+
+def parse_ficha_financeira(resultado: str | bytes, estatisticas: dict | None = None,
+                           progresso: Progresso | None = None) -> pd.DataFrame:
+    """Converte o XML de RealizarConsultaSQL em DataFrame sem materializar a árvore inteira.
+
+    O XML é processado em blocos de registros <Resultado> completos; cada bloco
+    vira uma árvore pequena, seus valores vão direto para arrays tipados por
+    coluna e a árvore é descartada antes do próximo bloco. O pico de memória
+    fica próximo do tamanho do DataFrame final. Com `progresso`, as linhas lidas
+    são somadas e o cancelamento é verificado a cada bloco.
+    """
+    inicio = time.perf_counter()
+    if isinstance(resultado, bytes):
+        resultado = resultado.decode("utf-8")
+    textos   = {tag: [] for tag, (_, tipo) in COLUNAS_FICHA.items() if tipo is str}
+    inteiros = {tag: array("q") for tag, (_, tipo) in COLUNAS_FICHA.items() if tipo is int}
+    reais    = {tag: array("d") for tag, (_, tipo) in COLUNAS_FICHA.items() if tipo is float}
+
+    linhas = 0
+    for bloco in _blocos_resultado(resultado):
+        if progresso is not None:
+            progresso.verificar()
+        linhas_bloco = linhas
+        for item in ET.fromstring(f"<Bloco>{bloco}</Bloco>"):
+            # Campos nulos são omitidos pelo DataSet do RM: lê por tag, não por posição
+            valores = {filho.tag: filho.text for filho in item}
+            for tag, coluna in textos.items():
+                coluna.append(valores.get(tag))
+            for tag, coluna in inteiros.items():
+                coluna.append(int(valores.get(tag) or 0))
+            for tag, coluna in reais.items():
+                coluna.append(float(valores.get(tag) or 0))
+            linhas += 1
+        if progresso is not None:
+            progresso.somar(linhas=linhas - linhas_bloco)
+
+    if not linhas:
+        df = pd.DataFrame()
+    else:
+        df = aplicar_schema(pd.DataFrame({
+            coluna: (textos[tag] if tipo is str else
+                     np.frombuffer(inteiros[tag], dtype=np.int64) if tipo is int else
+                     np.frombuffer(reais[tag], dtype=np.float64))
+            for tag, (coluna, tipo) in COLUNAS_FICHA.items()
+        }))
+
+    if estatisticas is not None:
+        segundos = time.perf_counter() - inicio
+        estatisticas.update({
+            "linhas": linhas, "bytes": len(resultado), "segundos": segundos,
+            "linhas_s": linhas / segundos if segundos else 0.0,
+        })
+    return df
+
+
+# ============================================================
+# CACHE COMPARTILHADO DE RESULTADOS
+# ============================================================
+class CacheResultados:
+    """LRU com TTL de DataFrames por (wsdl_url, coligada, ano), compartilhado entre sessões.
+
+    Um usuário só recebe dados do cache para uma (wsdl_url, coligada) depois de
+    ter consultado com sucesso essa coligada no servidor com as mesmas
+    credenciais (dentro do TTL) — numa carga completa ou na sondagem barata de
+    sondar_acesso. Entradas que excedem o limite de memória são despejadas em
+    Parquet na pasta de spill, se configurada.
+    """
+
+    def __init__(self, ttl_s: int = RESULTADO_TTL_S, max_bytes: int = RESULTADO_MAX_MB << 20,
+                 pasta_spill: str = RESULTADO_SPILL):
+        self.ttl_s       = ttl_s
+        self.max_bytes   = max_bytes
+        self.pasta_spill = pasta_spill
+        self._entradas: OrderedDict[tuple, tuple[pd.DataFrame, float, int]] = OrderedDict()
+        self._autorizados: dict[tuple, dict[tuple[str, str], float]] = {}
+        self._bytes = 0
+        self._geracao = 0   # muda a cada invalidar: spill em andamento é descartado
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _chave(wsdl_url: str, coligada: int, ano: int) -> tuple:
+        return (wsdl_url, int(coligada), int(ano))
+
+    def _arquivo_spill(self, chave: tuple) -> str:
+        nome = hashlib.sha1(repr(chave).encode("utf-8")).hexdigest()
+        return os.path.join(self.pasta_spill, f"{nome}.parquet")
+
+    def _autorizado(self, wsdl_url: str, coligada: int, usuario: str, senha: str, agora: float) -> bool:
+        credenciais = self._autorizados.get((wsdl_url, int(coligada)), {})
+        validado_em = credenciais.get((usuario, _hash_senha(senha)))
+        return validado_em is not None and agora - validado_em <= self.ttl_s
+
+    def autorizado(self, wsdl_url: str, coligada: int, usuario: str, senha: str) -> bool:
+        with self._lock:
+            return self._autorizado(wsdl_url, coligada, usuario, senha, time.time())
+
+    def autorizar(self, wsdl_url: str, coligada: int, usuario: str, senha: str) -> None:
+        """Registra que as credenciais consultaram a coligada com sucesso neste servidor."""
+        with self._lock:
+            self._autorizados.setdefault((wsdl_url, int(coligada)), {})[(usuario, _hash_senha(senha))] = time.time()
+
+    def _remover(self, chave: tuple) -> None:
+        _, _, tamanho = self._entradas.pop(chave)
+        self._bytes -= tamanho
+
+    def _despejar(self) -> list[tuple[tuple, pd.DataFrame, float]]:
+        """Tira da memória as entradas mais antigas além do limite (chamar com o lock).
+
+        Devolve as que ainda valem para o spill; a gravação fica com quem chamou,
+        fora do lock, para não travar as outras sessões durante o to_parquet.
+        """
+        vitimas = []
+        while self._bytes > self.max_bytes and len(self._entradas) > 1:
+            chave, (df, criado, _) = next(iter(self._entradas.items()))
+            self._remover(chave)
+            if self.pasta_spill and time.time() - criado <= self.ttl_s:
+                vitimas.append((chave, df, criado))
+        return vitimas
+
+    def _gravar_spill(self, vitimas: list[tuple[tuple, pd.DataFrame, float]], geracao: int) -> None:
+        for chave, df, criado in vitimas:
+            try:
+                os.makedirs(self.pasta_spill, exist_ok=True)
+                arquivo = self._arquivo_spill(chave)
+                df.to_parquet(arquivo, index=False)
+                os.utime(arquivo, (criado, criado))
+                with self._lock:
+                    invalidado = self._geracao != geracao
+                if invalidado:   # invalidar() rodou durante a gravação
+                    os.remove(arquivo)
+            except Exception:
+                pass
+
+    def contem(self, wsdl_url: str, coligada: int, ano: int) -> bool:
+        """Há resultado válido para a chave (em memória ou no spill), sem checar credenciais."""
+        chave = self._chave(wsdl_url, coligada, ano)
+        agora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and agora - entrada[1] <= self.ttl_s:
+                return True
+        if not self.pasta_spill:
+            return False
+        try:
+            return agora - os.path.getmtime(self._arquivo_spill(chave)) <= self.ttl_s
+        except OSError:
+            return False
+
+    def obter(self, wsdl_url: str, coligada: int, ano: int, usuario: str, senha: str) -> pd.DataFrame | None:
+        chave = self._chave(wsdl_url, coligada, ano)
+        agora = time.time()
+        with self._lock:
+            if not self._autorizado(wsdl_url, coligada, usuario, senha, agora):
+                return None
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                if agora - entrada[1] <= self.ttl_s:
+                    self._entradas.move_to_end(chave)
+                    return entrada[0]
+                self._remover(chave)
+        if not self.pasta_spill:
+            return None
+        arquivo = self._arquivo_spill(chave)
+        try:
+            criado = os.path.getmtime(arquivo)
+            if agora - criado > self.ttl_s:
+                os.remove(arquivo)
+                return None
+            df = pd.read_parquet(arquivo)
+        except (OSError, ValueError):
+            return None
+        self._inserir(chave, df, criado)
+        return df
+
+    def _inserir(self, chave: tuple, df: pd.DataFrame, criado: float) -> None:
+        tamanho = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = (df, criado, tamanho)
+            self._bytes += tamanho
+            vitimas, geracao = self._despejar(), self._geracao
+        if vitimas:
+            self._gravar_spill(vitimas, geracao)
+
+    def guardar(self, wsdl_url: str, coligada: int, ano: int, usuario: str, senha: str,
+                df: pd.DataFrame) -> None:
+        """Registra o resultado de uma consulta bem-sucedida (e valida as credenciais)."""
+        self.autorizar(wsdl_url, coligada, usuario, senha)
+        self._inserir(self._chave(wsdl_url, coligada, ano), df, time.time())
+
+    def invalidar(self, wsdl_url: str, coligada: int | None = None, ano: int | None = None) -> int:
+        """Remove as entradas do servidor (opcionalmente filtradas); retorna quantas saíram."""
+        def combina(chave):
+            return (chave[0] == wsdl_url and (coligada is None or chave[1] == int(coligada))
+                    and (ano is None or chave[2] == int(ano)))
+        with self._lock:
+            self._geracao += 1
+            chaves = [c for c in self._entradas if combina(c)]
+            for chave in chaves:
+                self._remover(chave)
+        removidas = len(chaves)
+        if self.pasta_spill and coligada is not None and ano is not None:
+            arquivo = self._arquivo_spill(self._chave(wsdl_url, coligada, ano))
+            if os.path.exists(arquivo):
+                os.remove(arquivo)
+                removidas += 1
+        elif self.pasta_spill and os.path.isdir(self.pasta_spill):
+            # Sem a chave completa não dá para derivar o nome: limpa o spill inteiro
+            for nome in os.listdir(self.pasta_spill):
+                if nome.endswith(".parquet"):
+                    os.remove(os.path.join(self.pasta_spill, nome))
+                    removidas += 1
+        return removidas
+
+
+cache_resultados = CacheResultados()
+
+
+def sondar_acesso(wsdl_url: str, usuario: str, senha: str, coligada: int,
+                  cod_sentenca: str, cod_sistema: str, mensal: bool = False) -> bool:
+    """Valida as credenciais na coligada sem trazer a folha e, se ok, autoriza o cache.
+
+    Executa a própria sentença com ANO=0 (e MES=0): o RM confere usuário, senha
+    e permissão na sentença/coligada, mas o resultado volta vazio. Assim um
+    analista novo usa o cache compartilhado sem antes baixar o ano inteiro.
+    """
+    parameters = f"CODCOLIGADA={coligada};ANO=0" + (";MES=0" if mensal else "")
+    try:
+        consultar_sentenca(wsdl_url, usuario, senha, cod_sentenca, cod_sistema, parameters)
+    except ConsultaCancelada:
+        raise
+    except Exception:
+        return False
+    cache_resultados.autorizar(wsdl_url, coligada, usuario, senha)
+    return True
+
+
+# ============================================================
+# BUSCA INCREMENTAL MÊS A MÊS
+# ============================================================
+def mes_fechado(ano: int, mes: int, hoje: date | None = None) -> bool:
+    """Competência anterior ao mês corrente: não muda mais e pode ficar em cache."""
+    hoje = hoje or date.today()
+    return (ano, mes) < (hoje.year, hoje.month)
+
+
+class CacheParticoes:
+    """Meses fechados da folha em Parquet, sem expiração, por (wsdl_url, coligada, ano, mês)."""
+
+    def __init__(self, pasta: str = PASTA_PARTICOES):
+        self.pasta = pasta
+
+    def _arquivo(self, wsdl_url: str, coligada: int, ano: int, mes: int) -> str:
+        nome = hashlib.sha1(wsdl_url.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.pasta, nome, f"{int(coligada)}_{int(ano)}_{int(mes):02d}.parquet")
+
+    def obter(self, wsdl_url: str, coligada: int, ano: int, mes: int) -> pd.DataFrame | None:
+        try:
+            return pd.read_parquet(self._arquivo(wsdl_url, coligada, ano, mes))
+        except (OSError, ValueError):
+            return None
+
+    def contem(self, wsdl_url: str, coligada: int, ano: int, mes: int) -> bool:
+        return os.path.exists(self._arquivo(wsdl_url, coligada, ano, mes))
+
+    def guardar(self, wsdl_url: str, coligada: int, ano: int, mes: int, df: pd.DataFrame) -> None:
+        arquivo = self._arquivo(wsdl_url, coligada, ano, mes)
+        os.makedirs(os.path.dirname(arquivo), exist_ok=True)
+        tmp = f"{arquivo}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, arquivo)
+
+    def invalidar(self, wsdl_url: str, coligada: int, ano: int) -> None:
+        for mes in range(1, 13):
+            arquivo = self._arquivo(wsdl_url, coligada, ano, mes)
+            if os.path.exists(arquivo):
+                os.remove(arquivo)
+
+
+cache_particoes = CacheParticoes()
+
+
+def buscar_ano_particionado(wsdl_url: str, usuario: str, senha: str, coligada: int, ano: int,
+                            cod_sentenca: str, cod_sistema: str,
+                            max_paralelo: int = PARTICOES_PARALELAS,
+                            ao_concluir=None, progresso: Progresso | None = None) -> pd.DataFrame:
+    """Busca o ano por competência (ano, mês), com paralelismo limitado.
+
+    Meses fechados vêm do cache de partições (se o usuário já validou acesso à
+    coligada, ou passa agora em sondar_acesso); só os demais vão ao RM. A sentença deve aceitar os parâmetros
+    CODCOLIGADA, ANO e MES. `ao_concluir(mes, df_mes, do_cache, total)` é chamado
+    à medida que cada partição fica pronta. Se `progresso` for cancelado, as
+    partições ainda não iniciadas são descartadas e ConsultaCancelada é levantada.
+    """
+    hoje = date.today()
+    meses = [m for m in range(1, 13) if (ano, m) <= (hoje.year, hoje.month)]
+    autorizado = cache_resultados.autorizado(wsdl_url, coligada, usuario, senha)
+    if not autorizado and any(mes_fechado(ano, m, hoje) and cache_particoes.contem(wsdl_url, coligada, ano, m)
+                              for m in meses):
+        autorizado = sondar_acesso(wsdl_url, usuario, senha, coligada, cod_sentenca, cod_sistema, mensal=True)
+    partes: dict[int, pd.DataFrame] = {}
+    pendentes = []
+    if progresso is not None:
+        progresso.particoes_total = len(meses)
+    for mes in meses:
+        df_mes = cache_particoes.obter(wsdl_url, coligada, ano, mes) if autorizado and mes_fechado(ano, mes, hoje) else None
+        if df_mes is None:
+            pendentes.append(mes)
+        else:
+            partes[mes] = df_mes
+            if progresso is not None:
+                progresso.somar(linhas=len(df_mes), particoes=1)
+            if ao_concluir:
+                ao_concluir(mes, df_mes, True, len(meses))
+
+    def buscar_mes(mes: int) -> pd.DataFrame:
+        _contexto.progresso = progresso
+        try:
+            if progresso is not None:
+                progresso.verificar()
+            parameters = f"CODCOLIGADA={coligada};ANO={ano};MES={mes}"
+            xml = consultar_sentenca(wsdl_url, usuario, senha, cod_sentenca, cod_sistema, parameters)
+            return parse_ficha_financeira(xml, progresso=progresso)
+        finally:
+            _contexto.progresso = None
+
+    if pendentes:
+        if progresso is not None:
+            progresso.fase = "Buscando competências no RM"
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_paralelo, len(pendentes))))
+        try:
+            futuros = {executor.submit(buscar_mes, mes): mes for mes in pendentes}
+            for futuro in as_completed(futuros):
+                mes = futuros[futuro]
+                df_mes = futuro.result()
+                partes[mes] = df_mes
+                if mes_fechado(ano, mes, hoje):
+                    cache_particoes.guardar(wsdl_url, coligada, ano, mes, df_mes)
+                if progresso is not None:
+                    progresso.somar(particoes=1)
+                if ao_concluir:
+                    ao_concluir(mes, df_mes, False, len(meses))
+        finally:
+            # Em erro/cancelamento, meses ainda na fila não chegam a ir ao RM
+            executor.shutdown(wait=True, cancel_futures=True)
+        cache_resultados.autorizar(wsdl_url, coligada, usuario, senha)
+
+    # Categorias diferem entre meses: o concat volta a texto e o schema recodifica
+    frames = [partes[m] for m in sorted(partes) if not partes[m].empty]
+    return aplicar_schema(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame()
+
+
+# ============================================================
+# CARGA EM SEGUNDO PLANO
+# ============================================================
+def carregar_ficha(wsdl_url: str, usuario: str, senha: str, coligada: int, ano: int,
+                   cod_sentenca: str, cod_sistema: str, mensal: bool = False,
+                   progresso: Progresso | None = None) -> tuple[pd.DataFrame, dict]:
+    """Carrega a ficha financeira de (coligada, ano) e retorna (df, estatísticas).
+
+    Com `mensal`, `cod_sentenca` é a sentença por competência e o ano vem de
+    buscar_ano_particionado; senão, do cache de resultados (validando antes as
+    credenciais com sondar_acesso, se preciso) ou de uma única chamada ao RM.
+    Não depende do Streamlit e pode rodar em qualquer thread.
+    """
+    progresso = progresso or Progresso()
+    if mensal:
+        particoes_rm = []
+
+        def contar(mes, df_mes, do_cache, total):
+            if not do_cache:
+                particoes_rm.append(mes)
+
+        df = buscar_ano_particionado(wsdl_url, usuario, senha, coligada, ano, cod_sentenca,
+                                     cod_sistema, ao_concluir=contar, progresso=progresso)
+        return df, {"particoes": progresso.particoes_total, "particoes_rm": len(particoes_rm)}
+
+    if (not cache_resultados.autorizado(wsdl_url, coligada, usuario, senha)
+            and cache_resultados.contem(wsdl_url, coligada, ano)):
+        sondar_acesso(wsdl_url, usuario, senha, coligada, cod_sentenca, cod_sistema)
+    df = cache_resultados.obter(wsdl_url, coligada, ano, usuario, senha)
+    if df is not None:
+        progresso.somar(linhas=len(df))
+        return df, {"cache": True}
+
+    _contexto.progresso = progresso
+    try:
+        xml = consultar_sentenca(wsdl_url, usuario, senha, cod_sentenca, cod_sistema,
+                                 f"CODCOLIGADA={coligada};ANO={ano}")
+    finally:
+        _contexto.progresso = None
+    progresso.fase = "Processando XML"
+    estatisticas: dict = {}
+    df = parse_ficha_financeira(xml, estatisticas, progresso)
+    progresso.verificar()
+    cache_resultados.guardar(wsdl_url, coligada, ano, usuario, senha, df)
+    return df, estatisticas
+
+
+_executor_consultas = ThreadPoolExecutor(max_workers=CONSULTAS_PARALELAS,
+                                         thread_name_prefix="rm-consulta")
+
+
+class TarefaConsulta:
+    """Uma carga de carregar_ficha rodando no executor do processo."""
+
+    def __init__(self, chave: tuple, futuro, progresso: Progresso):
+        self.chave     = chave
+        self.futuro    = futuro
+        self.progresso = progresso
+        self.inicio    = time.monotonic()
+
+    @property
+    def concluida(self) -> bool:
+        return self.futuro.done()
+
+    @property
+    def segundos(self) -> float:
+        return time.monotonic() - self.inicio
+
+    def cancelar(self) -> None:
+        self.progresso.cancelar()
+        self.futuro.cancel()
+
+    def resultado(self) -> tuple[pd.DataFrame, dict]:
+        """(df, estatísticas); relança o erro da carga ou ConsultaCancelada."""
+        if self.futuro.cancelled():
+            raise ConsultaCancelada()
+        return self.futuro.result()
+
+
+def iniciar_consulta(wsdl_url: str, usuario: str, senha: str, coligada: int, ano: int,
+                     cod_sentenca: str, cod_sistema: str, mensal: bool = False) -> TarefaConsulta:
+    """Dispara carregar_ficha em segundo plano e retorna a tarefa para acompanhamento."""
+    progresso = Progresso()
+    futuro = _executor_consultas.submit(carregar_ficha, wsdl_url, usuario, senha, coligada, ano,
+                                        cod_sentenca, cod_sistema, mensal, progresso)
+    return TarefaConsulta((wsdl_url, usuario, int(coligada), int(ano), mensal), futuro, progresso)
+
+
+# ============================================================
+# EXPORTAÇÃO
+# ============================================================
+FORMATOS_EXPORTACAO = {"csv": ".csv", "csv.gz": ".csv.gz", "parquet": ".parquet"}
+
+
+def exportar_dados(df: pd.DataFrame, destino: str, formato: str = "csv",
+                   linhas_por_bloco: int = 100_000) -> dict:
+    """Grava `df` em `destino` bloco a bloco e retorna {linhas, bytes, segundos}.
+
+    CSV (opcionalmente gzip) no padrão do dashboard (sep=";", decimal=",") ou
+    Parquet via pyarrow.ParquetWriter: só um bloco é convertido por vez, sem
+    montar o arquivo inteiro em memória.
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato de exportação inválido: {formato!r}")
+    inicio = time.perf_counter()
+    blocos = (df.iloc[i:i + linhas_por_bloco] for i in range(0, max(len(df), 1), linhas_por_bloco))
+    if formato == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        escritor = None
+        try:
+            for bloco in blocos:
+                tabela = pa.Table.from_pandas(bloco, preserve_index=False)
+                if escritor is None:
+                    escritor = pq.ParquetWriter(destino, tabela.schema)
+                escritor.write_table(tabela)
+        finally:
+            if escritor is not None:
+                escritor.close()
+    else:
+        abrir = gzip.open if formato == "csv.gz" else open
+        with abrir(destino, "wt", encoding="utf-8", newline="") as arquivo:
+            for i, bloco in enumerate(blocos):
+                bloco.to_csv(arquivo, index=False, header=i == 0, sep=";", decimal=",")
+    return {"linhas": len(df), "bytes": os.path.getsize(destino),
+            "segundos": time.perf_counter() - inicio}
@@ -0,0 +1,334 @@
+# =============================================================================
+#  RM Suite — Envelope de Pagamento da Ficha Financeira
+#
+#  O DataFrame carregado é indexado uma única vez por (Nome, Mês, Período);
+#  gerar um envelope é buscar as posições dessa chave, sem varrer o frame com
+#  máscaras. As linhas (código do evento, valores formatados e <tr> do HTML)
+#  são montadas com operações vetorizadas sobre todos os lançamentos do lote
+#  de uma vez, o que permite gerar os envelopes de um período inteiro
+#  (EnvelopesFicha.lote). exportar_periodo grava todos os envelopes de um
+#  (Mês, Período) em um ZIP: blocos de funcionários são montados em um pool
+#  de processos e cada bloco vai para o arquivo assim que fica pronto.
+# =============================================================================
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from ficha_analise import fmt, fmt_serie
+
+# Ajustáveis por variável de ambiente
+EXPORTACAO_PROCESSOS    = int(os.environ.get("RM_SUITE_EXPORTACAO_PROCESSOS", str(os.cpu_count() or 1)))
+EXPORTACAO_MIN_PARALELO = int(os.environ.get("RM_SUITE_EXPORTACAO_MIN_PARALELO", "2000"))  # envelopes
+EXPORTACAO_BLOCO        = int(os.environ.get("RM_SUITE_EXPORTACAO_BLOCO", "500"))          # envelopes por tarefa
+
+CHAVE_ENVELOPE = ["Nome", "Mês", "Período"]
+
+CSS_ENVELOPE = """
+<style>
+.envelope-wrap { font-family: Arial, sans-serif; font-size: 13px; color: #e0e0e0; }
+.envelope-wrap table { width: 100%; border-collapse: collapse; background: #1e1e2e; border-radius: 8px; overflow: hidden; }
+.envelope-wrap .title-row td { background: #2d2d44; text-align: center; font-weight: bold; font-size: 15px; padding: 10px; letter-spacing: 1px; color: #ffffff; border-bottom: 2px solid #444; }
+.envelope-wrap .func-row td { background: #252535; padding: 6px 10px; font-weight: bold; color: #ccc; border-bottom: 1px solid #444; text-align: center; }
+.envelope-wrap .header-row td { background: #2d2d44; padding: 7px 10px; color: #aaa; font-size: 12px; border-bottom: 2px solid #555; font-weight: bold; text-transform: uppercase; }
+.envelope-wrap tbody tr:nth-child(even) { background: #1a1a2e; }
+.envelope-wrap tbody tr:nth-child(odd)  { background: #1e1e2e; }
+.envelope-wrap tbody td { padding: 6px 10px; border-bottom: 1px solid #2a2a3e; text-align: center; }
+.envelope-wrap .totals-row td { background: #252535; padding: 7px 10px; font-weight: bold; text-align: right; border-top: 2px solid #555; color: #ccc; }
+.envelope-wrap .liquido-row td { background: #1c3a2a; padding: 8px 10px; font-weight: bold; text-align: right; color: #2ecc71; font-size: 14px; border-top: 2px solid #2ecc71; }
+</style>"""
+
+
+class Envelope(NamedTuple):
+    nome: str
+    empresa: str
+    rotulo_periodo: str      # ex.: "Mar/2024 — Período 1"
+    linhas: pd.DataFrame     # Evento, Proventos, Descontos (textos formatados)
+    linhas_html: str         # <tr> das linhas, na mesma ordem
+    linhas_csv: str          # linhas do CSV (sep=";"), cada uma terminada em "\n"
+    total_proventos: float
+    total_descontos: float
+
+    @property
+    def liquido(self) -> float:
+        return self.total_proventos - self.total_descontos
+
+    def html(self, com_estilo: bool = True) -> str:
+        return f"""{CSS_ENVELOPE if com_estilo else ""}
+<div class="envelope-wrap"><table><tbody>
+    <tr class="title-row"><td colspan="3">ENVELOPE DE PAGAMENTO</td></tr>
+    <tr class="func-row"><td colspan="3">FUNCIONÁRIO: {self.nome} &nbsp;|&nbsp; EMPRESA: {self.empresa} &nbsp;|&nbsp; PERÍODO: {self.rotulo_periodo}</td></tr>
+    <tr class="header-row"><td style="text-align:center;width:60%">DESCRIÇÃO</td><td style="text-align:right;width:20%">PROVENTOS</td><td style="text-align:right;width:20%">DESCONTOS</td></tr>
+    {self.linhas_html}
+</tbody>
+    <tr class="totals-row"><td style="text-align:right;color:#aaa">Totais</td><td>{fmt(self.total_proventos)}</td><td>{fmt(self.total_descontos)}</td></tr>
+    <tr class="liquido-row"><td style="text-align:left">💰 LÍQUIDO</td><td></td><td>{fmt(self.liquido)}</td></tr>
+</table></div>"""
+
+    def csv(self) -> bytes:
+        return ("Evento;Proventos;Descontos\n" + self.linhas_csv).encode("utf-8")
+
+
+def normalizar_eventos(eventos: pd.Series) -> np.ndarray:
+    """Textos dos eventos, com códigos numéricos sem casas decimais ("123.0" -> "123").
+
+    Em colunas category a conversão é feita só sobre as categorias.
+    """
+    if isinstance(eventos.dtype, pd.CategoricalDtype):
+        categorias = normalizar_eventos(eventos.cat.categories.to_series())
+        codigos = eventos.cat.codes.to_numpy()
+        return np.where(codigos >= 0, categorias[codigos], "nan").astype(object)
+    textos = eventos.astype(str).reset_index(drop=True)
+    numericos = textos.str.replace(".", "", regex=False).str.isdigit()
+    if numericos.any():
+        numeros = pd.to_numeric(textos[numericos], errors="coerce").dropna()
+        textos[numeros.index] = np.trunc(numeros.to_numpy()).astype("int64").astype(str)
+    return textos.to_numpy(dtype=object)
+
+
+class EnvelopesFicha:
+    """Envelopes de pagamento de um DataFrame fixo, agrupado uma vez por CHAVE_ENVELOPE."""
+
+    def __init__(self, df: pd.DataFrame, nomes_meses: dict[int, str] | None = None):
+        self.df = df
+        self.nomes_meses = nomes_meses or {}
+        # Linhas ordenadas por grupo (estável): as posições de um grupo são
+        # ordem[inicio[g]:inicio[g + 1]], em ordem crescente
+        grupo = (df.groupby(CHAVE_ENVELOPE, observed=True, sort=False).ngroup()
+                   .fillna(-1).to_numpy(dtype="int64"))
+        n_grupos = int(grupo.max()) + 1 if len(grupo) else 0
+        validas = grupo >= 0                      # -1: chave com nulo, fica no fim
+        chave_ordem  = np.where(validas, grupo, n_grupos)
+        self._ordem  = np.argsort(chave_ordem, kind="stable")
+        self._inicio = np.searchsorted(chave_ordem[self._ordem], np.arange(n_grupos + 1))
+        _, primeiras = np.unique(grupo[validas], return_index=True)
+        # Uma linha por grupo (o índice é o número do grupo)
+        self._chaves = df[CHAVE_ENVELOPE].iloc[np.flatnonzero(validas)[primeiras]].reset_index(drop=True)
+        self._evento = None
+
+    def nomes(self) -> list:
+        return sorted(self._chaves["Nome"].unique().tolist())
+
+    def meses(self) -> list:
+        return sorted(self._chaves["Mês"].unique().tolist())
+
+    def periodos(self, mes, nome=None) -> list:
+        """Períodos do funcionário no mês; sem lançamentos dele, os de todo o mês."""
+        do_mes = self._chaves[self._chaves["Mês"] == mes]
+        do_nome = do_mes.loc[do_mes["Nome"] == nome, "Período"]
+        return sorted((do_nome if not do_nome.empty else do_mes["Período"]).unique().tolist())
+
+    def _grupos_periodo(self, mes, periodo) -> pd.Series:
+        """Número do grupo de cada Nome no (Mês, Período), indexado por Nome."""
+        chaves = self._chaves
+        do_periodo = chaves[(chaves["Mês"] == mes) & (chaves["Período"] == periodo)]
+        return pd.Series(do_periodo.index.to_numpy(), index=do_periodo["Nome"].to_numpy())
+
+    def funcionarios(self, mes, periodo) -> list:
+        """Nomes com lançamentos no (Mês, Período), em ordem alfabética."""
+        return sorted(self._grupos_periodo(mes, periodo).index.tolist())
+
+    def _eventos(self) -> np.ndarray:
+        if self._evento is None:
+            self._evento = normalizar_eventos(self.df["Evento"])
+        return self._evento
+
+    def _rotulo(self, mes, ano: int | None, periodo) -> str:
+        nome_mes = self.nomes_meses.get(int(mes), str(mes))
+        return f"{nome_mes}/{ano} — Período {periodo}" if ano is not None else f"{nome_mes} — Período {periodo}"
+
+    def _posicoes(self, grupos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(posições das linhas, índice em `grupos` de cada uma), grupo após grupo."""
+        inicios  = self._inicio[grupos]
+        tamanhos = self._inicio[grupos + 1] - inicios
+        grupo = np.repeat(np.arange(len(grupos)), tamanhos)
+        deslocamento = np.arange(len(grupo)) - np.repeat(np.cumsum(tamanhos) - tamanhos, tamanhos)
+        return self._ordem[np.repeat(inicios, tamanhos) + deslocamento], grupo
+
+    def recorte(self, mes, periodo, nomes: list) -> pd.DataFrame:
+        """Lançamentos de `nomes` no (Mês, Período), para montar os envelopes em outro processo."""
+        do_periodo = self._grupos_periodo(mes, periodo)
+        pos, _ = self._posicoes(do_periodo.reindex(nomes).dropna().to_numpy(dtype="int64"))
+        return self.df.take(np.sort(pos))
+
+    def envelope(self, nome, mes, periodo) -> Envelope | None:
+        """Envelope de um funcionário, ou None se não houver lançamentos na chave."""
+        return next(self.lote(mes, periodo, [nome]), None)
+
+    def lote(self, mes, periodo, nomes: list | None = None) -> Iterator[Envelope]:
+        """Envelopes do (Mês, Período) para `nomes` (padrão: todos), montados em um só passe.
+
+        Os valores são formatados e as <tr> concatenadas uma vez para todos os
+        lançamentos do lote; cada envelope é então só uma fatia contígua.
+        """
+        do_periodo = self._grupos_periodo(mes, periodo)
+        if nomes is None:
+            do_periodo = do_periodo.sort_index()
+        else:
+            do_periodo = do_periodo.reindex([n for n in nomes if n in do_periodo.index])
+        if do_periodo.empty:
+            return
+        nomes  = do_periodo.index.tolist()
+        n      = len(nomes)
+        pos, grupo = self._posicoes(do_periodo.to_numpy())
+
+        # Proventos antes dos descontos, preservando a ordem de cada funcionário;
+        # lançamentos de outros tipos não entram no envelope
+        tipo   = self.df["Tipo Evento"].to_numpy()[pos]
+        ordem  = np.where(tipo == "Provento", 0, np.where(tipo == "Desconto", 1, 2))
+        seq    = np.lexsort((ordem, grupo))
+        seq    = seq[ordem[seq] < 2]
+        pos, grupo = pos[seq], grupo[seq]
+        limites = np.searchsorted(grupo, np.arange(n + 1))
+
+        e_provento = ordem[seq] == 0
+        valores = self.df["Valor"].to_numpy(dtype="float64")[pos]
+        texto_valor = fmt_serie(valores).to_numpy()
+        linhas = pd.DataFrame({
+            "Evento":    self._eventos()[pos],
+            "Proventos": np.where(e_provento, texto_valor, ""),
+            "Descontos": np.where(e_provento, "", texto_valor),
+        })
+        evento_csv = linhas["Evento"].where(~linhas["Evento"].str.contains('[;"\n]', regex=True),
+                                            '"' + linhas["Evento"].str.replace('"', '""', regex=False) + '"')
+        csv = (evento_csv + ";" + linhas["Proventos"] + ";" + linhas["Descontos"] + "\n").to_numpy()
+        tr = ("<tr><td style='text-align:center'>" + linhas["Evento"]
+              + "</td><td style='text-align:right'>" + linhas["Proventos"]
+              + "</td><td style='text-align:right'>" + linhas["Descontos"] + "</td></tr>").to_numpy()
+        total_prov = np.bincount(grupo, weights=np.where(e_provento, valores, 0.0), minlength=n)
+        total_desc = np.bincount(grupo, weights=np.where(e_provento, 0.0, valores), minlength=n)
+
+        primeiras = self._ordem[self._inicio[do_periodo.to_numpy()]]
+        anos = self.df["Ano"].to_numpy()[primeiras] if "Ano" in self.df.columns else [None] * n
+        empresas = self.df["Empresa"].to_numpy()[primeiras] if "Empresa" in self.df.columns else [""] * n
+        for i, nome in enumerate(nomes):
+            ini, fim = limites[i], limites[i + 1]
+            ano = int(anos[i]) if anos[i] is not None else None
+            yield Envelope(
+                nome=nome,
+                empresa=empresas[i],
+                rotulo_periodo=self._rotulo(mes, ano, periodo),
+                linhas=linhas.iloc[ini:fim].reset_index(drop=True),
+                linhas_html="".join(tr[ini:fim]),
+                linhas_csv="".join(csv[ini:fim]),
+                total_proventos=float(total_prov[i]),
+                total_descontos=float(total_desc[i]),
+            )
+
+
+_DOCUMENTO_HTML = ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>{titulo}</title>{estilo}</head>'
+                   '<body style="background:#111;padding:16px">')
+_SEPARADOR_HTML = '<div style="page-break-after:always;height:24px"></div>'
+_CABECALHO_CSV  = "Funcionário;Evento;Proventos;Descontos\n"
+
+
+def nome_arquivo(nome: str, extensao: str) -> str:
+    return f"envelope_{str(nome).replace(' ', '_').replace('/', '_')}.{extensao}"
+
+
+def _renderizar_bloco(df: pd.DataFrame, nomes_meses: dict, mes, periodo, formato: str,
+                      combinado: bool) -> tuple[int, list[tuple[str, bytes]]]:
+    """(quantidade, [(arquivo, conteúdo)]) dos envelopes de um bloco; roda no pool de processos.
+
+    No modo combinado devolve um único trecho, sem nome, para ser anexado ao arquivo do lote.
+    """
+    envelopes = list(EnvelopesFicha(df, nomes_meses).lote(mes, periodo))
+    if formato == "csv":
+        if combinado:
+            # Prefixa cada linha do envelope com o nome do funcionário
+            partes = []
+            for e in envelopes:
+                if e.linhas_csv:
+                    prefixo = (f'"{e.nome}"' if ";" in str(e.nome) else str(e.nome)) + ";"
+                    partes.append(prefixo + e.linhas_csv[:-1].replace("\n", "\n" + prefixo) + "\n")
+            texto = "".join(partes)
+            return len(envelopes), [("", texto.encode("utf-8"))]
+        return len(envelopes), [(nome_arquivo(e.nome, "csv"), e.csv()) for e in envelopes]
+    if combinado:
+        texto = "".join(e.html(com_estilo=False) + _SEPARADOR_HTML for e in envelopes)
+        return len(envelopes), [("", texto.encode("utf-8"))]
+    return len(envelopes), [
+        (nome_arquivo(e.nome, "html"),
+         (_DOCUMENTO_HTML.format(titulo=e.nome, estilo=CSS_ENVELOPE) + e.html(com_estilo=False)
+          + "</body></html>").encode("utf-8"))
+        for e in envelopes]
+
+
+def _em_ordem(executor, funcao, tarefas, janela: int):
+    """Resultados de `funcao(*tarefa)` na ordem das tarefas, com no máximo `janela` em voo."""
+    pendentes = deque()
+    for tarefa in tarefas:
+        pendentes.append(executor.submit(funcao, *tarefa))
+        if len(pendentes) >= janela:
+            yield pendentes.popleft().result()
+    while pendentes:
+        yield pendentes.popleft().result()
+
+
+def exportar_periodo(envelopes: EnvelopesFicha, mes, periodo, destino, formato: str = "html",
+                     combinado: bool = False, processos: int | None = None,
+                     progresso: Callable[[int, int], None] | None = None) -> dict:
+    """Grava em `destino` (caminho ou arquivo binário) um ZIP com os envelopes do (Mês, Período).
+
+    `formato` é "html" ou "csv"; com `combinado`, o ZIP tem um único arquivo
+    com todos os funcionários em vez de um por funcionário. Os blocos de
+    EXPORTACAO_BLOCO envelopes são montados em processos separados quando o
+    lote tem ao menos EXPORTACAO_MIN_PARALELO envelopes, e cada bloco é
+    comprimido e descartado assim que chega: só os blocos em voo ficam em
+    memória. Devolve as estatísticas (envelopes, bytes, segundos, envelopes/s).
+    """
+    if formato not in ("html", "csv"):
+        raise ValueError(f"Formato de exportação inválido: {formato!r}")
+    inicio = time.perf_counter()
+    nomes  = envelopes.funcionarios(mes, periodo)
+    blocos = [nomes[i:i + EXPORTACAO_BLOCO] for i in range(0, len(nomes), EXPORTACAO_BLOCO)]
+    tarefas = ((envelopes.recorte(mes, periodo, bloco), envelopes.nomes_meses, mes, periodo, formato, combinado)
+               for bloco in blocos)
+    processos = min(processos or EXPORTACAO_PROCESSOS, len(blocos))
+    paralelo  = processos > 1 and len(nomes) >= EXPORTACAO_MIN_PARALELO
+
+    feitos = bytes_ = 0
+    # spawn: o servidor do Streamlit tem threads, e fork copiaria locks em uso
+    executor = (ProcessPoolExecutor(processos, mp_context=multiprocessing.get_context("spawn"))
+                if paralelo else None)
+    try:
+        resultados = (_em_ordem(executor, _renderizar_bloco, tarefas, 2 * processos) if paralelo
+                      else (_renderizar_bloco(*tarefa) for tarefa in tarefas))
+        with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            combinado_arq = (zf.open(f"envelopes_{mes}_{periodo}.{formato}", "w", force_zip64=True)
+                             if combinado else None)
+            if combinado_arq is not None:
+                topo = (_CABECALHO_CSV if formato == "csv" else
+                        _DOCUMENTO_HTML.format(titulo=f"Envelopes {mes}/{periodo}", estilo=CSS_ENVELOPE))
+                combinado_arq.write(topo.encode("utf-8"))
+            for quantidade, arquivos in resultados:
+                for arquivo, conteudo in arquivos:
+                    if combinado_arq is not None:
+                        combinado_arq.write(conteudo)
+                    else:
+                        zf.writestr(arquivo, conteudo)
+                    bytes_ += len(conteudo)
+                feitos += quantidade
+                if progresso is not None:
+                    progresso(feitos, len(nomes))
+            if combinado_arq is not None:
+                if formato == "html":
+                    combinado_arq.write(b"</body></html>")
+                combinado_arq.close()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    segundos = time.perf_counter() - inicio
+    return {"envelopes": feitos, "bytes": bytes_, "segundos": segundos,
+            "envelopes_s": feitos / segundos if segundos else 0.0,
+            "processos": processos if paralelo else 1}
@@ -0,0 +1,406 @@
+# =============================================================================
+#  RM Suite — Análise de sentenças T-SQL do SQL Maker
+#
+#  Tokenizador de T-SQL (comentários, literais, [identificadores], N'...')
+#  e analisador do SELECT principal: colunas de saída, tabelas do FROM com
+#  seus JOINs e todas as tabelas citadas, inclusive em subconsultas. O
+#  tokenizador é incremental: guarda os tokens do último texto e, a cada
+#  edição, reaproveita os que terminam antes do primeiro caractere alterado,
+#  então digitar no fim de uma sentença longa só reescaneia o trecho novo.
+# =============================================================================
+
+from __future__ import annotations
+
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from typing import NamedTuple
+
+_PADRAO_TOKEN = re.compile(r"""
+    (?P<espaco>\s+)
+  | (?P<comentario>--[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<texto>N?'(?:[^']|'')*(?:'|\Z))
+  | (?P<nome>\[(?:[^\]]|\]\])*(?:\]|\Z)|"(?:[^"]|"")*(?:"|\Z))
+  | (?P<numero>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<variavel>@@?\w+)
+  | (?P<palavra>[^\W\d]\w*|\#\#?\w+)
+  | (?P<operador><>|!=|!<|!>|>=|<=|[-+*/%=<>!&|^~])
+  | (?P<simbolo>[(),.;])
+  | (?P<outro>.)
+""", re.VERBOSE | re.DOTALL)
+
+_IGNORADOS = {"espaco", "comentario"}
+_DICAS = {"NOLOCK", "READUNCOMMITTED", "READPAST", "NOWAIT", "ROWLOCK", "PAGLOCK", "UPDLOCK",
+          "HOLDLOCK", "TABLOCK", "TABLOCKX", "XLOCK", "INDEX", "FORCESEEK", "FORCESCAN"}
+
+# Palavras que encerram a lista do SELECT / o FROM no mesmo nível
+_FIM_SELECT = {"FROM", "INTO", "WHERE", "GROUP", "HAVING", "ORDER", "UNION", "EXCEPT", "INTERSECT", "OPTION", "FOR"}
+_FIM_FROM = _FIM_SELECT - {"FROM", "INTO"}
+_INICIO_JUNCAO = {"INNER", "LEFT", "RIGHT", "FULL", "CROSS", "OUTER", "JOIN"}
+# Palavras que nunca são apelido implícito de coluna/tabela
+_RESERVADAS = _FIM_SELECT | _INICIO_JUNCAO | {
+    "SELECT", "AS", "ON", "WITH", "AND", "OR", "NOT", "CASE", "WHEN", "THEN", "ELSE", "END",
+    "IS", "NULL", "IN", "LIKE", "BETWEEN", "EXISTS", "DISTINCT", "TOP", "ALL", "APPLY", "BY",
+}
+
+
+class Token(NamedTuple):
+    tipo: str
+    texto: str
+    inicio: int
+    fim: int
+
+    @property
+    def chave(self) -> str:
+        """Palavra em maiúsculas (para comparar com palavras-chave)."""
+        return self.texto.upper() if self.tipo == "palavra" else ""
+
+
+class Coluna(NamedTuple):
+    nome: str            # nome da coluna no resultado ("" quando o SQL Server não dá nome)
+    expressao: str
+    tabela: str = ""     # prefixo da referência simples (tabela ou apelido)
+    campo: str = ""      # campo da referência simples
+
+    @property
+    def rotulo(self) -> str:
+        """Nome para exibição: o nome, ou FUNC_CAMPO para agregações sem AS."""
+        if self.nome:
+            return self.nome
+        chamada = re.fullmatch(r"\s*(\w+)\s*\(\s*(?:DISTINCT\s+)?([\w.\[\]]+)\s*\)\s*", self.expressao, re.IGNORECASE)
+        if chamada:
+            return f"{chamada.group(1).upper()}_{_sem_aspas(chamada.group(2).split('.')[-1])}"
+        return self.expressao
+
+
+class TabelaSQL(NamedTuple):
+    nome: str            # tabela (ou "(subconsulta)")
+    apelido: str
+    juncao: str          # FROM, INNER, LEFT, RIGHT, FULL, CROSS, APPLY
+    condicao: str = ""   # texto do ON
+
+
+class AnaliseSQL(NamedTuple):
+    colunas: tuple[Coluna, ...]
+    tabelas: tuple[TabelaSQL, ...]      # FROM/JOINs do SELECT principal, na ordem
+    referenciadas: tuple[str, ...]      # todas as tabelas citadas (inclui subconsultas)
+    erros: tuple[str, ...]
+
+    @property
+    def juncoes(self) -> tuple[TabelaSQL, ...]:
+        return tuple(t for t in self.tabelas if t.juncao != "FROM")
+
+
+def _sem_aspas(nome: str) -> str:
+    if nome[:1] == "[" and nome[-1:] == "]":
+        return nome[1:-1].replace("]]", "]")
+    if nome[:1] in "\"'" and nome[-1:] == nome[:1] and len(nome) > 1:
+        return nome[1:-1].replace(nome[0] * 2, nome[0])
+    return nome
+
+
+# ============================================================
+# TOKENIZAÇÃO
+# ============================================================
+def tokenizar(texto: str, inicio: int = 0) -> list[Token]:
+    """Todos os tokens (inclusive espaços e comentários) a partir de `inicio`."""
+    tokens, pos, fim = [], inicio, len(texto)
+    casar = _PADRAO_TOKEN.match
+    while pos < fim:
+        m = casar(texto, pos)
+        tokens.append(Token(m.lastgroup, m.group(), pos, m.end()))
+        pos = m.end()
+    return tokens
+
+
+def _prefixo_comum(a: str, b: str) -> int:
+    """Tamanho do prefixo comum, por busca binária em comparações de fatias."""
+    baixo, alto = 0, min(len(a), len(b))
+    while baixo < alto:
+        meio = (baixo + alto + 1) // 2
+        if a[:meio] == b[:meio]:
+            baixo = meio
+        else:
+            alto = meio - 1
+    return baixo
+
+
+class TokenizadorIncremental:
+    """Guarda os tokens do último texto e reescaneia só a partir da edição.
+
+    Entre dois tokens o scanner não carrega estado (comentários e literais
+    são um token só), então os tokens que terminam antes do primeiro
+    caractere alterado continuam válidos; o que toca a edição é refeito.
+    """
+
+    def __init__(self):
+        self._texto = ""
+        self._tokens: list[Token] = []
+        self._fins: list[int] = []
+
+    def tokens(self, texto: str) -> list[Token]:
+        if texto == self._texto:
+            return self._tokens
+        k = bisect_left(self._fins, _prefixo_comum(self._texto, texto))
+        reaproveitados = self._tokens[:k]
+        novos = tokenizar(texto, reaproveitados[-1].fim if reaproveitados else 0)
+        self._texto = texto
+        self._tokens = reaproveitados + novos
+        self._fins = self._fins[:k] + [t.fim for t in novos]
+        return self._tokens
+
+
+# ============================================================
+# ANÁLISE
+# ============================================================
+def _fatia(texto: str, tokens: list[Token]) -> str:
+    return texto[tokens[0].inicio:tokens[-1].fim] if tokens else ""
+
+
+def _fechamento(tokens: list[Token], i: int) -> int:
+    """Índice do ")" que fecha o "(" em `i` (ou len(tokens) se não fechar)."""
+    nivel = 0
+    for j in range(i, len(tokens)):
+        if tokens[j].texto == "(":
+            nivel += 1
+        elif tokens[j].texto == ")":
+            nivel -= 1
+            if nivel == 0:
+                return j
+    return len(tokens)
+
+
+def _no_nivel(tokens: list[Token], i: int, fim: int):
+    """Índices de `i` a `fim` que estão fora de parênteses (relativo a `i`)."""
+    nivel = 0
+    for j in range(i, fim):
+        t = tokens[j].texto
+        if t == "(":
+            nivel += 1
+        elif t == ")":
+            nivel -= 1
+        elif nivel == 0:
+            yield j
+
+
+def _nome_pontuado(tokens: list[Token], i: int) -> tuple[list[Token], int]:
+    """Partes de um nome a.b.c a partir de `i` e o índice seguinte."""
+    partes = [tokens[i]]
+    i += 1
+    while i + 1 < len(tokens) and tokens[i].texto == "." and tokens[i + 1].tipo in ("palavra", "nome", "operador"):
+        partes.append(tokens[i + 1])
+        i += 2
+    return partes, i
+
+
+def _pode_ser_apelido(token: Token) -> bool:
+    return token.tipo == "nome" or (token.tipo == "palavra" and token.chave not in _RESERVADAS)
+
+
+def _coluna(texto: str, item: list[Token]) -> Coluna:
+    apelido = ""
+    if len(item) > 2 and item[1].texto == "=" and item[0].tipo in ("palavra", "nome"):
+        apelido, item = _sem_aspas(item[0].texto), item[2:]          # apelido = expressão
+    elif len(item) > 2 and item[-2].chave == "AS":
+        apelido, item = _sem_aspas(item[-1].texto), item[:-2]
+    elif (len(item) > 1 and _pode_ser_apelido(item[-1]) and item[-2].texto not in (".",)
+          and (item[-2].tipo in ("palavra", "nome", "numero", "texto") or item[-2].texto == ")")
+          and (item[-2].tipo != "palavra" or item[-2].chave not in _RESERVADAS - {"END"})):
+        apelido, item = _sem_aspas(item[-1].texto), item[:-1]
+    expressao = _fatia(texto, item)
+    if item and item[0].tipo in ("palavra", "nome"):
+        partes, j = _nome_pontuado(item, 0)
+        if j == len(item):
+            nomes = [_sem_aspas(p.texto) for p in partes]
+            campo = nomes[-1]
+            return Coluna(apelido or campo, expressao, nomes[-2] if len(nomes) > 1 else "", campo)
+    if expressao == "*":
+        return Coluna(apelido or "*", expressao, "", "*")
+    return Coluna(apelido, expressao)
+
+
+def _colunas(texto: str, tokens: list[Token], i: int, fim: int, erros: list[str]) -> list[Coluna]:
+    # DISTINCT / ALL / TOP (n) | TOP n [PERCENT] [WITH TIES]
+    while i < fim and tokens[i].chave in ("DISTINCT", "ALL", "TOP"):
+        if tokens[i].chave == "TOP":
+            i += 1
+            i = _fechamento(tokens, i) + 1 if i < fim and tokens[i].texto == "(" else i + 1
+            if i < fim and tokens[i].chave == "PERCENT":
+                i += 1
+            if i + 1 < fim and tokens[i].chave == "WITH" and tokens[i + 1].chave == "TIES":
+                i += 2
+        else:
+            i += 1
+    colunas, inicio = [], i
+    for j in list(_no_nivel(tokens, i, fim)) + [fim]:
+        if j == fim or tokens[j].texto == ",":
+            if j > inicio:
+                colunas.append(_coluna(texto, tokens[inicio:j]))
+            elif j < fim or inicio > i:   # vírgula sem coluna antes ou depois dela
+                pos = tokens[j].inicio if j < fim else tokens[j - 1].fim
+                erros.append(f"Coluna vazia na lista do SELECT (posição {pos + 1}).")
+            inicio = j + 1
+    if not colunas and not erros:
+        erros.append("SELECT sem colunas.")
+    return colunas
+
+
+def _fonte(texto: str, tokens: list[Token], i: int, fim: int) -> tuple[str, str, int]:
+    """(tabela, apelido, próximo índice) de uma fonte do FROM/JOIN."""
+    if i < fim and tokens[i].texto == "(":
+        nome, i = "(subconsulta)", _fechamento(tokens, i) + 1
+    elif i < fim and tokens[i].tipo in ("palavra", "nome", "variavel"):
+        partes, i = _nome_pontuado(tokens, i)
+        nome = ".".join(_sem_aspas(p.texto) for p in partes)
+        if i + 1 < fim and tokens[i].texto == "(" and tokens[i + 1].chave not in _DICAS:
+            nome, i = nome + "()", _fechamento(tokens, i) + 1            # função de tabela
+    else:
+        return "", "", i + 1
+    apelido = ""
+    for _ in range(2):   # dicas de tabela e apelido, em qualquer ordem
+        if i < fim and tokens[i].texto == "(":
+            i = _fechamento(tokens, i) + 1
+        elif i + 1 < fim and tokens[i].chave == "WITH" and tokens[i + 1].texto == "(":
+            i = _fechamento(tokens, i + 1) + 1
+        elif i + 1 < fim and tokens[i].chave == "AS":
+            apelido, i = _sem_aspas(tokens[i + 1].texto), i + 2
+        elif i < fim and _pode_ser_apelido(tokens[i]):
+            apelido, i = _sem_aspas(tokens[i].texto), i + 1
+    return nome, apelido, i
+
+
+def _tabelas(texto: str, tokens: list[Token], i: int, fim: int) -> list[TabelaSQL]:
+    tabelas, juncao = [], "FROM"
+    while i < fim:
+        nome, apelido, i = _fonte(texto, tokens, i, fim)
+        condicao = ""
+        if i < fim and tokens[i].chave == "ON":
+            inicio = i + 1
+            for i in _no_nivel(tokens, inicio, fim):
+                if tokens[i].chave in _INICIO_JUNCAO or tokens[i].texto == ",":
+                    break
+            else:
+                i = fim
+            condicao = _fatia(texto, tokens[inicio:i])
+        if nome:
+            tabelas.append(TabelaSQL(nome, apelido, juncao, condicao))
+        # Próximo operador de junção: ",", [tipo] [OUTER] [dica] JOIN, CROSS/OUTER APPLY
+        if i >= fim:
+            break
+        if tokens[i].texto == ",":
+            juncao, i = "CROSS", i + 1
+            continue
+        palavras = []
+        while i < fim and tokens[i].chave not in ("JOIN", "APPLY") and tokens[i].tipo == "palavra":
+            palavras.append(tokens[i].chave)
+            i += 1
+        if i >= fim:
+            break
+        if tokens[i].chave == "APPLY":
+            juncao = "APPLY"
+        else:
+            juncao = next((p for p in palavras if p in ("INNER", "LEFT", "RIGHT", "FULL", "CROSS")), "INNER")
+        i += 1
+    return tabelas
+
+
+def _ctes(tokens: list[Token]) -> set[str]:
+    """Nomes definidos em WITH nome AS (...), nome2 AS (...)."""
+    nomes = set()
+    if tokens and tokens[0].chave == "WITH":
+        i = 1
+        while i + 2 < len(tokens) and tokens[i + 1].chave == "AS" and tokens[i + 2].texto == "(":
+            nomes.add(_sem_aspas(tokens[i].texto).upper())
+            i = _fechamento(tokens, i + 2) + 1
+            if i >= len(tokens) or tokens[i].texto != ",":
+                break
+            i += 1
+    return nomes
+
+
+def _fim_from(tokens: list[Token], i: int, fim: int) -> int:
+    """Fim da lista do FROM iniciada em `i`: cláusula seguinte, ";" ou o ")" da subconsulta."""
+    nivel = 0
+    for j in range(i, fim):
+        t = tokens[j]
+        if t.texto == "(":
+            nivel += 1
+        elif t.texto == ")":
+            nivel -= 1
+            if nivel < 0:
+                return j
+        elif nivel == 0 and (t.chave in _FIM_FROM or t.texto == ";"):
+            return j
+    return fim
+
+
+def _referenciadas(texto: str, tokens: list[Token]) -> list[str]:
+    """Tabelas de todo FROM (com JOINs e vírgulas) e após UPDATE/INTO, em qualquer nível, sem CTEs."""
+    ctes = _ctes(tokens)
+    vistas = {}
+
+    def anotar(nome: str):
+        if nome.upper() not in ctes:
+            vistas.setdefault(nome.upper(), nome)
+
+    for j, t in enumerate(tokens[:-1]):
+        if t.chave == "FROM":
+            for tabela in _tabelas(texto, tokens, j + 1, _fim_from(tokens, j + 1, len(tokens))):
+                if not tabela.nome.endswith(")"):   # subconsulta / função de tabela
+                    anotar(tabela.nome)
+        elif t.chave in ("UPDATE", "INTO") and tokens[j + 1].tipo in ("palavra", "nome"):
+            partes, k = _nome_pontuado(tokens, j + 1)
+            if k + 1 < len(tokens) and tokens[k].texto == "(" and tokens[k + 1].chave not in _DICAS:
+                continue   # função de tabela
+            anotar(".".join(_sem_aspas(p.texto) for p in partes))
+    return list(vistas.values())
+
+
+def analisar_tokens(texto: str, todos: list[Token]) -> AnaliseSQL:
+    tokens = [t for t in todos if t.tipo not in _IGNORADOS]
+    erros = []
+    nivel = 0
+    for t in tokens:
+        nivel += (t.texto == "(") - (t.texto == ")")
+        if nivel < 0:
+            erros.append(f"Parêntese ')' sem abertura na posição {t.inicio + 1}.")
+            nivel = 0
+    if nivel > 0:
+        erros.append(f"{nivel} parêntese(s) sem fechar.")
+    if any(t.tipo == "texto" and (len(t.texto) < 2 or not t.texto.endswith("'")) for t in tokens):
+        erros.append("Texto entre aspas sem fechar.")
+
+    # SELECT principal: o primeiro fora de parênteses (depois de eventuais CTEs)
+    select = next((j for j in _no_nivel(tokens, 0, len(tokens)) if tokens[j].chave == "SELECT"), None)
+    if select is None:
+        return AnaliseSQL((), (), tuple(_referenciadas(texto, tokens)), tuple(erros + ["Nenhum SELECT encontrado."]))
+    fim_sentenca = next((j for j in _no_nivel(tokens, select, len(tokens)) if tokens[j].texto == ";"), len(tokens))
+
+    fim_lista = next((j for j in _no_nivel(tokens, select + 1, fim_sentenca)
+                      if tokens[j].chave in _FIM_SELECT or tokens[j].texto == ";"), fim_sentenca)
+    colunas = _colunas(texto, tokens, select + 1, fim_lista, erros)
+
+    tabelas = []
+    inicio_from = next((j for j in _no_nivel(tokens, fim_lista, fim_sentenca) if tokens[j].chave == "FROM"), None)
+    if inicio_from is not None:
+        tabelas = _tabelas(texto, tokens, inicio_from + 1, _fim_from(tokens, inicio_from + 1, fim_sentenca))
+    return AnaliseSQL(tuple(colunas), tuple(tabelas), tuple(_referenciadas(texto, tokens)), tuple(erros))
+
+
+@lru_cache(maxsize=64)
+def analisar(texto: str) -> AnaliseSQL:
+    """Análise completa de uma sentença (sem reaproveitar tokens)."""
+    return analisar_tokens(texto, tokenizar(texto))
+
+
+class AnalisadorSQL:
+    """Análise para um editor: tokenização incremental + cache do último resultado."""
+
+    def __init__(self):
+        self._tokenizador = TokenizadorIncremental()
+        self._ultimo: tuple[str, AnaliseSQL] | None = None
+
+    def analisar(self, texto: str) -> AnaliseSQL:
+        if self._ultimo is None or self._ultimo[0] != texto:
+            self._ultimo = (texto, analisar_tokens(texto, self._tokenizador.tokens(texto)))
+        return self._ultimo[1]
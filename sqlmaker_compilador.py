@@ -0,0 +1,432 @@
+# =============================================================================
+#  RM Suite — Compilador de sentenças do SQL Maker
+#
+#  A consulta montada na tela vira uma especificação imutável (ConsultaSQL):
+#  tabela principal, colunas, JOINs, cálculo, filtros e ordenação. O
+#  compilador monta a árvore da sentença (NoSelect) com o grafo de JOINs do
+#  IndiceMetadados e a renderiza em T-SQL. Especificações iguais têm o mesmo
+#  hash, então a SQL já compilada sai do cache; nada aqui depende do
+#  Streamlit, o que permite gerar sentenças em lote e medir o custo.
+#  Entre montar e renderizar, otimizar() reescreve a árvore: LEFT JOIN que
+#  o WHERE torna obrigatório vira INNER, filtros de tabelas INNER descem
+#  para tabelas derivadas, os JOINs mais seletivos vêm primeiro e as
+#  igualdades de CODCOLIGADA abrem cada ON.
+# =============================================================================
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, replace
+from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple
+
+from sqlmaker_metadados import GrafoJoins, IndiceMetadados
+
+PASTA_SENTENCAS = "historico_queries"
+CACHE_SENTENCAS = int(os.environ.get("SQLMAKER_CACHE_SENTENCAS", "4096"))
+
+FUNCOES_AGREGACAO = {
+    "SOMA (SUM)": "SUM",
+    "CONTAGEM (COUNT)": "COUNT",
+    "MÉDIA (AVG)": "AVG",
+    "MÁXIMO (MAX)": "MAX",
+    "MÍNIMO (MIN)": "MIN",
+}
+TIPOS_JOIN = ("INNER", "LEFT", "RIGHT", "FULL")
+
+
+# ============================================================
+# ESPECIFICAÇÃO
+# ============================================================
+@dataclass(frozen=True)
+class Filtro:
+    campo: str
+    operador: str
+    valor: str = ""
+    conector: str = "AND"   # liga este filtro ao anterior (ignorado no primeiro)
+
+
+def _valor_filtro(valor, operador: str = "") -> str:
+    """Valor de filtro como texto; listas viram "a, b" (IN) ou "a|b" (BETWEEN).
+
+    Especificações em YAML/JSON trazem números como int/float e listas como
+    list; a tela sempre entrega texto.
+    """
+    if isinstance(valor, (list, tuple)):
+        if operador == "BETWEEN":
+            return "|".join(str(v) for v in valor)
+        return ", ".join(str(v) if isinstance(v, (int, float)) else _literal(str(v)) for v in valor)
+    return "" if valor is None else str(valor)
+
+
+@dataclass(frozen=True)
+class Ordenacao:
+    campo: str
+    direcao: str = "ASC"
+
+
+@dataclass(frozen=True)
+class Agregacao:
+    funcao: str   # SUM, COUNT, AVG, MAX ou MIN
+    tabela: str
+    campo: str
+
+
+@dataclass(frozen=True)
+class ConsultaSQL:
+    """O que o usuário pediu, sem nada de tela. Todas as coleções são tuplas."""
+    tabela: str
+    colunas: tuple[tuple[str, str], ...]          # (tabela, campo) na ordem do SELECT
+    juncoes: tuple[tuple[str, str], ...] = ()     # (tabela, tipo de JOIN) escolhidas
+    profundidade: int = 2
+    agregacao: Agregacao | None = None
+    filtros: tuple[Filtro, ...] = ()
+    ordenacao: tuple[Ordenacao, ...] = ()
+    otimizar: bool = True
+
+    @classmethod
+    def criar(cls, tabela, colunas, juncoes=(), profundidade=2, agregacao=None, filtros=(), ordenacao=(),
+              otimizar=True):
+        """Aceita listas/dicts (como vêm da tela) e normaliza para tuplas."""
+        if isinstance(juncoes, dict):
+            juncoes = juncoes.items()
+        return cls(
+            tabela=tabela,
+            colunas=tuple((t, c) for t, c in colunas),
+            juncoes=tuple((t, tipo) for t, tipo in juncoes),
+            profundidade=int(profundidade),
+            agregacao=agregacao,
+            filtros=tuple(f if isinstance(f, Filtro) else
+                          Filtro(**{**f, "valor": _valor_filtro(f.get("valor"), f.get("operador", ""))})
+                          for f in filtros),
+            ordenacao=tuple(o if isinstance(o, Ordenacao) else Ordenacao(**o) for o in ordenacao),
+            otimizar=bool(otimizar),
+        )
+
+    @classmethod
+    def de_dict(cls, spec: dict, grafo: GrafoJoins | None = None) -> ConsultaSQL:
+        """Especificação em arquivo (JSON/YAML) → ConsultaSQL.
+
+        Campos sem prefixo pertencem à tabela principal; `juncoes` aceita
+        {tabela: tipo} (tipo em TIPOS_JOIN) ou lista de tabelas (INNER); `ordenacao` aceita
+        "CAMPO DESC"; `agregacao` é {"funcao": "SUM", "campo": "TABELA.CAMPO"};
+        `otimizar: false` mantém a sentença na ordem pedida.
+        Tabelas citadas em colunas, filtros, ordenação ou cálculo entram nas
+        junções (INNER) mesmo sem estar em `juncoes`. Com `grafo`, toda junção
+        precisa de caminho pelos RELACIONAMENTOS; senão ValueError.
+        """
+        tabela = spec["tabela"]
+        profundidade = int(spec.get("profundidade", 2))
+
+        def qualificado(campo: str) -> tuple[str, str]:
+            return tuple(campo.split(".", 1)) if "." in campo else (tabela, campo)
+
+        def com_tabela(campo: str) -> str:
+            return campo if "." in campo or campo.isdigit() else f"{tabela}.{campo}"
+
+        juncoes = spec.get("juncoes", ())
+        if not isinstance(juncoes, dict):
+            juncoes = {j: "INNER" for j in juncoes}
+        juncoes = {t: str(tipo).upper() for t, tipo in juncoes.items()}
+        invalidas = [f"{t} ({tipo})" for t, tipo in juncoes.items() if tipo not in TIPOS_JOIN]
+        if invalidas:
+            raise ValueError(f"Tipo de JOIN inválido em {', '.join(invalidas)}; "
+                             f"use {', '.join(TIPOS_JOIN)}.")
+        colunas = [qualificado(c) for c in spec.get("colunas", ())]
+        agregacao = spec.get("agregacao")
+        if agregacao:
+            funcao = FUNCOES_AGREGACAO.get(agregacao["funcao"], agregacao["funcao"]).upper()
+            agregacao = Agregacao(funcao, *qualificado(agregacao["campo"]))
+        filtros = [{**f, "campo": com_tabela(f["campo"])} for f in spec.get("filtros", ())]
+        ordenacao = [Ordenacao(*o.split()) if isinstance(o, str) else Ordenacao(**o)
+                     for o in spec.get("ordenacao", ())]
+        ordenacao = [replace(o, campo=com_tabela(o.campo)) for o in ordenacao]
+
+        citadas = [t for t, _ in colunas]
+        citadas += [f["campo"].split(".", 1)[0] for f in filtros if "." in f["campo"]]
+        citadas += [o.campo.split(".", 1)[0] for o in ordenacao if "." in o.campo]
+        if agregacao:
+            citadas.append(agregacao.tabela)
+        for t in citadas:
+            if t != tabela and t not in juncoes:
+                juncoes[t] = "INNER"
+        if grafo is not None and juncoes:
+            _, sem_caminho = grafo.conectar(tabela, list(juncoes), profundidade)
+            if sem_caminho:
+                raise ValueError(f"Sem caminho de JOIN de {tabela} até {', '.join(sem_caminho)} "
+                                 f"em {profundidade} salto(s).")
+        return cls.criar(tabela, colunas, juncoes, profundidade, agregacao or None,
+                         filtros, ordenacao, spec.get("otimizar", True))
+
+
+def salvar_sentenca(sql: str, tabela_principal: str, pasta: str = PASTA_SENTENCAS,
+                    nome: str | None = None) -> str:
+    """Grava a sentença com o cabeçalho do SQL Maker; devolve o caminho do arquivo.
+
+    Sem `nome`, o arquivo é query_<tabela>_<timestamp>.sql (histórico do app).
+    """
+    os.makedirs(pasta, exist_ok=True)
+    agora = datetime.now()
+    caminho = os.path.join(pasta, f"{nome}.sql" if nome else
+                           f"query_{tabela_principal}_{agora.strftime('%Y%m%d_%H%M%S')}.sql")
+    with open(caminho, "w", encoding="utf-8") as f:
+        f.write(f"-- Query gerada em: {agora.strftime('%d/%m/%Y %H:%M:%S')}\n")
+        f.write(f"-- Tabela principal: {tabela_principal}\n-- Gerado por: RM Suite\n\n")
+        f.write(sql)
+    return caminho
+
+
+# ============================================================
+# ÁRVORE DA SENTENÇA
+# ============================================================
+class NoJoin(NamedTuple):
+    tipo: str
+    tabela: str
+    condicoes: tuple[str, ...]   # vazio: relação desconhecida, JOIN a ajustar
+    nota: str = ""
+    anterior: str = ""           # tabela à qual o ON se liga
+    filtros: tuple[Filtro, ...] = ()   # aplicados dentro da tabela derivada
+
+
+class NoSelect(NamedTuple):
+    colunas: tuple[str, ...]
+    origem: str
+    joins: tuple[NoJoin, ...]
+    where: tuple[Filtro, ...]
+    group_by: tuple[str, ...]
+    order_by: tuple[str, ...]
+
+
+def _e_numero(valor: str) -> bool:
+    return valor.replace(".", "").replace("-", "").isdigit()
+
+
+def _literal(valor: str) -> str:
+    return valor if valor.startswith("'") else f"'{valor}'"
+
+
+def condicao_filtro(filtro: Filtro) -> str:
+    """Texto da condição de um filtro; textos não numéricos vão entre aspas."""
+    campo, operador, valor = filtro.campo, filtro.operador, filtro.valor
+    if operador in ("IS NULL", "IS NOT NULL"):
+        return f"{campo} {operador}"
+    if operador == "BETWEEN":
+        valores = valor.split("|")
+        if len(valores) != 2:
+            return f"{campo} BETWEEN {valor}"
+        val1, val2 = (v.strip() for v in valores)
+        val1 = val1 if _e_numero(val1) else _literal(val1)
+        val2 = val2 if _e_numero(val2) else _literal(val2)
+        return f"{campo} BETWEEN {val1} AND {val2}"
+    if operador in ("IN", "NOT IN"):
+        return f"{campo} {operador} ({valor})"
+    if operador in ("LIKE", "NOT LIKE"):
+        return f"{campo} {operador} {_literal(valor)}"
+    if _e_numero(valor.replace(",", "")):
+        return f"{campo} {operador} {valor}"
+    return f"{campo} {operador} {_literal(valor)}"
+
+
+def montar(consulta: ConsultaSQL, indice: IndiceMetadados) -> NoSelect:
+    """Resolve JOINs (com intermediárias) e cálculo; devolve a árvore da sentença."""
+    if not consulta.colunas:
+        raise ValueError("A consulta precisa de ao menos uma coluna.")
+    colunas = [f"{t}.{c}" for t, c in consulta.colunas]
+    group_by: list[str] = []
+    agg = consulta.agregacao
+    if agg is not None:
+        group_by = [c for c in colunas if not c.endswith(f".{agg.campo}")]
+        colunas = group_by + [f"{agg.funcao}({agg.tabela}.{agg.campo}) AS {agg.funcao}_{agg.campo}"]
+
+    tipos = dict(consulta.juncoes)
+    fora = sorted({t for t, _ in consulta.colunas} - {consulta.tabela} - set(tipos))
+    if fora:
+        raise ValueError(f"Colunas de tabela(s) fora da consulta: {', '.join(fora)}.")
+    passos, sem_caminho = indice.grafo.conectar(consulta.tabela, list(tipos), consulta.profundidade)
+    joins = []
+    for passo in passos:
+        # Intermediárias herdam o tipo de JOIN da tabela que as motivou
+        nota = f"intermediária para {passo.destino}" if passo.intermediaria else ""
+        joins.append(NoJoin(tipos.get(passo.destino, "INNER"), passo.tabela,
+                            tuple(indice.condicoes_join(passo.anterior, passo.tabela)), nota, passo.anterior))
+    for filha in sem_caminho:
+        joins.append(NoJoin(tipos.get(filha, "INNER"), filha, ()))
+
+    order_by = tuple(f"{o.campo} {o.direcao}" for o in consulta.ordenacao)
+    return NoSelect(tuple(colunas), consulta.tabela, tuple(joins), consulta.filtros, tuple(group_by), order_by)
+
+
+# ============================================================
+# OTIMIZAÇÃO
+# ============================================================
+# Seletividade presumida por operador (menor = descarta mais linhas)
+_SELETIVIDADE = {"=": 1, "IS NULL": 2, "IN": 2, "BETWEEN": 3, "LIKE": 3,
+                 ">": 4, "<": 4, ">=": 4, "<=": 4}
+_SEM_FILTRO = 99
+
+
+def _tabela_do_campo(campo: str) -> str:
+    return campo.split(".", 1)[0] if "." in campo else ""
+
+
+def _e_codcoligada(texto: str) -> bool:
+    return "CODCOLIGADA" in texto.upper()
+
+
+def _seletividade(filtro: Filtro) -> int:
+    # CODCOLIGADA tem poucos valores: igualdade nela quase não reduz linhas
+    if _e_codcoligada(filtro.campo):
+        return 7
+    if filtro.operador in ("LIKE", "NOT LIKE") and filtro.valor.lstrip("'").startswith("%"):
+        return 6
+    return _SELETIVIDADE.get(filtro.operador, 8)
+
+
+def otimizar(no: NoSelect) -> NoSelect:
+    """Reescreve a árvore sem mudar o resultado da sentença.
+
+    As regras que dependem do WHERE só valem quando todos os filtros estão
+    ligados por AND, e a reordenação/descida de filtros só quando há apenas
+    INNER/LEFT JOINs com relação conhecida (cada ON cita só a tabela anterior).
+    """
+    joins = [j._replace(condicoes=tuple(sorted(dict.fromkeys(j.condicoes), key=lambda c: not _e_codcoligada(c))))
+             for j in no.joins]
+    where = list(no.where)
+    so_and = all(f.conector == "AND" for f in where[1:])
+    simples = all(j.condicoes and j.tipo in ("INNER", "LEFT") for j in joins)
+    por_tabela = {j.tabela: i for i, j in enumerate(joins)}
+
+    if so_and:
+        # Filtro que rejeita NULL numa tabela de LEFT JOIN descarta as linhas
+        # sem correspondência: o JOIN (e o caminho até ele) é na prática INNER.
+        for f in where:
+            i = por_tabela.get(_tabela_do_campo(f.campo))
+            while i is not None and f.operador != "IS NULL":
+                if joins[i].tipo == "LEFT":
+                    nota = "; ".join(filter(None, (joins[i].nota, "INNER: o WHERE exige a linha")))
+                    joins[i] = joins[i]._replace(tipo="INNER", nota=nota)
+                i = por_tabela.get(joins[i].anterior)
+        # Igualdade em CODCOLIGADA abre o WHERE
+        where.sort(key=lambda f: not (_e_codcoligada(f.campo) and f.operador == "="))
+        if where:
+            where[0] = replace(where[0], conector="AND")
+
+    if not simples:
+        return no._replace(joins=tuple(joins), where=tuple(where))
+
+    if so_and:
+        # Filtros de tabelas ligadas só por INNER descem para a tabela derivada
+        def so_inner(i):
+            while i is not None:
+                if joins[i].tipo != "INNER":
+                    return False
+                i = por_tabela.get(joins[i].anterior)
+            return True
+        restantes = []
+        for f in where:
+            i = por_tabela.get(_tabela_do_campo(f.campo))
+            if i is not None and so_inner(i):
+                joins[i] = joins[i]._replace(filtros=joins[i].filtros + (f,))
+            else:
+                restantes.append(f)
+        if restantes:
+            restantes[0] = replace(restantes[0], conector="AND")
+        where = restantes
+
+    # Seletividade de cada JOIN = a do filtro mais seletivo na sua subárvore
+    peso = [min((_seletividade(f) for f in j.filtros), default=_SEM_FILTRO) for j in joins]
+    for f in where if so_and else ():
+        i = por_tabela.get(_tabela_do_campo(f.campo))
+        if i is not None:
+            peso[i] = min(peso[i], _seletividade(f))
+    for i in reversed(range(len(joins))):   # filhas sempre vêm depois da anterior
+        pai = por_tabela.get(joins[i].anterior)
+        if pai is not None:
+            peso[pai] = min(peso[pai], peso[i])
+
+    # Ordem topológica gulosa: INNER antes de LEFT, mais seletivo primeiro
+    emitidas, ordem, pendentes = {no.origem}, [], list(range(len(joins)))
+    while pendentes:
+        prontos = [i for i in pendentes if joins[i].anterior in emitidas]
+        i = min(prontos, key=lambda i: (joins[i].tipo != "INNER", peso[i], i))
+        pendentes.remove(i)
+        emitidas.add(joins[i].tabela)
+        ordem.append(joins[i])
+    return no._replace(joins=tuple(ordem), where=tuple(where))
+
+
+def renderizar(no: NoSelect) -> str:
+    """T-SQL no mesmo layout que o SQL Maker sempre gerou."""
+    partes = [f"SELECT\n  " + ",\n  ".join(no.colunas), f"FROM {no.origem} (NOLOCK)"]
+    for join in no.joins:
+        if join.condicoes:
+            nota = f"  -- {join.nota}" if join.nota else ""
+            fonte = f"{join.tabela} (NOLOCK)"
+            if join.filtros:
+                fonte = (f"(SELECT * FROM {join.tabela} (NOLOCK) WHERE "
+                         + " AND ".join(condicao_filtro(f) for f in join.filtros) + f") {join.tabela}")
+            partes.append(f"{join.tipo} JOIN {fonte} ON{nota}\n  " + " AND\n  ".join(join.condicoes))
+        else:
+            partes.append(f"{join.tipo} JOIN {join.tabela} (NOLOCK) ON\n"
+                          f"  -- AJUSTE O JOIN: {no.origem}.ID = {join.tabela}.ID")
+    if no.where:
+        partes.append("WHERE\n  " + "\n  ".join(condicao_filtro(f) if i == 0 else f"{f.conector} {condicao_filtro(f)}"
+                                                  for i, f in enumerate(no.where)))
+    if no.group_by:
+        partes.append("GROUP BY\n  " + ",\n  ".join(no.group_by))
+    if no.order_by:
+        partes.append("ORDER BY\n  " + ",\n  ".join(no.order_by))
+    return "\n".join(partes)
+
+
+# ============================================================
+# COMPILADOR
+# ============================================================
+class CompiladorSQL:
+    """ConsultaSQL → SQL, com cache LRU por especificação (hash do dataclass).
+
+    Um compilador por IndiceMetadados: o cache só vale para os metadados com
+    que as sentenças foram montadas.
+    """
+
+    def __init__(self, indice: IndiceMetadados, tamanho_cache: int = CACHE_SENTENCAS):
+        self.indice = indice
+        self.compilar = lru_cache(maxsize=tamanho_cache)(self._compilar)
+
+    def _compilar(self, consulta: ConsultaSQL) -> str:
+        return renderizar(self.arvore(consulta))
+
+    def arvore(self, consulta: ConsultaSQL) -> NoSelect:
+        no = montar(consulta, self.indice)
+        return otimizar(no) if consulta.otimizar else no
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    from sqlmaker_metadados import carregar_metadados
+
+    indice = IndiceMetadados(*carregar_metadados())
+    compilador = CompiladorSQL(indice)
+    sorteio = random.Random(0)
+    tabelas = [t for t in indice.tabelas_do_sistema("P")
+               if indice.campos(t) and indice.grafo.alcancaveis(t, 2)][:200]
+    consultas = []
+    for tabela in tabelas:
+        filhas = sorteio.sample(indice.grafo.alcancaveis(tabela, 2), k=1)
+        colunas = ([(tabela, c) for c in indice.campos(tabela)[:3]]
+                   + [(f, indice.campos(f)[0]) for f in filhas if indice.campos(f)])
+        consultas.append(ConsultaSQL.criar(tabela, colunas, [(f, "LEFT") for f in filhas],
+                                           filtros=[Filtro(colunas[0][1], "=", "1")]))
+    t0 = time.perf_counter()
+    for consulta in consultas:
+        compilador.compilar(consulta)
+    t1 = time.perf_counter()
+    for consulta in consultas:
+        compilador.compilar(consulta)
+    t2 = time.perf_counter()
+    n = len(consultas)
+    print(f"{n} sentenças | compilação: {(t1 - t0) / n * 1000:.3f} ms/sentença"
+          f" | do cache: {(t2 - t1) / n * 1e6:.1f} µs/sentença")
@@ -0,0 +1,161 @@
+# =============================================================================
+#  RM Suite — Geração de sentenças em lote (sem Streamlit)
+#
+#  Lê especificações de consulta em JSON ou YAML (um arquivo pode ter uma
+#  consulta, uma lista delas ou {"consultas": [...]}) e compila todas contra
+#  o cache Parquet dos metadados, gravando um .sql por consulta com o mesmo
+#  cabeçalho do histórico do SQL Maker. Catálogos grandes são divididos em
+#  blocos compilados em processos separados.
+#
+#  Uso:  python sqlmaker_lote.py relatorios/*.yaml --saida sentencas/
+#
+#  Exemplo de especificação (YAML):
+#    nome: folha_por_secao
+#    tabela: PFUNC
+#    colunas: [CHAPA, NOME, PSECAO.DESCRICAO]
+#    juncoes: {PSECAO: LEFT}
+#    filtros:
+#      - {campo: PFUNC.CODSITUACAO, operador: "<>", valor: D}
+#      - {campo: PFUNC.CODCOLIGADA, operador: "=", valor: 1}
+#      - {campo: PFUNC.CODTIPO, operador: IN, valor: [N, T]}
+#    ordenacao: ["PFUNC.NOME ASC"]
+# =============================================================================
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlmaker_compilador import CompiladorSQL, ConsultaSQL, salvar_sentenca
+from sqlmaker_metadados import IndiceMetadados, carregar_metadados
+
+LOTE_PROCESSOS    = int(os.environ.get("SQLMAKER_LOTE_PROCESSOS", str(os.cpu_count() or 1)))
+LOTE_MIN_PARALELO = int(os.environ.get("SQLMAKER_LOTE_MIN_PARALELO", "5000"))  # consultas
+LOTE_BLOCO        = int(os.environ.get("SQLMAKER_LOTE_BLOCO", "1000"))         # consultas por tarefa
+
+_compilador: CompiladorSQL | None = None
+
+
+def _nome_arquivo(nome) -> str:
+    """Nome de consulta seguro para virar arquivo na pasta de saída (sem / nem ..)."""
+    return re.sub(r"[^\w.-]+", "_", str(nome)).strip("._") or "consulta"
+
+
+def ler_especificacoes(caminho: str) -> list[dict]:
+    """Consultas de um arquivo .json/.yaml/.yml; sem `nome`, usa o do arquivo (+ posição).
+
+    Levanta ValueError se o arquivo estiver vazio ou tiver algo que não seja
+    uma consulta (objeto/mapeamento).
+    """
+    with open(caminho, encoding="utf-8") as f:
+        if caminho.lower().endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("Especificações YAML exigem o pacote PyYAML (pip install pyyaml).")
+            try:
+                conteudo = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(f"YAML inválido ({e})") from e
+        else:
+            conteudo = json.load(f)
+    if isinstance(conteudo, dict):
+        conteudo = conteudo.get("consultas", [conteudo])
+    if not isinstance(conteudo, list) or not conteudo:
+        raise ValueError("nenhuma consulta encontrada")
+    invalidas = [str(i + 1) for i, spec in enumerate(conteudo) if not isinstance(spec, dict)]
+    if invalidas:
+        raise ValueError(f"consulta(s) {', '.join(invalidas)} não são objetos")
+    base = os.path.splitext(os.path.basename(caminho))[0]
+    return [{**spec, "nome": _nome_arquivo(spec.get("nome") or
+                                           (base if len(conteudo) == 1 else f"{base}_{i + 1}"))}
+            for i, spec in enumerate(conteudo)]
+
+
+def _iniciar_processo():
+    global _compilador
+    _compilador = CompiladorSQL(IndiceMetadados(*carregar_metadados()))
+
+
+def _compilar_bloco(specs: list[dict]) -> list[tuple[str, str, str | None, str | None, float]]:
+    """[(nome, tabela, sql, erro, ms)] de cada especificação; roda no pool ou em linha."""
+    resultados = []
+    for spec in specs:
+        t0 = time.perf_counter()
+        sql = erro = None
+        try:
+            sql = _compilador.compilar(ConsultaSQL.de_dict(spec, _compilador.indice.grafo))
+        except Exception as e:   # uma especificação ruim não derruba o lote
+            erro = f"{type(e).__name__}: {e}"
+        resultados.append((spec["nome"], spec.get("tabela", ""), sql, erro,
+                           (time.perf_counter() - t0) * 1000))
+    return resultados
+
+
+def gerar_lote(specs: list[dict], saida: str, processos: int | None = None) -> list[tuple]:
+    """Compila e grava as especificações; devolve [(nome, arquivo|None, erro|None, ms)]."""
+    blocos = [specs[i:i + LOTE_BLOCO] for i in range(0, len(specs), LOTE_BLOCO)]
+    processos = min(processos or LOTE_PROCESSOS, len(blocos))
+    relatorio = []
+    if processos > 1 and len(specs) >= LOTE_MIN_PARALELO:
+        # Cada processo carrega os metadados do cache Parquet uma vez
+        with ProcessPoolExecutor(processos, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_iniciar_processo) as executor:
+            resultados = [r for bloco in executor.map(_compilar_bloco, blocos) for r in bloco]
+    else:
+        if _compilador is None:
+            _iniciar_processo()
+        resultados = _compilar_bloco(specs)
+    for nome, tabela, sql, erro, ms in resultados:
+        arquivo = None
+        if sql is not None:
+            try:
+                arquivo = salvar_sentenca(sql, tabela, saida, nome)
+            except OSError as e:   # falha de gravação também fica só nesta consulta
+                erro = f"{type(e).__name__}: {e}"
+        relatorio.append((nome, arquivo, erro, ms))
+    return relatorio
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Gera sentenças SQL do RM a partir de especificações JSON/YAML.")
+    parser.add_argument("especificacoes", nargs="+", help="arquivos .json, .yaml ou .yml")
+    parser.add_argument("--saida", default="historico_queries", help="pasta dos .sql (padrão: historico_queries)")
+    parser.add_argument("--processos", type=int, default=None, help="processos para catálogos grandes")
+    parser.add_argument("--silencioso", action="store_true", help="mostra só erros e o resumo")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    specs, erros_leitura = [], 0
+    for caminho in args.especificacoes:
+        try:
+            specs += ler_especificacoes(caminho)
+        except (OSError, ValueError) as e:   # JSON/YAML inválido ou sem consultas
+            erros_leitura += 1
+            print(f"ERRO  {caminho}: {e}", file=sys.stderr)
+    repetidos = sorted(n for n, vezes in Counter(s["nome"] for s in specs).items() if vezes > 1)
+    if repetidos:
+        raise SystemExit(f"Nomes de consulta repetidos: {', '.join(repetidos)}")
+
+    relatorio = gerar_lote(specs, args.saida, args.processos)
+    erros = 0
+    for nome, arquivo, erro, ms in relatorio:
+        if erro:
+            erros += 1
+            print(f"ERRO  {nome}: {erro}", file=sys.stderr)
+        elif not args.silencioso:
+            print(f"{ms:8.2f} ms  {arquivo}")
+    total = time.perf_counter() - t0
+    print(f"{len(relatorio) - erros} sentença(s) gerada(s), {erros + erros_leitura} erro(s) em {total:.2f}s")
+    return 1 if erros or erros_leitura else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
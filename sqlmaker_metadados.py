@@ -0,0 +1,439 @@
+# =============================================================================
+#  RM Suite — Metadados do SQL Maker
+#
+#  As planilhas CAMPOS.xlsx, SISTEMAS.xlsx e RELACIONAMENTOS.xlsx são
+#  convertidas uma única vez para Parquet em um diretório de cache. A chave do
+#  cache é (tamanho, mtime, sha256) de cada planilha; enquanto as fontes não
+#  mudarem, qualquer processo/réplica lê o Parquet em memory-map em vez de
+#  reinterpretar o XLSX com openpyxl.
+#  Sobre os metadados carregados ficam o grafo de JOINs (caminhos mínimos
+#  entre tabelas) e a busca textual por campos (BuscaCampos).
+# =============================================================================
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import unicodedata
+from collections import deque
+from functools import lru_cache
+from typing import Iterable, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+PASTA_BASE = os.path.dirname(os.path.abspath(__file__))
+PASTA_CACHE = os.environ.get("RM_SUITE_CACHE_DIR", os.path.join(PASTA_BASE, ".cache_rmsuite"))
+
+FONTES = {
+    "campos":    "CAMPOS.xlsx",
+    "sistemas":  "SISTEMAS.xlsx",
+    "relacoes":  "RELACIONAMENTOS.xlsx",
+}
+VERSAO_CACHE = 1
+_MANIFESTO = "metadados.json"
+
+
+def _hash_arquivo(caminho: str) -> str:
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _assinatura(caminho: str) -> dict:
+    st_ = os.stat(caminho)
+    return {"tamanho": st_.st_size, "mtime_ns": st_.st_mtime_ns}
+
+
+def _normalizar(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = df.columns.str.strip().str.upper()
+    return df
+
+
+def _ler_manifesto(pasta: str) -> dict:
+    try:
+        with open(os.path.join(pasta, _MANIFESTO), encoding="utf-8") as f:
+            manifesto = json.load(f)
+        return manifesto if manifesto.get("versao") == VERSAO_CACHE else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _gravar_atomico(pasta: str, nome: str, escrever) -> None:
+    # Grava em arquivo temporário e renomeia: réplicas concorrentes nunca leem
+    # um Parquet/manifesto pela metade.
+    fd, tmp = tempfile.mkstemp(dir=pasta, prefix=f".{nome}.")
+    os.close(fd)
+    try:
+        escrever(tmp)
+        os.replace(tmp, os.path.join(pasta, nome))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _fontes_validas(pasta_fontes: str, manifesto: dict) -> tuple[bool, dict]:
+    """Confere as planilhas contra o manifesto; só calcula o hash se o stat mudou."""
+    atual, validas = {}, bool(manifesto)
+    for chave, arquivo in FONTES.items():
+        caminho = os.path.join(pasta_fontes, arquivo)
+        assinatura = _assinatura(caminho)
+        anterior = manifesto.get("fontes", {}).get(chave, {})
+        if anterior and all(anterior.get(k) == v for k, v in assinatura.items()):
+            assinatura["sha256"] = anterior["sha256"]
+        else:
+            assinatura["sha256"] = _hash_arquivo(caminho)
+            validas = validas and anterior.get("sha256") == assinatura["sha256"]
+        atual[chave] = assinatura
+    return validas, atual
+
+
+def compilar_metadados(pasta_fontes: str = PASTA_BASE, pasta_cache: str = PASTA_CACHE,
+                       fontes: dict | None = None) -> dict:
+    """Converte as planilhas para Parquet e grava o manifesto com as assinaturas."""
+    os.makedirs(pasta_cache, exist_ok=True)
+    if fontes is None:
+        fontes = {chave: {**_assinatura(os.path.join(pasta_fontes, arq)),
+                          "sha256": _hash_arquivo(os.path.join(pasta_fontes, arq))}
+                  for chave, arq in FONTES.items()}
+    for chave, arquivo in FONTES.items():
+        df = _normalizar(pd.read_excel(os.path.join(pasta_fontes, arquivo)))
+        df = df.astype({c: "string" for c in df.columns if df[c].dtype == object})
+        _gravar_atomico(pasta_cache, f"{chave}.parquet", lambda p, df=df: df.to_parquet(p, index=False))
+    manifesto = {"versao": VERSAO_CACHE, "fontes": fontes}
+    _gravar_atomico(pasta_cache, _MANIFESTO, lambda p: _escrever_json(p, manifesto))
+    return manifesto
+
+
+def _escrever_json(caminho: str, dados: dict) -> None:
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(dados, f, indent=2)
+
+
+def carregar_metadados(pasta_fontes: str = PASTA_BASE, pasta_cache: str = PASTA_CACHE):
+    """Retorna (df_campos, df_sistemas, df_relacoes) a partir do cache Parquet.
+
+    O cache é reconstruído apenas quando o conteúdo de alguma planilha muda;
+    mudança só de mtime (ex.: checkout/cópia) renova o manifesto sem reconverter.
+    """
+    manifesto = _ler_manifesto(pasta_cache)
+    validas, fontes = _fontes_validas(pasta_fontes, manifesto)
+    parquets = [os.path.join(pasta_cache, f"{chave}.parquet") for chave in FONTES]
+    if not validas or not all(os.path.exists(p) for p in parquets):
+        compilar_metadados(pasta_fontes, pasta_cache, fontes)
+    elif fontes != manifesto["fontes"]:
+        manifesto["fontes"] = fontes
+        _gravar_atomico(pasta_cache, _MANIFESTO, lambda p: _escrever_json(p, manifesto))
+    df_campos, df_sistemas, df_relacoes = (pd.read_parquet(p, memory_map=True) for p in parquets)
+    return df_campos, df_sistemas, df_relacoes
+
+
+# ============================================================
+# GRAFO DE JOINS
+# ============================================================
+class PassoJoin(NamedTuple):
+    tabela: str          # tabela que entra no FROM/JOIN
+    anterior: str        # tabela já presente à qual ela se liga
+    destino: str         # tabela escolhida pelo usuário que motivou o passo
+    intermediaria: bool  # True se a tabela só entrou para completar o caminho
+
+
+class GrafoJoins:
+    """Grafo não-direcionado de RELACIONAMENTOS com caminhos mínimos em cache.
+
+    Arestas cuja chave é apenas CODCOLIGADA ligam quase tudo via GCOLIGADA e não
+    relacionam linhas de fato; elas só são usadas se não houver caminho "forte".
+    Com `tabelas`, alcancaveis só oferece essas (as que têm campos); as demais
+    continuam valendo como intermediárias nos caminhos.
+    """
+
+    def __init__(self, relacoes: dict[tuple[str, str], list[tuple[str, str]]],
+                 tabelas: Iterable[str] | None = None):
+        self._tabelas = frozenset(tabelas) if tabelas is not None else None
+        adj_fortes: dict[str, set[str]] = {}
+        adj_todas: dict[str, set[str]] = {}
+        for (master, filha), pares in relacoes.items():
+            if master == filha:
+                continue
+            fraca = all(mf.replace(" ", "").upper() == "CODCOLIGADA" for mf, _ in pares)
+            for a, b in ((master, filha), (filha, master)):
+                adj_todas.setdefault(a, set()).add(b)
+                if not fraca:
+                    adj_fortes.setdefault(a, set()).add(b)
+        # Vizinhos ordenados: o caminho escolhido não depende do hash do processo.
+        self._adj = {
+            True:  {t: tuple(sorted(v)) for t, v in adj_fortes.items()},
+            False: {t: tuple(sorted(v)) for t, v in adj_todas.items()},
+        }
+        self._arvore = lru_cache(maxsize=4096)(self._bfs)
+
+    def _bfs(self, origem: str, profundidade: int, fortes: bool) -> dict[str, tuple[str | None, int]]:
+        """Árvore BFS a partir de `origem`: tabela → (predecessor, distância)."""
+        adj = self._adj[fortes]
+        arvore = {origem: (None, 0)}
+        fila = deque([origem])
+        while fila:
+            atual = fila.popleft()
+            dist = arvore[atual][1]
+            if dist >= profundidade:
+                continue
+            for viz in adj.get(atual, ()):
+                if viz not in arvore:
+                    arvore[viz] = (atual, dist + 1)
+                    fila.append(viz)
+        return arvore
+
+    def _so_fracas(self, origem: str) -> bool:
+        """True se `origem` não tem nenhuma aresta forte (só liga por CODCOLIGADA)."""
+        return origem not in self._adj[True]
+
+    def alcancaveis(self, origem: str, profundidade: int) -> list[str]:
+        """Tabelas a até `profundidade` JOINs de `origem` (exclusive).
+
+        Só arestas fortes, como em caminho/conectar; as fracas valem apenas
+        para uma origem sem nenhuma relação forte (ver ligacoes_fracas).
+        Tabelas fora de `tabelas` (sem campos em CAMPOS) não entram.
+        """
+        fortes = not self._so_fracas(origem)
+        return sorted(t for t in self._arvore(origem, profundidade, fortes)
+                      if t != origem and (self._tabelas is None or t in self._tabelas))
+
+    def ligacoes_fracas(self, origem: str, profundidade: int) -> set[str]:
+        """Das alcançáveis, as que só se ligam a `origem` por CODCOLIGADA."""
+        return set(self.alcancaveis(origem, profundidade)) if self._so_fracas(origem) else set()
+
+    def caminho(self, origem: str, destino: str, profundidade: int) -> list[str] | None:
+        """Menor sequência de tabelas origem → destino, ou None."""
+        for fortes in (True, False):
+            arvore = self._arvore(destino, profundidade, fortes)
+            if origem in arvore:
+                seq, atual = [], origem
+                while atual is not None:
+                    seq.append(atual)
+                    atual = arvore[atual][0]
+                return seq
+        return None
+
+    def conectar(self, raiz: str, tabelas: list[str], profundidade: int) -> tuple[list[PassoJoin], list[str]]:
+        """Liga cada tabela escolhida à árvore de JOINs já montada pelo menor caminho.
+
+        Retorna os passos de JOIN na ordem de emissão (com tabelas intermediárias
+        inseridas onde necessário) e as tabelas sem caminho dentro da profundidade.
+        """
+        na_query, ordem = {raiz}, [raiz]
+        escolhidas = set(tabelas)
+        passos, sem_caminho = [], []
+        for destino in tabelas:
+            if destino in na_query:
+                continue
+            seq = None
+            for fortes in (True, False):
+                arvore = self._arvore(destino, profundidade, fortes)
+                candidatas = [t for t in ordem if t in arvore]
+                if candidatas:
+                    atual = min(candidatas, key=lambda t: arvore[t][1])
+                    seq = []
+                    while atual is not None:
+                        seq.append(atual)
+                        atual = arvore[atual][0]
+                    break
+            if seq is None:
+                sem_caminho.append(destino)
+                continue
+            for anterior, tabela in zip(seq, seq[1:]):
+                passos.append(PassoJoin(tabela, anterior, destino, tabela not in escolhidas))
+                na_query.add(tabela)
+                ordem.append(tabela)
+        return passos, sem_caminho
+
+
+# ============================================================
+# BUSCA DE CAMPOS
+# ============================================================
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas sem acentos: "Salário Base" -> "salario base"."""
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii").lower()
+
+
+class _TextosIndexados:
+    """Textos distintos (já normalizados) com índice invertido de trigramas."""
+
+    def __init__(self, textos: list[str]):
+        self.textos = textos
+        trigramas: dict[str, list[int]] = {}
+        for i, texto in enumerate(textos):
+            for tri in {texto[j:j + 3] for j in range(len(texto) - 2)}:
+                trigramas.setdefault(tri, []).append(i)
+        self._trigramas = {tri: np.array(ids, dtype=np.int32) for tri, ids in trigramas.items()}
+
+    def contendo(self, termo: str) -> np.ndarray:
+        """Ids dos textos que contêm `termo` como substring."""
+        if len(termo) < 3:
+            candidatos = range(len(self.textos))
+        else:
+            listas = []
+            for tri in {termo[j:j + 3] for j in range(len(termo) - 2)}:
+                ids = self._trigramas.get(tri)
+                if ids is None:
+                    return np.empty(0, dtype=np.int32)
+                listas.append(ids)
+            listas.sort(key=len)
+            candidatos = listas[0]
+            for ids in listas[1:]:
+                candidatos = np.intersect1d(candidatos, ids, assume_unique=True)
+        return np.fromiter((i for i in candidatos if termo in self.textos[i]), dtype=np.int32)
+
+
+class BuscaCampos:
+    """Busca por nome de campo e descrição em CAMPOS, sem acentos e por substring.
+
+    Os nomes e as descrições distintos são indexados por trigramas uma vez;
+    uma consulta cruza as listas dos trigramas de cada termo, confere a
+    substring só nos candidatos e pontua por linha de CAMPOS com numpy.
+    Todos os termos precisam aparecer (E); sem resultado, vale qualquer um (OU).
+    """
+
+    _PALAVRAS = re.compile(r"[a-z0-9]+")
+
+    def __init__(self, tabelas, campos, descricoes):
+        self.tabelas    = np.asarray(tabelas, dtype=object)
+        self.campos     = np.asarray(campos, dtype=object)
+        self.descricoes = np.asarray(descricoes, dtype=object)
+        cod_campo, campos_distintos = pd.factorize(pd.Series(self.campos).map(normalizar_texto))
+        cod_desc, descs_distintas   = pd.factorize(pd.Series(self.descricoes).fillna("").map(normalizar_texto))
+        self._cod_campo = cod_campo
+        self._cod_desc  = cod_desc
+        self._campos = _TextosIndexados(list(campos_distintos))
+        self._descs  = _TextosIndexados(list(descs_distintas))
+
+    def _pontos_termo(self, termo: str) -> np.ndarray:
+        """Pontuação de cada linha para um termo (0 = não contém)."""
+        nos_campos = np.zeros(len(self._campos.textos), dtype=np.float32)
+        for i in self._campos.contendo(termo):
+            texto = self._campos.textos[i]
+            nos_campos[i] = 5 if texto == termo else 3 if texto.startswith(termo) else 2
+        nas_descs = np.zeros(len(self._descs.textos), dtype=np.float32)
+        for i in self._descs.contendo(termo):
+            palavras = self._PALAVRAS.findall(self._descs.textos[i])
+            nas_descs[i] = (3 if termo in palavras else
+                            2 if any(p.startswith(termo) for p in palavras) else 1)
+        return np.maximum(nos_campos[self._cod_campo], nas_descs[self._cod_desc])
+
+    def buscar(self, consulta: str, limite: int = 30, tabelas: set[str] | None = None) -> pd.DataFrame:
+        """Colunas TABELA, CAMPO, DESCRIÇÃO e PONTOS, da maior pontuação para a menor.
+
+        `tabelas` restringe o resultado (ex.: às alcançáveis a partir da principal).
+        """
+        termos = list(dict.fromkeys(self._PALAVRAS.findall(normalizar_texto(consulta))))
+        vazio = pd.DataFrame(columns=["TABELA", "CAMPO", "DESCRIÇÃO", "PONTOS"])
+        if not termos:
+            return vazio
+        pontos = [self._pontos_termo(t) for t in termos]
+        total = np.sum(pontos, axis=0)
+        validas = np.logical_and.reduce([p > 0 for p in pontos])
+        if not validas.any():
+            validas = total > 0
+        if tabelas is not None:
+            validas &= np.isin(self.tabelas, list(tabelas))
+        ids = np.flatnonzero(validas)
+        if not len(ids):
+            return vazio
+        # Maior pontuação; empate: descrição mais curta, depois tabela/campo
+        tamanho = np.fromiter((len(d) if isinstance(d, str) else 0 for d in self.descricoes[ids]),
+                              dtype=np.int32, count=len(ids))
+        ordem = np.lexsort((self.campos[ids].astype(str), self.tabelas[ids].astype(str), tamanho, -total[ids]))
+        ids = ids[ordem[:limite]]
+        return pd.DataFrame({"TABELA": self.tabelas[ids], "CAMPO": self.campos[ids],
+                             "DESCRIÇÃO": self.descricoes[ids], "PONTOS": total[ids]})
+
+
+# ============================================================
+# ÍNDICE EM MEMÓRIA
+# ============================================================
+class IndiceMetadados:
+    """Índices construídos uma vez por conjunto de metadados carregado.
+
+    Substitui as varreduras booleanas sobre CAMPOS/RELACIONAMENTOS feitas a cada
+    rerun por consultas O(1) em dicionários.
+    """
+
+    def __init__(self, df_campos: pd.DataFrame, df_sistemas: pd.DataFrame, df_relacoes: pd.DataFrame):
+        col_campo = df_campos.columns[1]
+
+        # Sistema → label e tabelas (mesma regra de prefixo do gerador)
+        self.sistemas = {f"{cod} - {desc}": str(cod)
+                         for cod, desc in zip(df_sistemas["CODSISTEMA"], df_sistemas["DESCRICAO"])}
+        tabelas = sorted(df_campos["TABELA"].dropna().unique().tolist())
+        self._tabelas_por_sistema = {
+            cod: [t for t in tabelas if t.startswith(cod)] for cod in set(self.sistemas.values())
+        }
+
+        # Tabela → campos (ordem original da planilha)
+        campos = df_campos[["TABELA", col_campo]].dropna()
+        self._campos_por_tabela = {
+            tabela: grupo.tolist()
+            for tabela, grupo in campos.groupby("TABELA", sort=False)[col_campo]
+        }
+
+        # Master → filhas e (master, filha) → pares de chaves
+        self._filhas_por_master: dict[str, list[str]] = {}
+        self._relacoes: dict[tuple[str, str], list[tuple[str, str]]] = {}
+        for master, mfield, child, cfield in zip(df_relacoes["MASTERTABLE"], df_relacoes["MASTERFIELD"],
+                                                 df_relacoes["CHILDTABLE"], df_relacoes["CHILDFIELD"]):
+            filhas = self._filhas_por_master.setdefault(master, [])
+            if child not in filhas:
+                filhas.append(child)
+            self._relacoes.setdefault((master, child), []).append((str(mfield), str(cfield)))
+
+        self.grafo = GrafoJoins(self._relacoes, self._campos_por_tabela)
+
+        # Busca textual: montada na primeira consulta
+        fonte = df_campos.dropna(subset=["TABELA", col_campo])
+        self._fonte_busca = (fonte["TABELA"], fonte[col_campo], fonte[df_campos.columns[2]])
+        self._busca: BuscaCampos | None = None
+
+    @property
+    def busca(self) -> BuscaCampos:
+        if self._busca is None:
+            self._busca = BuscaCampos(*self._fonte_busca)
+        return self._busca
+
+    def tabelas_do_sistema(self, cod_sistema: str) -> list[str]:
+        return self._tabelas_por_sistema.get(cod_sistema, [])
+
+    def campos(self, tabela: str) -> list[str]:
+        return self._campos_por_tabela.get(tabela, [])
+
+    def filhas(self, master: str) -> list[str]:
+        return self._filhas_por_master.get(master, [])
+
+    def relacoes(self, master: str, filha: str) -> list[tuple[str, str]]:
+        """Pares (MASTERFIELD, CHILDFIELD) que ligam master → filha."""
+        return self._relacoes.get((master, filha), [])
+
+    def condicoes_join(self, anterior: str, tabela: str) -> list[str]:
+        """Condições ON entre duas tabelas, em qualquer sentido da relação."""
+        conds = []
+        for master, filha in ((anterior, tabela), (tabela, anterior)):
+            for master_field, child_field in self.relacoes(master, filha):
+                for cp, cf in zip(master_field.split(","), child_field.split(",")):
+                    conds.append(f"{master}.{cp.strip()} = {filha}.{cf.strip()}")
+            if conds:
+                break
+        return conds
+
+
+if __name__ == "__main__":
+    import time
+    t0 = time.perf_counter()
+    compilar_metadados()
+    t1 = time.perf_counter()
+    carregar_metadados()
+    t2 = time.perf_counter()
+    print(f"Compilação: {t1 - t0:.2f}s | Carga a partir do cache: {(t2 - t1) * 1000:.1f} ms")
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLANILHAS = ("CAMPOS.xlsx", "SISTEMAS.xlsx", "RELACIONAMENTOS.xlsx")
+
+
+@pytest.fixture(scope="session")
+def indice_real():
+    """IndiceMetadados das planilhas do RM (não versionadas): pula se ausentes."""
+    if not all(os.path.exists(os.path.join(RAIZ, p)) for p in PLANILHAS):
+        pytest.skip("planilhas de metadados do RM ausentes")
+    from sqlmaker_metadados import IndiceMetadados, carregar_metadados
+    return IndiceMetadados(*carregar_metadados())
+
+
+@pytest.fixture(scope="session")
+def ficha():
+    """Ficha financeira sintética no esquema compacto (SCHEMA_FICHA), com alguns nulos."""
+    import numpy as np
+    import pandas as pd
+
+    from ficha_dados import aplicar_schema
+
+    rng = np.random.default_rng(42)
+    n = 5000
+    nomes = np.array([f"Funcionário {i:03d}" for i in range(300)])
+    df = pd.DataFrame({
+        "Coligada":    1,
+        "Empresa":     "Empresa",
+        "Nome":        nomes[rng.integers(0, len(nomes), n)],
+        "Função":      rng.choice(["Analista", "Gerente", "Operador", None], n),
+        "Seção":       rng.choice(["01.001", "01.002", "02.001"], n),
+        "Tipo Evento": rng.choice(["Provento", "Desconto", "Base"], n, p=[0.55, 0.35, 0.10]),
+        "Evento":      rng.choice([f"Evento {i}" for i in range(40)], n),
+        "Período":     rng.choice(["1", "2"], n),
+        "Mês":         rng.integers(1, 13, n),
+        "Ano":         rng.choice([2023, 2024], n),
+        "Valor":       rng.gamma(2.0, 800.0, n).round(2),
+        "Liquido":     rng.normal(0, 500, n).round(2),
+    })
+    return aplicar_schema(df)
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ficha_analise import (CuboFicha, FiltroFicha, faixas_pareto, fmt, fmt_pct, fmt_serie,
+                           indices_maiores, lttb, reduzir_figura)
+
+
+@pytest.fixture
+def go():
+    return pytest.importorskip("plotly.graph_objects")
+
+
+def test_lttb_mantem_extremos_e_picos():
+    x = np.arange(1000, dtype="float64")
+    y = np.zeros(1000)
+    y[500] = 100.0
+    idx = lttb(x, y, 50)
+    assert len(idx) == 50 and idx[0] == 0 and idx[-1] == 999
+    assert 500 in idx
+    assert (np.diff(idx) > 0).all()
+
+
+def test_lttb_nao_reduz_serie_curta():
+    assert lttb(np.arange(10), np.arange(10), 20).tolist() == list(range(10))
+
+
+def test_indices_maiores_em_ordem_original():
+    assert indices_maiores(np.array([5, -9, 1, 7, 0]), 3).tolist() == [0, 1, 3]
+
+
+def test_figura_dentro_do_orcamento_nao_muda(go):
+    fig = go.Figure(go.Bar(x=list("abc"), y=[1, 2, 3]))
+    assert reduzir_figura(fig, 1 << 20, 100)[0] is fig
+
+
+def test_pareto_barra_e_linha_ficam_com_o_mesmo_x(go):
+    n = 3000
+    cats = [f"Evento {i}" for i in range(n)]
+    v = np.sort(np.random.default_rng(0).random(n) * 1000)[::-1]
+    fig = go.Figure([go.Bar(x=cats, y=v), go.Scatter(x=cats, y=np.cumsum(v) / v.sum() * 100, yaxis="y2")])
+    reduzida, antes, depois = reduzir_figura(fig, 1 << 20, 200)
+    barra, linha = reduzida.data
+    assert len(barra.x) == 200 and list(barra.x) == list(linha.x)
+    assert barra.x[-1] == "Outros" and np.isnan(linha.y[-1])
+    assert barra.y.sum() == pytest.approx(v.sum())
+    assert depois < antes
+    assert len(fig.data[0].x) == n   # a original fica intacta
+
+
+def test_outros_tem_hover_proprio_e_template_fatiado(go):
+    n = 100
+    v = np.arange(n, dtype="float64")
+    fig = go.Figure(go.Bar(y=[f"F{i}" for i in range(n)], x=v, orientation="h", customdata=np.c_[v, v],
+                           hovertemplate="%{y} R$ %{customdata[0]:,.2f}<extra></extra>"))
+    barra = reduzir_figura(fig, 1 << 20, 20)[0].data[0]
+    assert len(barra.hovertemplate) == len(barra.y) == len(barra.customdata) == 20
+    assert barra.hovertemplate[0].startswith("%{y}")
+    assert "Outros (81 itens)" in barra.hovertemplate[-1] and "customdata" not in barra.hovertemplate[-1]
+
+
+def test_estimativa_proxima_do_json(go):
+    n = 5000
+    fig = go.Figure(go.Scatter(x=np.arange(n), y=np.random.default_rng(1).random(n)))
+    _, antes, _ = reduzir_figura(fig, 1 << 30, n)
+    assert 0.5 < antes / len(fig.to_json()) < 2
+
+
+# Comparações com as contas que o dashboard fazia direto sobre o DataFrame
+def _soma_por(df, col, tipo):
+    return df[df["Tipo Evento"] == tipo].groupby(col, observed=True)["Valor"].sum()
+
+
+def test_filtro_equivale_ao_isin(ficha):
+    filtro = FiltroFicha(ficha)
+    selecoes = [
+        {},
+        {"Ano": [2024], "Tipo Evento": ["Provento", "Desconto"]},
+        {"Mês": list(range(3, 7)), "Período": ["1"], "Nome": ["Funcionário 007", "Funcionário 010"]},
+        {"Função": ["Analista", "Gerente", "Operador"]},   # todos os valores, mas a coluna tem nulos
+        {"Seção": []},
+    ]
+    for selecao in selecoes:
+        mascara = np.ones(len(ficha), dtype=bool)
+        for coluna, valores in selecao.items():
+            mascara &= ficha[coluna].isin(valores).to_numpy()
+        df, _ = filtro.filtrar(selecao)
+        pd.testing.assert_frame_equal(df, ficha[mascara])
+        assert filtro.filtrar(selecao)[0] is df   # segunda vez vem do cache
+
+
+def test_assinatura_ignora_selecao_completa(ficha):
+    filtro = FiltroFicha(ficha)
+    assert filtro.assinatura({"Ano": [2023, 2024], "Seção": filtro.valores("Seção")}) == ()
+    assert filtro.assinatura({"Função": filtro.valores("Função")}) != ()
+
+
+def test_cubo_totais_e_saldo(ficha):
+    cubo = CuboFicha(ficha)
+    assert cubo.registros == len(ficha)
+    assert cubo.total() == pytest.approx(ficha["Valor"].sum())
+    assert cubo.total("Liquido", tipo="Desconto") == pytest.approx(
+        ficha.loc[ficha["Tipo Evento"] == "Desconto", "Liquido"].sum())
+    base = (ficha.groupby(["Ano", "Mês", "Tipo Evento"], observed=True)["Valor"].sum().reset_index()
+            .pivot_table(index=["Ano", "Mês"], columns="Tipo Evento", values="Valor", aggfunc="sum")
+            .fillna(0).reset_index())
+    saldo = cubo.saldo_periodo()
+    np.testing.assert_allclose(saldo["Provento"], base["Provento"])
+    np.testing.assert_allclose(saldo["Saldo"], base["Provento"] - base["Desconto"])
+
+
+@pytest.mark.parametrize("por", ["Nome", "Seção", "Função"])
+def test_comprometimento_igual_ao_calculo_direto(ficha, por):
+    prov = _soma_por(ficha, por, "Provento").rename("Proventos")
+    desc = _soma_por(ficha, por, "Desconto").rename("Descontos")
+    base = pd.concat([prov, desc], axis=1).fillna(0)
+    base = base[base["Proventos"] > 0]
+    base["Índice (%)"] = (base["Descontos"] / base["Proventos"] * 100).round(1)
+
+    comp = CuboFicha(ficha).comprometimento(por).set_index(por)
+    assert set(comp.index) == set(base.index)
+    pd.testing.assert_series_equal(comp["Índice (%)"].sort_index(), base["Índice (%)"].sort_index(),
+                                   check_names=False, check_index_type=False)
+    assert comp["Índice (%)"].is_monotonic_decreasing
+
+
+@pytest.mark.parametrize("tipo", ["Provento", None])
+def test_pareto_e_faixas_iguais_ao_laco_original(ficha, tipo):
+    if tipo is None:
+        base = _soma_por(ficha, "Nome", "Provento").subtract(_soma_por(ficha, "Nome", "Desconto"), fill_value=0)
+    else:
+        base = _soma_por(ficha, "Nome", tipo)
+    base = base[base > 0].sort_values(ascending=False)
+    pareto = CuboFicha(ficha).pareto("Nome", tipo)
+    np.testing.assert_allclose(pareto["Valor"], base.to_numpy())
+    np.testing.assert_allclose(pareto["% Acumulado"], (base.cumsum() / base.sum() * 100).round(2))
+
+    n_corte, n_buckets = 37, 20
+    tamanho = max(1, len(pareto) // n_buckets)
+    esperadas = []
+    for i in range(0, len(pareto), tamanho):
+        fatia = pareto.iloc[i:i + tamanho]
+        ini, fim = fatia["Rank"].iloc[0], fatia["Rank"].iloc[-1]
+        esperadas.append((f"{ini}–{fim}", fatia["Valor"].sum(), fatia["% Acumulado"].iloc[-1],
+                          len(fatia), fim <= n_corte, ini <= n_corte < fim))
+    faixas = faixas_pareto(pareto, n_buckets, n_corte)
+    obtidas = list(zip(faixas["label"], faixas["Valor"], faixas["% Acumulado"], faixas["n"],
+                       faixas["alerta"], faixas["parcial"]))
+    assert [(a, pytest.approx(b), c, d, e, f) for a, b, c, d, e, f in esperadas] == obtidas
+
+
+def test_fmt_serie_igual_a_fmt_por_linha():
+    valores = pd.Series([1234.5, 0.0, 1234.5, -10.256, 1e6])
+    assert fmt_serie(valores).tolist() == valores.apply(fmt).tolist()
+    assert fmt_pct(valores).tolist() == [f"{v:.1f}%" for v in valores]
@@ -0,0 +1,86 @@
+import os
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ficha_dados
+from ficha_dados import COLUNAS_FICHA, CacheResultados, aplicar_schema, parse_ficha_financeira
+
+
+@pytest.fixture
+def cache(tmp_path):
+    pytest.importorskip("pyarrow")
+    return CacheResultados(max_bytes=1 << 20, pasta_spill=str(tmp_path))
+
+
+def _grande():
+    return pd.DataFrame({"Valor": np.arange(200_000, dtype="float64")})
+
+
+def test_despejo_grava_spill_e_volta_para_memoria(cache, tmp_path):
+    cache.guardar("w", 1, 2023, "ana", "x", _grande())
+    cache.guardar("w", 1, 2024, "ana", "x", _grande())
+    assert len(os.listdir(tmp_path)) == 1
+    df = cache.obter("w", 1, 2023, "ana", "x")
+    assert df is not None and len(df) == 200_000
+
+
+def test_spill_gravado_depois_de_invalidar_e_descartado(cache, tmp_path):
+    geracao = cache._geracao
+    cache.invalidar("w", 1, 2023)
+    cache._gravar_spill([(cache._chave("w", 1, 2023), _grande(), 0.0)], geracao)
+    assert os.listdir(tmp_path) == []
+
+
+def test_obter_exige_credencial_autorizada(cache):
+    cache.guardar("w", 1, 2024, "ana", "x", pd.DataFrame({"Valor": [1.0]}))
+    assert cache.contem("w", 1, 2024)
+    assert cache.obter("w", 1, 2024, "bia", "y") is None
+    cache.autorizar("w", 1, "bia", "y")
+    assert cache.obter("w", 1, 2024, "bia", "y") is not None
+
+
+# Parser em blocos contra a leitura da árvore inteira que buscar_dados fazia
+def _parse_arvore(resultado):
+    registros = []
+    for item in ET.fromstring(resultado).findall("Resultado"):
+        registros.append({
+            coluna: (tipo(item.findtext(tag) or 0) if tipo is not str else item.findtext(tag))
+            for tag, (coluna, tipo) in COLUNAS_FICHA.items()
+        })
+    return aplicar_schema(pd.DataFrame(registros))
+
+
+def _xml(df):
+    tags = {coluna: tag for tag, (coluna, _) in COLUNAS_FICHA.items()}
+    linhas = ["<?xml version=\"1.0\" encoding=\"utf-8\"?>", "<NewDataSet>"]
+    for registro in df.to_dict("records"):
+        # O DataSet do RM omite campos nulos
+        campos = "".join(f"<{tags[c]}>{escape(str(v))}</{tags[c]}>" for c, v in registro.items()
+                         if v is not None and not (isinstance(v, float) and np.isnan(v)))
+        linhas.append(f"  <Resultado>{campos}</Resultado>")
+    linhas.append("</NewDataSet>")
+    return "\n".join(linhas)
+
+
+@pytest.mark.parametrize("bloco", [1 << 20, 4096, 10])   # 10 bytes: todo registro é maior que o bloco
+def test_parse_em_blocos_igual_a_arvore_inteira(ficha, monkeypatch, bloco):
+    df = ficha.head(800).copy()
+    df["Nome"] = df["Nome"].cat.rename_categories(lambda n: n.replace("0", "<&>"))
+    xml = _xml(df)
+    monkeypatch.setattr(ficha_dados, "_BLOCO_PARSE", bloco)
+    estatisticas = {}
+    obtido = parse_ficha_financeira(xml.encode("utf-8"), estatisticas)
+    pd.testing.assert_frame_equal(obtido, _parse_arvore(xml))
+    assert obtido["Função"].isna().sum() == df["Função"].isna().sum() > 0
+    assert estatisticas["linhas"] == len(df)
+
+
+def test_parse_campos_omitidos_e_resultado_vazio():
+    xml = ("<NewDataSet><Resultado><CODCOLIGADA>1</CODCOLIGADA><NOME>Ana</NOME></Resultado>"
+           "<Resultado><VALOR>10.5</VALOR><MESCOMP>3</MESCOMP></Resultado></NewDataSet>")
+    pd.testing.assert_frame_equal(parse_ficha_financeira(xml), _parse_arvore(xml))
+    assert parse_ficha_financeira("<NewDataSet />").empty
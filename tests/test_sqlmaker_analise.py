@@ -0,0 +1,108 @@
+import random
+import re
+
+import pytest
+
+from sqlmaker_analise import AnalisadorSQL, TokenizadorIncremental, analisar, tokenizar
+
+SQL = """WITH ATIVOS AS (SELECT CHAPA FROM PFUNC WHERE CODSITUACAO <> 'D')
+SELECT PFUNC.CHAPA, PFUNC.NOME AS "Nome do funcionário", -- comentário, com vírgula
+       SUM(PFFINANC.VALOR) AS TOTAL, COUNT(DISTINCT PFFINANC.CODEVENTO),
+       /* bloco ( sem fechar */ 'it''s, FROM' AS TEXTO
+FROM PFUNC (NOLOCK)
+INNER JOIN PFFINANC (NOLOCK) ON PFFINANC.CODCOLIGADA = PFUNC.CODCOLIGADA AND PFFINANC.CHAPA = PFUNC.CHAPA
+LEFT JOIN PSECAO S ON S.CODCOLIGADA = PFUNC.CODCOLIGADA AND S.CODIGO = PFUNC.CODSECAO
+WHERE PFUNC.CHAPA IN (SELECT CHAPA FROM ATIVOS) AND PFFINANC.ANOCOMP = 2024
+GROUP BY PFUNC.CHAPA, PFUNC.NOME"""
+
+
+# Extração de colunas que o app fazia antes do analisador (regex sobre SELECT ... FROM)
+def _extrair_colunas_regex(sql):
+    sql = re.sub(r"--.*", "", sql)
+    match = re.search(r"SELECT(.*?)FROM", sql, re.IGNORECASE | re.DOTALL)
+    if not match:
+        return []
+    colunas_final = []
+    for col in [c.strip() for c in match.group(1).split(",") if c.strip()]:
+        alias_match = re.search(r"\s+AS\s+(.+)$", col, re.IGNORECASE)
+        if alias_match:
+            colunas_final.append(alias_match.group(1).strip())
+            continue
+        func_match = re.search(r"(\w+)\((.*?)\)", col)
+        if func_match:
+            colunas_final.append(f"{func_match.group(1).upper()}_{func_match.group(2).split('.')[-1]}")
+            continue
+        colunas_final.append(col)
+    return colunas_final
+
+
+def test_tokens_cobrem_o_texto():
+    tokens = tokenizar(SQL)
+    assert "".join(t.texto for t in tokens) == SQL
+    assert all(a.fim == b.inicio for a, b in zip(tokens, tokens[1:]))
+    assert "'it''s, FROM'" in [t.texto for t in tokens if t.tipo == "texto"]
+    assert "/* bloco ( sem fechar */" in [t.texto for t in tokens if t.tipo == "comentario"]
+
+
+def test_incremental_igual_a_tokenizacao_completa():
+    rng = random.Random(0)
+    incremental = TokenizadorIncremental()
+    texto = SQL
+    pedacos = ["'", "--", "/*", "*/", "\n", " ", ",", "(", ")", "[X", "]", "SELECT", "2024", "N'a'"]
+    for _ in range(300):
+        i = rng.randrange(len(texto) + 1)
+        if rng.random() < 0.5 and texto:
+            texto = texto[:i] + texto[i + rng.randrange(1, 10):]
+        else:
+            texto = texto[:i] + rng.choice(pedacos) + texto[i:]
+        assert incremental.tokens(texto) == tokenizar(texto)
+
+
+def test_analisador_incremental_igual_a_analise_completa():
+    analisador = AnalisadorSQL()
+    texto = ""
+    for c in SQL:   # digitação caractere a caractere
+        texto += c
+        assert analisador.analisar(texto) == analisar(texto)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT PFUNC.CHAPA, PFUNC.NOME FROM PFUNC",
+    "SELECT PFUNC.CHAPA AS MATRICULA, SUM(PFFINANC.VALOR) AS TOTAL FROM PFUNC, PFFINANC",
+    "select count(PFUNC.CHAPA), max(PFFINANC.VALOR)\nfrom PFUNC -- fim",
+    "SELECT CHAPA, NOME AS [Nome], AVG(SALARIO) FROM PFUNC WHERE CODSITUACAO = 'A'",
+])
+def test_rotulos_iguais_a_extracao_por_regex(sql):
+    # A regex devolvia a referência inteira (PFUNC.CHAPA); o nome da coluna no resultado é o campo
+    esperado = [c.split(".")[-1].strip("[]") for c in _extrair_colunas_regex(sql)]
+    assert [c.rotulo for c in analisar(sql).colunas] == esperado
+
+
+def test_casos_que_a_regex_errava():
+    analise = analisar(SQL)
+    assert [c.rotulo for c in analise.colunas] == [
+        "CHAPA", "Nome do funcionário", "TOTAL", "COUNT_CODEVENTO", "TEXTO"]
+    assert [c.rotulo for c in analisar("SELECT ISNULL(A.X, 0) AS X, B.Y FROM A, B").colunas] == ["X", "Y"]
+    assert analise.erros == ()
+
+
+def test_tabelas_juncoes_e_referenciadas():
+    analise = analisar(SQL)
+    assert [(t.nome, t.apelido, t.juncao) for t in analise.tabelas] == [
+        ("PFUNC", "", "FROM"), ("PFFINANC", "", "INNER"), ("PSECAO", "S", "LEFT")]
+    assert [t.nome for t in analise.juncoes] == ["PFFINANC", "PSECAO"]
+    assert "ATIVOS" not in analise.referenciadas   # CTE não é tabela
+    assert analisar("SELECT * FROM PFUNC A, PSECAO B WHERE A.CODSECAO = B.CODIGO").referenciadas == ("PFUNC", "PSECAO")
+
+
+@pytest.mark.parametrize("sql, erro", [
+    ("SELECT A, , B FROM T", "Coluna vazia na lista do SELECT"),
+    ("SELECT A, FROM T", "Coluna vazia na lista do SELECT"),
+    ("SELECT FROM T", "SELECT sem colunas."),
+    ("UPDATE T SET A = 1", "Nenhum SELECT encontrado."),
+    ("SELECT 'abc FROM T", "Texto entre aspas sem fechar."),
+    ("SELECT (A FROM T", "parêntese(s) sem fechar"),
+    ("SELECT A) FROM T", "Parêntese ')' sem abertura"),
+])
+def test_erros(sql, erro):
+    assert any(erro in e for e in analisar(sql).erros)
@@ -0,0 +1,224 @@
+import pandas as pd
+import pytest
+
+from sqlmaker_compilador import (Agregacao, CompiladorSQL, ConsultaSQL, Filtro, Ordenacao,
+                                 condicao_filtro, montar)
+from sqlmaker_metadados import IndiceMetadados
+
+CAMPOS = {
+    "PSECAO":   ["CODCOLIGADA", "CODIGO", "DESCRICAO"],
+    "PFUNC":    ["CODCOLIGADA", "CHAPA", "NOME", "CODSECAO", "SALARIO"],
+    "PFFINANC": ["CODCOLIGADA", "CHAPA", "CODEVENTO", "VALOR", "ANOCOMP"],
+    "PEVENTO":  ["CODCOLIGADA", "CODIGO", "DESCRICAO"],
+}
+RELACOES = [
+    ("PSECAO", "CODCOLIGADA,CODIGO", "PFUNC", "CODCOLIGADA,CODSECAO"),
+    ("PFUNC", "CODCOLIGADA,CHAPA", "PFFINANC", "CODCOLIGADA,CHAPA"),
+    ("PEVENTO", "CODCOLIGADA,CODIGO", "PFFINANC", "CODCOLIGADA,CODEVENTO"),
+]
+
+
+@pytest.fixture(scope="module")
+def df_relacoes():
+    return pd.DataFrame(RELACOES, columns=["MASTERTABLE", "MASTERFIELD", "CHILDTABLE", "CHILDFIELD"])
+
+
+@pytest.fixture(scope="module")
+def indice(df_relacoes):
+    df_campos = pd.DataFrame([(t, c, c.title()) for t, cs in CAMPOS.items() for c in cs],
+                             columns=["TABELA", "CAMPO", "DESCRIÇÃO"])
+    df_sistemas = pd.DataFrame({"CODSISTEMA": ["P"], "DESCRICAO": ["Folha"]})
+    return IndiceMetadados(df_campos, df_sistemas, df_relacoes)
+
+
+def _sql_original(df_relacoes, tabela_pai, campos_pai, campos_por_filha, tipos_join,
+                  filtros=(), agregacao=None, ordenacoes=()):
+    """Geração inline que o SQL Maker fazia antes do compilador (relação direta ou entre filhas)."""
+    colunas_select = [f"{tabela_pai}.{c}" for c in campos_pai]
+    for filha, cols in campos_por_filha.items():
+        colunas_select += [f"{filha}.{c}" for c in cols]
+    if agregacao:
+        func, prefixo, campo = agregacao
+        campos_gb = [c for c in colunas_select if not c.endswith(f".{campo}")]
+        select_final = ",\n  ".join(campos_gb + [f"{func}({prefixo}.{campo}) AS {func}_{campo}"])
+        group_by_sql = "\nGROUP BY\n  " + ",\n  ".join(campos_gb)
+    else:
+        select_final, group_by_sql = ",\n  ".join(colunas_select), ""
+    script = f"SELECT\n  {select_final}\nFROM {tabela_pai} (NOLOCK)"
+    filhas = list(campos_por_filha)
+    for filha in filhas:
+        rel = df_relacoes[(df_relacoes["MASTERTABLE"] == tabela_pai) & (df_relacoes["CHILDTABLE"] == filha)]
+        master_usado = tabela_pai
+        if rel.empty:
+            for outra in filhas:
+                rel_ff = df_relacoes[(df_relacoes["MASTERTABLE"] == outra) & (df_relacoes["CHILDTABLE"] == filha)]
+                if outra != filha and not rel_ff.empty:
+                    rel, master_usado = rel_ff, outra
+                    break
+        conds = []
+        for _, r in rel.iterrows():
+            for cp, cf in zip(str(r["MASTERFIELD"]).split(","), str(r["CHILDFIELD"]).split(",")):
+                conds.append(f"{master_usado}.{cp.strip()} = {filha}.{cf.strip()}")
+        script += f"\n{tipos_join[filha]} JOIN {filha} (NOLOCK) ON\n  " + " AND\n  ".join(conds)
+    if filtros:
+        script += "\nWHERE\n  " + "\n  ".join(
+            condicao_filtro(f) if i == 0 else f"{f.conector} {condicao_filtro(f)}" for i, f in enumerate(filtros))
+    script += group_by_sql
+    if ordenacoes:
+        script += "\nORDER BY\n  " + ",\n  ".join(f"{o.campo} {o.direcao}" for o in ordenacoes)
+    return script
+
+
+FILTROS = (Filtro("PFUNC.CHAPA", "=", "00123"), Filtro("PFFINANC.VALOR", ">", "1.500,00"),
+           Filtro("PFFINANC.CODEVENTO", "IN", "'001', '002'", "OR"),
+           Filtro("PFFINANC.ANOCOMP", "BETWEEN", "2023|2024"), Filtro("PFUNC.NOME", "LIKE", "%SILVA%"),
+           Filtro("PFUNC.CODSECAO", "IS NOT NULL"))
+
+
+@pytest.mark.parametrize("caso", ["simples", "filtros", "calculo", "entre_filhas"])
+def test_sem_otimizar_igual_a_geracao_original(indice, df_relacoes, caso):
+    filtros, agregacao, ordenacao = (), None, ()
+    if caso == "entre_filhas":
+        pai, campos_pai = "PSECAO", ["DESCRICAO"]
+        por_filha = {"PFUNC": ["CHAPA"], "PFFINANC": ["VALOR"]}
+    else:
+        pai, campos_pai = "PFUNC", ["CHAPA", "NOME"]
+        por_filha = {"PFFINANC": ["CODEVENTO", "VALOR"]}
+    tipos = {f: "LEFT" for f in por_filha}
+    if caso == "filtros":
+        filtros, ordenacao = FILTROS, (Ordenacao("PFUNC.NOME"), Ordenacao("PFFINANC.VALOR", "DESC"))
+    if caso == "calculo":
+        agregacao = ("SUM", "PFFINANC", "VALOR")
+
+    colunas = [(pai, c) for c in campos_pai] + [(f, c) for f, cs in por_filha.items() for c in cs]
+    consulta = ConsultaSQL.criar(pai, colunas, tipos.items(),
+                                 agregacao=Agregacao(*agregacao) if agregacao else None,
+                                 filtros=filtros, ordenacao=ordenacao, otimizar=False)
+    esperado = _sql_original(df_relacoes, pai, campos_pai, por_filha, tipos, filtros, agregacao, ordenacao)
+    assert CompiladorSQL(indice).compilar(consulta) == esperado
+
+
+def test_intermediaria_entra_no_caminho(indice):
+    consulta = ConsultaSQL.criar("PSECAO", [("PSECAO", "DESCRICAO"), ("PFFINANC", "VALOR")],
+                                 [("PFFINANC", "LEFT")], otimizar=False)
+    no = montar(consulta, indice)
+    assert [(j.tipo, j.tabela, j.nota) for j in no.joins] == [
+        ("LEFT", "PFUNC", "intermediária para PFFINANC"), ("LEFT", "PFFINANC", "")]
+
+
+def test_montar_rejeita_consulta_sem_colunas_ou_com_tabela_fora(indice):
+    with pytest.raises(ValueError):
+        montar(ConsultaSQL.criar("PFUNC", []), indice)
+    with pytest.raises(ValueError, match="PSECAO"):
+        montar(ConsultaSQL.criar("PFUNC", [("PSECAO", "DESCRICAO")]), indice)
+
+
+def test_compilar_usa_cache_por_especificacao(indice):
+    compilador = CompiladorSQL(indice)
+    a = ConsultaSQL.criar("PFUNC", [("PFUNC", "CHAPA")], filtros=[{"campo": "PFUNC.CHAPA", "operador": "=",
+                                                                  "valor": 123}])
+    b = ConsultaSQL.criar("PFUNC", [["PFUNC", "CHAPA"]], filtros=[Filtro("PFUNC.CHAPA", "=", "123")])
+    assert compilador.compilar(a) is compilador.compilar(b)
+    assert compilador.compilar.cache_info().hits == 1
+
+
+def test_de_dict_qualifica_campos_e_junta_tabelas_citadas(indice):
+    spec = {"tabela": "PFUNC", "colunas": ["CHAPA", "PSECAO.DESCRICAO"],
+            "filtros": [{"campo": "CODCOLIGADA", "operador": "=", "valor": 1},
+                        {"campo": "PFFINANC.CODEVENTO", "operador": "IN", "valor": ["001", 2]}],
+            "ordenacao": ["NOME DESC"]}
+    consulta = ConsultaSQL.de_dict(spec, indice.grafo)
+    assert consulta.colunas == (("PFUNC", "CHAPA"), ("PSECAO", "DESCRICAO"))
+    assert dict(consulta.juncoes) == {"PSECAO": "INNER", "PFFINANC": "INNER"}
+    assert [(f.campo, f.valor) for f in consulta.filtros] == [
+        ("PFUNC.CODCOLIGADA", "1"), ("PFFINANC.CODEVENTO", "'001', 2")]
+    assert consulta.ordenacao == (Ordenacao("PFUNC.NOME", "DESC"),)
+
+
+def test_de_dict_rejeita_tipo_de_join_e_tabela_sem_caminho(indice):
+    with pytest.raises(ValueError, match="OUTER"):
+        ConsultaSQL.de_dict({"tabela": "PFUNC", "colunas": ["CHAPA"], "juncoes": {"PSECAO": "outer"}})
+    with pytest.raises(ValueError, match="PEVENTO"):
+        ConsultaSQL.de_dict({"tabela": "PSECAO", "colunas": ["PEVENTO.DESCRICAO"], "profundidade": 2},
+                            indice.grafo)
+
+
+# ============================================================
+# otimizar(): mesma resposta que a sentença na ordem pedida
+# ============================================================
+@pytest.fixture(scope="module")
+def banco():
+    """SQLite com as tabelas do CAMPOS de teste e dados sintéticos (com linhas órfãs e nulos)."""
+    import random
+    import sqlite3
+
+    sorteio = random.Random(7)
+    con = sqlite3.connect(":memory:")
+    for tabela, campos in CAMPOS.items():
+        con.execute(f"CREATE TABLE {tabela} ({', '.join(campos)})")
+    con.executemany("INSERT INTO PSECAO VALUES (?, ?, ?)",
+                    [(c, f"S{i}", f"Seção {i}") for c in (1, 2) for i in range(5)])
+    con.executemany("INSERT INTO PEVENTO VALUES (?, ?, ?)",
+                    [(c, f"{i:03d}", f"Evento {i}") for c in (1, 2) for i in range(8)])
+    con.executemany("INSERT INTO PFUNC VALUES (?, ?, ?, ?, ?)",
+                    [(sorteio.choice((1, 2)), f"{i:05d}", sorteio.choice(("ANA SILVA", "BIA SOUZA", "CAIO")),
+                      sorteio.choice(("S0", "S1", "S2", "S9", None)), sorteio.randint(1000, 9000))
+                     for i in range(60)])
+    con.executemany("INSERT INTO PFFINANC VALUES (?, ?, ?, ?, ?)",
+                    [(sorteio.choice((1, 2)), f"{sorteio.randint(0, 70):05d}", f"{sorteio.randint(0, 9):03d}",
+                      sorteio.randint(0, 3000), sorteio.choice((2023, 2024))) for _ in range(400)])
+    return con
+
+
+def _executar(banco, sql):
+    return sorted(banco.execute(sql.replace(" (NOLOCK)", "")).fetchall(), key=repr)
+
+
+CONSULTAS = [
+    # LEFT com filtro que exige a linha vira INNER; filtro desce para a derivada
+    dict(colunas=[("PFUNC", "CHAPA"), ("PFFINANC", "VALOR")], juncoes=[("PFFINANC", "LEFT")],
+         filtros=[Filtro("PFFINANC.VALOR", ">", "1000"), Filtro("PFUNC.CODCOLIGADA", "=", "1")]),
+    # IS NULL mantém o LEFT (busca justamente as linhas sem correspondência)
+    dict(colunas=[("PFUNC", "CHAPA"), ("PSECAO", "DESCRICAO")], juncoes=[("PSECAO", "LEFT")],
+         filtros=[Filtro("PSECAO.DESCRICAO", "IS NULL")]),
+    # OR: nenhuma regra que dependa do WHERE se aplica
+    dict(colunas=[("PFUNC", "NOME"), ("PFFINANC", "CODEVENTO")], juncoes=[("PFFINANC", "LEFT")],
+         filtros=[Filtro("PFFINANC.ANOCOMP", "=", "2024"), Filtro("PFUNC.NOME", "LIKE", "%SILVA%", "OR")]),
+    # Vários JOINs, intermediária e filtros em tabelas diferentes
+    dict(colunas=[("PFUNC", "CHAPA"), ("PSECAO", "DESCRICAO"), ("PEVENTO", "DESCRICAO")],
+         juncoes=[("PSECAO", "INNER"), ("PEVENTO", "LEFT")], profundidade=2,
+         filtros=[Filtro("PEVENTO.CODIGO", "IN", "'001', '002'"), Filtro("PFUNC.SALARIO", "BETWEEN", "2000|7000"),
+                  Filtro("PSECAO.CODCOLIGADA", "=", "2")]),
+    # Cálculo com GROUP BY
+    dict(colunas=[("PFUNC", "CODSECAO"), ("PFFINANC", "VALOR")], juncoes=[("PFFINANC", "INNER")],
+         agregacao=Agregacao("SUM", "PFFINANC", "VALOR"), filtros=[Filtro("PFFINANC.CODEVENTO", "=", "003")]),
+]
+
+
+@pytest.mark.parametrize("i", range(len(CONSULTAS)))
+def test_otimizada_devolve_as_mesmas_linhas(indice, banco, i):
+    compilador = CompiladorSQL(indice)
+    base = ConsultaSQL.criar("PFUNC", **CONSULTAS[i], otimizar=False)
+    original = compilador.compilar(base)
+    otimizada = compilador.compilar(ConsultaSQL.criar("PFUNC", **CONSULTAS[i]))
+    assert _executar(banco, otimizada) == _executar(banco, original)
+
+
+def test_regras_de_reescrita(indice):
+    from sqlmaker_compilador import otimizar
+
+    def arvore(i):
+        return otimizar(montar(ConsultaSQL.criar("PFUNC", **CONSULTAS[i]), indice))
+
+    no = arvore(0)
+    assert [(j.tipo, j.tabela) for j in no.joins] == [("INNER", "PFFINANC")]
+    assert [f.campo for f in no.joins[0].filtros] == ["PFFINANC.VALOR"]
+    assert [f.campo for f in no.where] == ["PFUNC.CODCOLIGADA"]
+    assert no.joins[0].condicoes[0].startswith("PFUNC.CODCOLIGADA")
+    assert arvore(1).joins[0].tipo == "LEFT"
+    no = arvore(2)
+    assert no.joins[0].tipo == "LEFT" and not no.joins[0].filtros and len(no.where) == 2
+    # O IN em PEVENTO torna o caminho INNER e mais seletivo que CODCOLIGADA em PSECAO
+    no = arvore(3)
+    assert [(j.tipo, j.tabela) for j in no.joins] == [("INNER", "PFFINANC"), ("INNER", "PEVENTO"),
+                                                      ("INNER", "PSECAO")]
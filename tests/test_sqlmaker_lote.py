@@ -0,0 +1,63 @@
+import json
+
+import pandas as pd
+import pytest
+
+import sqlmaker_lote
+from sqlmaker_compilador import CompiladorSQL
+from sqlmaker_metadados import IndiceMetadados
+
+
+@pytest.fixture
+def compilador(monkeypatch):
+    df_campos = pd.DataFrame({"TABELA": ["PFUNC", "PFUNC", "PSECAO"],
+                              "CAMPO": ["CHAPA", "CODSECAO", "DESCRICAO"],
+                              "DESCRIÇÃO": ["Chapa", "Seção", "Descrição"]})
+    df_sistemas = pd.DataFrame({"CODSISTEMA": ["P"], "DESCRICAO": ["Folha"]})
+    df_relacoes = pd.DataFrame({"MASTERTABLE": ["PSECAO"], "MASTERFIELD": ["CODCOLIGADA,CODIGO"],
+                                "CHILDTABLE": ["PFUNC"], "CHILDFIELD": ["CODCOLIGADA,CODSECAO"]})
+    compilador = CompiladorSQL(IndiceMetadados(df_campos, df_sistemas, df_relacoes))
+    monkeypatch.setattr(sqlmaker_lote, "_compilador", compilador)
+    return compilador
+
+
+def _arquivo(tmp_path, nome, conteudo):
+    caminho = tmp_path / nome
+    caminho.write_text(conteudo, encoding="utf-8")
+    return str(caminho)
+
+
+def test_nome_vira_arquivo_seguro(tmp_path):
+    caminho = _arquivo(tmp_path, "rel.json", json.dumps({"nome": "../../etc/folha x", "tabela": "PFUNC"}))
+    assert sqlmaker_lote.ler_especificacoes(caminho)[0]["nome"] == "etc_folha_x"
+
+
+def test_nome_padrao_pelo_arquivo(tmp_path):
+    caminho = _arquivo(tmp_path, "rel.json", json.dumps([{"tabela": "PFUNC"}, {"tabela": "PSECAO"}]))
+    assert [s["nome"] for s in sqlmaker_lote.ler_especificacoes(caminho)] == ["rel_1", "rel_2"]
+
+
+@pytest.mark.parametrize("conteudo", ["", "- 1\n- {tabela: PFUNC}\n", "a: ["])
+def test_yaml_vazio_ou_invalido_levanta_valueerror(tmp_path, conteudo):
+    pytest.importorskip("yaml")
+    with pytest.raises(ValueError):
+        sqlmaker_lote.ler_especificacoes(_arquivo(tmp_path, "rel.yaml", conteudo))
+
+
+def test_erros_ficam_na_consulta(tmp_path, compilador):
+    specs = [{"nome": "ok", "tabela": "PFUNC", "colunas": ["CHAPA", "PSECAO.DESCRICAO"]},
+             {"nome": "outer", "tabela": "PFUNC", "colunas": ["CHAPA"], "juncoes": {"PSECAO": "OUTER"}}]
+    relatorio = {nome: (arquivo, erro) for nome, arquivo, erro, _ in
+                 sqlmaker_lote.gerar_lote(specs, str(tmp_path / "saida"))}
+    arquivo, erro = relatorio["ok"]
+    assert erro is None and "INNER JOIN PSECAO" in open(arquivo, encoding="utf-8").read()
+    assert relatorio["outer"][0] is None and "OUTER" in relatorio["outer"][1]
+
+
+def test_falha_de_gravacao_nao_derruba_o_lote(tmp_path, compilador):
+    bloqueio = _arquivo(tmp_path, "saida", "")   # arquivo no lugar da pasta
+    specs = [{"nome": "a", "tabela": "PFUNC", "colunas": ["CHAPA"]},
+             {"nome": "b", "tabela": "PFUNC", "colunas": ["CODSECAO"]}]
+    relatorio = sqlmaker_lote.gerar_lote(specs, bloqueio)
+    assert [(nome, arquivo) for nome, arquivo, _, _ in relatorio] == [("a", None), ("b", None)]
+    assert all(erro.startswith(("FileExistsError", "NotADirectoryError")) for _, _, erro, _ in relatorio)
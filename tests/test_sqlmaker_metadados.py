@@ -0,0 +1,108 @@
+import re
+
+import pandas as pd
+import pytest
+
+from sqlmaker_metadados import BuscaCampos, GrafoJoins, IndiceMetadados, normalizar_texto
+
+
+def _indice(relacoes, campos):
+    df_campos = pd.DataFrame(
+        [(t, c, f"{t}.{c}") for t, cs in campos.items() for c in cs],
+        columns=["TABELA", "CAMPO", "DESCRIÇÃO"])
+    df_sistemas = pd.DataFrame({"CODSISTEMA": ["P"], "DESCRICAO": ["Folha"]})
+    df_relacoes = pd.DataFrame(relacoes, columns=["MASTERTABLE", "MASTERFIELD", "CHILDTABLE", "CHILDFIELD"])
+    return IndiceMetadados(df_campos, df_sistemas, df_relacoes)
+
+
+RELACOES = [
+    ("PFUNC", "CODCOLIGADA,CODSECAO", "PSECAO", "CODCOLIGADA,CODIGO"),
+    ("PSECAO", "CODCOLIGADA,CODIGO", "PSEMCAMPOS", "CODCOLIGADA,CODSECAO"),
+    ("PSEMCAMPOS", "CODCOLIGADA,ID", "PNETA", "CODCOLIGADA,IDPAI"),
+    ("GCOLIGADA", "CODCOLIGADA", "PFUNC", "CODCOLIGADA"),
+    ("GCOLIGADA", "CODCOLIGADA", "PSOLTA", "CODCOLIGADA"),
+]
+CAMPOS = {"PFUNC": ["CHAPA", "NOME"], "PSECAO": ["CODIGO", "DESCRICAO"], "PNETA": ["ID"],
+          "GCOLIGADA": ["CODCOLIGADA"], "PSOLTA": ["ID"]}
+
+
+def test_alcancaveis_usa_so_arestas_fortes():
+    indice = _indice(RELACOES, CAMPOS)
+    assert indice.grafo.alcancaveis("PFUNC", 3) == ["PNETA", "PSECAO"]
+    assert indice.grafo.ligacoes_fracas("PFUNC", 3) == set()
+
+
+def test_origem_so_com_arestas_fracas_usa_as_fracas():
+    indice = _indice(RELACOES, CAMPOS)
+    assert indice.grafo.alcancaveis("PSOLTA", 2) == ["GCOLIGADA", "PFUNC"]
+    assert indice.grafo.ligacoes_fracas("PSOLTA", 2) == {"GCOLIGADA", "PFUNC"}
+
+
+def test_tabela_sem_campos_nao_e_oferecida_mas_serve_de_caminho():
+    indice = _indice(RELACOES, CAMPOS)
+    assert "PSEMCAMPOS" not in indice.grafo.alcancaveis("PFUNC", 3)
+    passos, sem_caminho = indice.grafo.conectar("PFUNC", ["PNETA"], 3)
+    assert sem_caminho == []
+    assert [(p.tabela, p.intermediaria) for p in passos] == [
+        ("PSECAO", True), ("PSEMCAMPOS", True), ("PNETA", False)]
+
+
+def test_grafo_sem_lista_de_tabelas_oferece_todas():
+    grafo = GrafoJoins({("A", "B"): [("ID", "IDA")], ("B", "C"): [("ID", "IDB")]})
+    assert grafo.alcancaveis("A", 2) == ["B", "C"]
+
+
+def test_normalizar_texto():
+    assert normalizar_texto("Salário Base") == "salario base"
+
+
+def test_toda_tabela_alcancavel_tem_campos(indice_real):
+    for tabela in indice_real.tabelas_do_sistema("P"):
+        for alcancavel in indice_real.grafo.alcancaveis(tabela, 2):
+            assert indice_real.campos(alcancavel), f"{tabela} → {alcancavel} sem campos"
+
+
+# Busca: índice de trigramas contra a varredura direta de CAMPOS
+def _busca_direta(tabelas, campos, descricoes, consulta):
+    palavras = re.compile(r"[a-z0-9]+")
+    termos = list(dict.fromkeys(palavras.findall(normalizar_texto(consulta))))
+    pontos = []
+    for campo, desc in zip(campos, descricoes):
+        campo, desc = normalizar_texto(campo), normalizar_texto(desc or "")
+        linha = []
+        for termo in termos:
+            p_campo = (5 if campo == termo else 3 if campo.startswith(termo) else 2) if termo in campo else 0
+            ps = palavras.findall(desc)
+            p_desc = (3 if termo in ps else 2 if any(p.startswith(termo) for p in ps) else 1) if termo in desc else 0
+            linha.append(max(p_campo, p_desc))
+        pontos.append(linha)
+    todos = {i: sum(p) for i, p in enumerate(pontos) if all(p)}
+    if not todos:
+        todos = {i: sum(p) for i, p in enumerate(pontos) if sum(p)}
+    return {(tabelas[i], campos[i]): float(t) for i, t in todos.items()}
+
+
+CATALOGO = [
+    ("PFUNC", "CHAPA", "Chapa do funcionário"),
+    ("PFUNC", "SALARIO", "Salário base"),
+    ("PFUNC", "DATAADMISSAO", "Data de admissão"),
+    ("PFFINANC", "VALOR", "Valor do evento no salário"),
+    ("PFFINANC", "CODEVENTO", "Código do evento"),
+    ("PSECAO", "DESCRICAO", "Descrição da seção"),
+    ("PEVENTO", "SALARIOBASE", None),
+]
+
+
+@pytest.mark.parametrize("consulta", ["salario", "Salário base", "evento", "cod", "ção",
+                                      "admissao chapa", "xyz", "sa"])
+def test_busca_igual_a_varredura(consulta):
+    tabelas, campos, descricoes = map(list, zip(*CATALOGO))
+    resultado = BuscaCampos(tabelas, campos, descricoes).buscar(consulta, limite=100)
+    obtido = {(t, c): float(p) for t, c, p in zip(resultado["TABELA"], resultado["CAMPO"], resultado["PONTOS"])}
+    assert obtido == _busca_direta(tabelas, campos, descricoes, consulta)
+    assert list(resultado["PONTOS"]) == sorted(resultado["PONTOS"], reverse=True)
+
+
+def test_busca_restrita_a_tabelas():
+    busca = BuscaCampos(*map(list, zip(*CATALOGO)))
+    assert set(busca.buscar("salario", tabelas={"PFUNC"})["TABELA"]) == {"PFUNC"}